@@ -0,0 +1,197 @@
+"""
+Geradores determinísticos de arquivos sintéticos EXTRATO e TRICARD.
+
+Os registros são montados coluna a coluna como uma matriz de bytes, usando as
+posições do registro de layouts (scripts/layouts.py); a mesma semente sempre
+gera o mesmo arquivo. Uma fração `error_rate` das linhas recebe um campo
+inválido (valor monetário / data), para medir também o caminho de erro.
+"""
+
+import numpy as np
+
+from scripts.layouts import LAYOUTS
+
+SPACE = ord(' ')
+NEWLINE = b'\r\n'
+
+# Lojas distintas por arquivo, como em um extrato real (dimensão loja pequena)
+STORES = 50
+
+
+def _digits(rng, n, width):
+    return rng.integers(ord('0'), ord('9') + 1, size=(n, width), dtype=np.uint8)
+
+
+def _text(values, width):
+    """Lista/array de str -> matriz (n x width) de bytes, alinhada à esquerda."""
+    return np.array([v.ljust(width)[:width] for v in values], dtype=f'S{width}').view(np.uint8).reshape(-1, width)
+
+
+def _choice(rng, n, options, width):
+    return _text(options, width)[rng.integers(0, len(options), size=n)]
+
+
+def _numbers(values, width):
+    """Inteiros -> matriz de dígitos com zeros à esquerda."""
+    values = np.asarray(values, dtype=np.int64)
+    powers = 10 ** np.arange(width - 1, -1, -1, dtype=np.int64)
+    return ((values[:, None] // powers) % 10 + ord('0')).astype(np.uint8)
+
+
+def _dates(rng, n, order):
+    """Datas válidas de 2025 como AAAAMMDD (order='ymd') ou DDMMAAAA (order='dmy')."""
+    day = rng.integers(1, 29, size=n)
+    month = rng.integers(1, 13, size=n)
+    year = np.full(n, 2025)
+    if order == 'ymd':
+        return _numbers(year * 10000 + month * 100 + day, 8)
+    return _numbers(day * 1000000 + month * 10000 + year, 8)
+
+
+def _amounts(rng, n, width, high=10 ** 7):
+    return _numbers(rng.integers(0, high, size=n), width)
+
+
+def _assemble(n, width, columns):
+    """Monta a matriz de registros a partir de {(start, end): bloco}."""
+    matrix = np.full((n, width), SPACE, dtype=np.uint8)
+    for (start, end), block in columns.items():
+        matrix[:, start:end] = block
+    return matrix
+
+
+def _to_bytes(lines):
+    """Junta header, matrizes de registros e trailer em um único buffer."""
+    parts = []
+    for line in lines:
+        if isinstance(line, bytes):
+            parts.append(line + NEWLINE)
+        elif len(line):
+            newline = np.frombuffer(NEWLINE * len(line), dtype=np.uint8).reshape(len(line), -1)
+            parts.append(np.hstack([line, newline]).tobytes())
+    return b''.join(parts)
+
+
+def _error_rows(rng, n, error_rate):
+    return np.flatnonzero(rng.random(n) < error_rate)
+
+
+def extrato_cv_records(n, rng, error_rate=0.0):
+    """Matriz com n registros CV válidos para o layout 002.0a."""
+    fields = {field.name: (field.start, field.end) for field in LAYOUTS[('EXTRATO', 'CV', '002.0a')]}
+    store = rng.integers(0, STORES, size=n)
+    store_ids = rng.integers(10 ** 13, 10 ** 14, size=STORES)
+
+    columns = {
+        fields['codigo_registro']: _text(['CV'], 2).repeat(n, axis=0),
+        fields['identificacao_loja']: _numbers(store_ids[store], 15),
+        fields['nsu_host_transacao']: _digits(rng, n, 12),
+        fields['data_transacao']: _dates(rng, n, 'ymd'),
+        fields['horario_transacao']: _digits(rng, n, 6),
+        fields['tipo_lancamento']: _choice(rng, n, ['0', '1', '2'], 1),
+        fields['data_lancamento']: _dates(rng, n, 'ymd'),
+        fields['tipo_produto']: _choice(rng, n, ['C', 'D', 'V'], 1),
+        fields['meio_captura']: _choice(rng, n, list('12345689'), 1),
+        fields['numero_cartao']: _digits(rng, n, 19),
+        fields['numero_parcela']: _numbers(rng.integers(0, 13, size=n), 2),
+        fields['numero_total_parcelas']: _numbers(rng.integers(0, 13, size=n), 2),
+        fields['nsu_host_parcela']: _digits(rng, n, 12),
+        fields['banco']: _digits(rng, n, 3),
+        fields['agencia']: _digits(rng, n, 6),
+        fields['conta']: _digits(rng, n, 11),
+        fields['codigo_autorizacao']: _digits(rng, n, 12),
+        fields['codigo_bandeira']: _choice(rng, n, ['001', '002', '007'], 3),
+        fields['codigo_produto']: _numbers(rng.integers(1, 14, size=n), 3),
+        fields['tipo_transacao']: _text(['00'], 2).repeat(n, axis=0),
+        fields['sigla_pais']: _text(['BRA'], 3).repeat(n, axis=0),
+        fields['codigo_ec_venda']: _numbers(store_ids[store] % 10 ** 9, 9),
+        fields['codigo_ec_pagamento']: _numbers(store_ids[store] % 10 ** 9, 9),
+        fields['cnpj_ec_pagamento']: _numbers(store_ids[store], 14),
+        fields['data_vencimento_original']: _dates(rng, n, 'ymd'),
+        fields['indicador_deb_balance']: _choice(rng, n, ['D', ' '], 1),
+        fields['indicador_reenvio']: _choice(rng, n, ['R', ' '], 1),
+        fields['nsu_origem']: _digits(rng, n, 6),
+        fields['numero_operacao_recebivel']: _digits(rng, n, 20),
+        fields['sequencial_operacao_recebivel']: _text(['01'], 2).repeat(n, axis=0),
+        fields['tipo_operacao_recebivel']: _choice(rng, n, ['C', 'G', 'P', ' '], 1),
+        fields['nseq']: _numbers(np.arange(2, n + 2), 6),
+    }
+    for field in LAYOUTS[('EXTRATO', 'CV', '002.0a')]:
+        if field.type == 'cents':
+            columns[(field.start, field.end)] = _amounts(rng, n, field.end - field.start)
+
+    matrix = _assemble(n, fields['nseq'][0] + 6, columns)
+    bad = _error_rows(rng, n, error_rate)
+    start, end = fields['valor_bruto_venda']
+    matrix[bad, start:end] = _text(['12A34'], end - start)
+    return matrix
+
+
+def extrato_file(rows, seed=0, error_rate=0.0):
+    """Conteúdo de um arquivo EXTRATO (A0 + rows x CV + A9)."""
+    rng = np.random.default_rng(seed)
+    header = (
+        'A0' + '002.0a' + '20250621' + '120000' + '000248' + 'UNICA'.ljust(30)
+        + '0001' + '000051309' + 'N' + '000001'
+    ).encode('latin-1')
+    trailer = ('A9' + f'{rows + 2:06d}' + f'{rows + 2:06d}').encode('latin-1')
+    return _to_bytes([header, extrato_cv_records(rows, rng, error_rate), trailer])
+
+
+# Tipo de arquivo TRICARD -> (header, registros de detalhe, trailer)
+TRICARD_RECORDS = {
+    'VENDA': ('002', ['008', '012'], '028'),
+    'FINANCEIRO': ('030', ['034', '035', '036'], '052'),
+    'SALDO': ('060', ['062'], '069'),
+}
+
+
+def tricard_records(tipo, n, rng, error_rate=0.0):
+    """Matriz com n registros `tipo`, preenchidos conforme o tipo de cada campo."""
+    fields = [field for field in LAYOUTS[('TRICARD', tipo, 'padrao')] if field.end > field.start]
+    width = max(field.end for field in fields)
+    columns = {(0, 3): _text([tipo], 3).repeat(n, axis=0)}
+    for field in fields:
+        size = field.end - field.start
+        if field.type == 'date':
+            columns[(field.start, field.end)] = _dates(rng, n, 'dmy')
+        elif field.type == 'amount':
+            columns[(field.start, field.end)] = _amounts(rng, n, size)
+        elif field.type == 'int':
+            columns[(field.start, field.end)] = _numbers(rng.integers(1, 13, size=n), size)
+        else:
+            columns[(field.start, field.end)] = _digits(rng, n, size)
+    matrix = _assemble(n, width, columns)
+
+    bad = _error_rows(rng, n, error_rate)
+    for field in fields:
+        if field.type == 'date':
+            matrix[bad, field.start:field.end] = _text(['31022025'], 8)
+        elif field.type == 'amount':
+            matrix[bad, field.start:field.end] = _text(['12A34'], field.end - field.start)
+    return matrix
+
+
+def tricard_file(file_type, rows, seed=0, error_rate=0.0, trailing_blank=False):
+    """Conteúdo de um arquivo TRICARD (header + detalhes intercalados + trailer).
+
+    Com `trailing_blank`, o arquivo termina com duas linhas em branco (uma só
+    com LF e outra com CRLF), que não contam como registros.
+    """
+    rng = np.random.default_rng(seed)
+    header_type, detail_types, trailer_type = TRICARD_RECORDS[file_type]
+
+    # Cada linha recebe um tipo de detalhe; os registros ficam intercalados como no arquivo real
+    kinds = rng.integers(0, len(detail_types), size=rows)
+    blocks = [tricard_records(tipo, int((kinds == i).sum()), rng, error_rate) for i, tipo in enumerate(detail_types)]
+    width = max(block.shape[1] for block in blocks)
+    matrix = np.full((rows, width), SPACE, dtype=np.uint8)
+    for i, block in enumerate(blocks):
+        matrix[kinds == i, :block.shape[1]] = block
+
+    header = (header_type + '21062025').ljust(125).encode('latin-1')
+    trailer = (trailer_type + '0001' + f'{rows + 2:06d}').encode('latin-1')
+    content = _to_bytes([header, matrix, trailer])
+    if trailing_blank:
+        content += b'\n' + NEWLINE
+    return content
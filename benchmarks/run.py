@@ -0,0 +1,204 @@
+"""
+Benchmarks de leitura e validação.
+
+Uso:
+    python -m benchmarks.run --rows 200000 --error-rate 0.0 --repeat 3
+    python -m benchmarks.run --compare benchmarks/results/<resultado_anterior>.json
+
+Cada caso mede o melhor tempo entre `repeat` execuções (linhas/s) e, em uma
+execução separada com tracemalloc, o pico de memória alocada. O resultado é
+gravado em benchmarks/results/ como JSON, com versão do código e das
+bibliotecas, para comparação entre versões.
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.generators import extrato_file, tricard_file
+from scripts.reading_files import ExtratoTransacao
+from scripts.reading_tricard import ExtratoTricard
+from scripts.transform_files import TransformerTrasacoes
+from utils.logger import setup_logger
+
+logger = setup_logger("benchmarks", level=logging.INFO)
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# Loggers de leitura/validação registram uma linha por chamada; silenciados durante as medições
+QUIET_LOGGERS = ['reading_files', 'reading_tricard', 'transform_files', 'layouts']
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'desconhecida'
+
+
+def measure(func, repeat):
+    """Retorna (melhor tempo em s, pico de memória em MB) de func()."""
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings), peak / 1024 / 1024
+
+
+def build_cases(workdir, rows, seed, error_rate):
+    """Gera os arquivos sintéticos e retorna {caso: (função, linhas)}"""
+    extrato_path = os.path.join(workdir, 'EXTRATO_BENCH')
+    with open(extrato_path, 'wb') as f:
+        f.write(extrato_file(rows, seed=seed, error_rate=error_rate))
+
+    # Validação sempre sobre o mesmo DataFrame lido, copiado a cada execução
+    _, df_transacoes, _ = ExtratoTransacao(extrato_path).process_file()
+    df_transacoes['file_name'] = 'EXTRATO_BENCH'
+
+    def validate(transformer):
+        # Sem linhas inválidas a validação tem que chegar ao fim; uma lista é a lista de erros
+        result = transformer.validate_all()
+        assert error_rate or isinstance(result, pd.DataFrame), f"validate_all falhou: {result[:5]}"
+        return result
+
+    def parse_validate():
+        for df_chunk in ExtratoTransacao(extrato_path).iter_chunks():
+            df_chunk['file_name'] = 'EXTRATO_BENCH'
+            validate(TransformerTrasacoes(df_chunk))
+
+    def parse_validate_fused():
+        for df_chunk, blocks in ExtratoTransacao(extrato_path).iter_fused_chunks():
+            df_chunk['file_name'] = 'EXTRATO_BENCH'
+            validate(TransformerTrasacoes(df_chunk, byte_columns=blocks))
+
+    cases = {
+        'extrato_process_file': (lambda: ExtratoTransacao(extrato_path).process_file(), rows),
+        'extrato_iter_chunks': (lambda: sum(len(c) for c in ExtratoTransacao(extrato_path).iter_chunks()), rows),
+        'extrato_validate_all': (lambda: validate(TransformerTrasacoes(df_transacoes.copy())), rows),
+        'extrato_parse_validate': (parse_validate, rows),
+        'extrato_parse_validate_fused': (parse_validate_fused, rows),
+    }
+
+    for file_type in ('VENDA', 'FINANCEIRO', 'SALDO'):
+        path = os.path.join(workdir, f'TRICARD_{file_type}_BENCH')
+        with open(path, 'wb') as f:
+            f.write(tricard_file(file_type, rows, seed=seed, error_rate=error_rate))
+        cases[f'tricard_{file_type.lower()}_process_file'] = (
+            lambda path=path, file_type=file_type: ExtratoTricard(path, file_type).process_file(), rows
+        )
+
+    # Linhas em branco depois do trailer não podem quebrar a conferência de contagens
+    path = os.path.join(workdir, 'TRICARD_VENDA_BLANK_BENCH')
+    with open(path, 'wb') as f:
+        f.write(tricard_file('VENDA', rows, seed=seed, error_rate=error_rate, trailing_blank=True))
+    cases['tricard_venda_trailing_blank_process_file'] = (
+        lambda: ExtratoTricard(path, 'VENDA').process_file(), rows
+    )
+    return cases
+
+
+def run(rows, seed, error_rate, repeat, selected=None):
+    workdir = tempfile.mkdtemp(prefix='bench_')
+    quiet = {name: logging.getLogger(name).level for name in QUIET_LOGGERS}
+    try:
+        for name in QUIET_LOGGERS:
+            logging.getLogger(name).setLevel(logging.ERROR)
+
+        results = {}
+        for name, (func, n) in build_cases(workdir, rows, seed, error_rate).items():
+            if selected and name not in selected:
+                continue
+            seconds, peak_mb = measure(func, repeat)
+            results[name] = {
+                'rows': n,
+                'seconds': round(seconds, 4),
+                'rows_per_s': round(n / seconds, 1) if seconds else None,
+                'peak_mb': round(peak_mb, 1),
+            }
+            logger.info(f"{name}: {n / seconds:,.0f} linhas/s, pico {peak_mb:.1f} MB")
+        return results
+    finally:
+        for name, level in quiet.items():
+            logging.getLogger(name).setLevel(level)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def save(results, args, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    revision = _git_revision()
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'revision': revision,
+        'params': {'rows': args.rows, 'seed': args.seed, 'error_rate': args.error_rate, 'repeat': args.repeat},
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.machine(),
+        },
+        'results': results,
+    }
+    path = os.path.join(output_dir, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{revision}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Resultados gravados em {path}")
+    return path
+
+
+def compare(results, baseline_path):
+    """Mostra a variação de linhas/s e pico de memória em relação a um resultado anterior."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    logger.info(f"Comparando com {baseline_path} (revisão {baseline.get('revision')})")
+    for name, current in results.items():
+        previous = baseline['results'].get(name)
+        if not previous:
+            continue
+        speed = current['rows_per_s'] / previous['rows_per_s'] if previous['rows_per_s'] else float('nan')
+        memory = current['peak_mb'] - previous['peak_mb']
+        logger.info(f"{name}: {speed:.2f}x linhas/s, {memory:+.1f} MB de pico")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de leitura e validação de arquivos")
+    parser.add_argument('--rows', type=int, default=100000, help="Registros de detalhe por arquivo")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fração de linhas com campo inválido")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='*', help="Casos a executar (padrão: todos)")
+    parser.add_argument('--output', default=RESULTS_DIR, help="Diretório dos resultados")
+    parser.add_argument('--compare', help="Arquivo de resultado anterior para comparação")
+    args = parser.parse_args()
+
+    results = run(args.rows, args.seed, args.error_rate, args.repeat, args.only)
+    save(results, args, args.output)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
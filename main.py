@@ -1,14 +1,26 @@
 from ftplib import FTP_TLS
+import argparse
+import multiprocessing
 import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import datetime
 
 from utils.logger import setup_logger
 from utils.connection_db import (
-    get_file_processing_status
+    DB_POOL_MAX,
+    claim_file,
+    close_pools,
+    get_file_processing_status,
+    has_pending_refresh,
+    init_pool,
+    release_claim
 )
+from utils.pipeline import Channel, StageStats, start_stage
 from utils.s3_utils import list_s3_files, download_s3_file, upload_s3_file
 from scripts.leitor_extratos import (
     analyze_files_to_process,
+    iter_parsed_chunks,
     process_file
 )
 
@@ -27,8 +39,18 @@ else:
     log_directory = os.path.join(local_directory, "outputs", "log")
     os.makedirs(log_directory, exist_ok=True)
     log_filename = os.path.join(log_directory, f"log_{datetime.now().strftime('%d%m%y_%H_%M_%S')}.txt")
+# Workers do ProcessPoolExecutor (spawn) reimportam este módulo: escrevem no mesmo log do processo pai
+log_filename = os.environ.setdefault('MAIN_LOG_FILE', log_filename)
 logger = setup_logger("main", level=20, log_file=log_filename)  # 20 = INFO level
 
+# Arquivos processados em paralelo (1 = sequencial); sobrescrito por --workers
+PROCESS_WORKERS = int(os.getenv('PROCESS_WORKERS', '1'))
+# Com 1 worker: download, parse/validação e carga em estágios sobrepostos (0 = um arquivo por vez)
+PROCESS_PIPELINE = os.getenv('PROCESS_PIPELINE', '1') != '0'
+# Arquivos baixados à frente do parse e blocos validados à frente da carga
+PIPELINE_FETCH_AHEAD = int(os.getenv('PIPELINE_FETCH_AHEAD', '2'))
+PIPELINE_CHUNKS_AHEAD = int(os.getenv('PIPELINE_CHUNKS_AHEAD', '2'))
+
 connection_database = {
     'host': os.getenv('DB_HOST'),
     'user': os.getenv('DB_USER'),
@@ -37,12 +59,242 @@ connection_database = {
     'port': os.getenv('DB_PORT')
 }
 
-def main():
+def fetch_file(file_name, s3_files, sftp_files, ftps, ftps_lock):
+    """Baixa o arquivo do S3 (ou do SFTP) e retorna o caminho local; None em caso de falha"""
+    # Na Lambda, usar /tmp para arquivos temporários
+    if os.path.exists('/var/task'):  # Detecta se está rodando na Lambda
+        local_file_path = os.path.join("/tmp", file_name)
+    else:
+        local_file_path = os.path.join(local_directory, file_name)
+
+    # Tenta obter do S3 primeiro
+    if file_name in s3_files:
+        key = f"{S3_PREFIX}/{file_name}".lstrip('/')
+        if download_s3_file(S3_BUCKET, key, local_file_path):
+            logger.info(f"Arquivo baixado do S3 para processamento: {file_name}")
+            return local_file_path
+        logger.error(f"Falha ao baixar do S3: {file_name}")
+        return None
+    # Se não estiver no S3, tenta baixar do SFTP (uma transferência por vez na mesma conexão)
+    elif ftps and file_name in sftp_files:
+        try:
+            with ftps_lock, open(local_file_path, 'wb') as local_file:
+                ftps.retrbinary(f'RETR {file_name}', local_file.write)
+            logger.info(f"Arquivo baixado do SFTP para processamento: {file_name}")
+            return local_file_path
+        except Exception as e:
+            logger.error(f"Erro ao baixar arquivo do SFTP: {file_name} - {e}")
+            return None
+    else:
+        logger.warning(f"Arquivo não encontrado no S3 nem no SFTP: {file_name}")
+        return None
+
+# Retorno de claim_and_fetch para arquivo reservado por outro worker
+NOT_CLAIMED = object()
+
+def claim_and_fetch(file_name, s3_files, sftp_files, ftps, ftps_lock):
+    """Reserva o arquivo em controle_arquivos e baixa; retorna o caminho local,
+    None em falha ou NOT_CLAIMED se outro worker já está com ele"""
+    try:
+        if not claim_file(connection_database, file_name):
+            logger.info(f"Arquivo {file_name} reservado por outro worker; ignorado nesta execução")
+            return NOT_CLAIMED
+    except Exception as e:
+        logger.error(f"Erro ao reservar arquivo {file_name}: {e}")
+        return None
+
+    local_file_path = fetch_file(file_name, s3_files, sftp_files, ftps, ftps_lock)
+    if local_file_path is None:
+        # Sem arquivo não há carga: a reserva vira ERRO em vez de esperar o prazo vencer
+        try:
+            release_claim(connection_database, file_name, "Falha ao baixar o arquivo")
+        except Exception as e:
+            logger.error(f"Erro ao liberar reserva do arquivo {file_name}: {e}")
+    return local_file_path
+
+def run_processor(file_name, local_file_path, chunks=None):
+    """Roteia o arquivo para o processador correto; cada arquivo usa sua própria conexão (do pool) e transação
+
+    chunks: saída do estágio de parse (parse_source) quando rodando em pipeline.
+    """
+    # Caminho remoto alvo (S3)
+    remote_path = f"s3://{S3_BUCKET}/{S3_PREFIX}/{file_name}"
+
+    if "TRICARD" in file_name:
+        from scripts.leitor_tricard import process_tricard_file
+        return process_tricard_file(file_name, local_file_path, remote_path, connection_database,
+                                    is_tryout=False, parsed=chunks)
+    return process_file(file_name, local_file_path, remote_path, connection_database,
+                        is_tryout=False, chunks=chunks)
+
+def parse_source(file_name, local_file_path):
+    """Parse e validação do arquivo, sem banco: o que run_processor recebe em chunks"""
+    if "TRICARD" in file_name:
+        from scripts.leitor_tricard import iter_parsed_tricard
+        return iter_parsed_tricard(file_name, local_file_path)
+    return iter_parsed_chunks(file_name, local_file_path)
+
+def finish_file(file_name, local_file_path, success):
+    if not success:
+        if os.path.exists(local_file_path):
+            os.remove(local_file_path)
+        logger.error(f"Erro ao processar arquivo {file_name}")
+    return success
+
+def process_files(files_to_process, s3_files, sftp_files, ftps, workers):
+    """Baixa e processa os arquivos; retorna (arquivos processados, falhas).
+
+    Cada arquivo é reservado em controle_arquivos (claim_and_fetch) antes do
+    download; os reservados por outra execução ficam de fora, sem contar como falha.
+
+    Com 1 worker os arquivos passam pelo pipeline em estágios (process_files_pipeline).
+    Com workers > 1 os downloads rodam em threads e o processamento em um pool
+    de processos (threads na Lambda, que não oferece multiprocessing).
+    """
+    ftps_lock = threading.Lock()
+    processed = []
+    failed = 0
+
+    if workers <= 1 and PROCESS_PIPELINE:
+        return process_files_pipeline(files_to_process, s3_files, sftp_files, ftps)
+
+    if workers <= 1:
+        for file_name in files_to_process:
+            local_file_path = claim_and_fetch(file_name, s3_files, sftp_files, ftps, ftps_lock)
+            if local_file_path is NOT_CLAIMED:
+                continue
+            logger.info(f"Processando arquivo: {file_name}")
+            if local_file_path is None:
+                failed += 1
+                continue
+            try:
+                success = run_processor(file_name, local_file_path)
+            except Exception as e:
+                logger.error(f"Falha ao processar {file_name}: {e}")
+                success = False
+            if finish_file(file_name, local_file_path, success):
+                processed.append(file_name)
+            else:
+                failed += 1
+        return processed, failed
+
+    pool_class = ThreadPoolExecutor if os.path.exists('/var/task') else ProcessPoolExecutor
+    logger.info(f"Processando {len(files_to_process)} arquivos com {workers} workers ({pool_class.__name__})")
+
+    # spawn: um fork com as threads de download ativas pode herdar locks (logging, SSL, pool) travados
+    pool_kwargs = {'mp_context': multiprocessing.get_context('spawn')} if pool_class is ProcessPoolExecutor else {}
+
+    with ThreadPoolExecutor(max_workers=workers) as downloads, pool_class(max_workers=workers, **pool_kwargs) as processors:
+        download_futures = {
+            downloads.submit(claim_and_fetch, file_name, s3_files, sftp_files, ftps, ftps_lock): file_name
+            for file_name in files_to_process
+        }
+        process_futures = {}
+        for future in as_completed(download_futures):
+            file_name = download_futures[future]
+            local_file_path = future.result()
+            if local_file_path is NOT_CLAIMED:
+                continue
+            if local_file_path is None:
+                failed += 1
+                continue
+            logger.info(f"Processando arquivo: {file_name}")
+            process_futures[processors.submit(run_processor, file_name, local_file_path)] = (file_name, local_file_path)
+
+        for future in as_completed(process_futures):
+            file_name, local_file_path = process_futures[future]
+            try:
+                success = future.result()
+            except Exception as e:
+                logger.error(f"Falha no worker ao processar {file_name}: {e}")
+                success = False
+            if finish_file(file_name, local_file_path, success):
+                processed.append(file_name)
+            else:
+                failed += 1
+
+    return processed, failed
+
+def fetch_stage(fetched, files_to_process, s3_files, sftp_files, ftps, stats):
+    ftps_lock = threading.Lock()
+    for file_name in files_to_process:
+        try:
+            local_file_path = claim_and_fetch(file_name, s3_files, sftp_files, ftps, ftps_lock)
+        except Exception as e:
+            logger.error(f"Erro ao baixar arquivo {file_name}: {e}")
+            local_file_path = None
+        if local_file_path is NOT_CLAIMED:
+            continue
+        stats.items += 1
+        fetched.put((file_name, local_file_path))
+
+def parse_stage(parsed, fetched, stats, load_stats):
+    for file_name, local_file_path in fetched:
+        if local_file_path is None:
+            parsed.put((file_name, None, None))
+            continue
+        # Blocos do arquivo seguem para a carga à medida que ficam prontos
+        chunks = Channel(PIPELINE_CHUNKS_AHEAD, producer=stats, consumer=load_stats)
+        parsed.put((file_name, local_file_path, chunks))
+        try:
+            for item in parse_source(file_name, local_file_path):
+                chunks.put(item)
+        except Exception as e:
+            chunks.fail(e)
+        finally:
+            chunks.close()
+        stats.items += 1
+
+def process_files_pipeline(files_to_process, s3_files, sftp_files, ftps):
+    """Download, parse/validação e carga no banco em estágios ligados por filas limitadas.
+
+    O download do próximo arquivo e a validação dos próximos blocos acontecem
+    enquanto o bloco atual é gravado; as filas limitam quantos arquivos e
+    blocos ficam à frente da carga (PIPELINE_FETCH_AHEAD / PIPELINE_CHUNKS_AHEAD).
+    """
+    stats = {name: StageStats(name) for name in ('download', 'parse', 'carga')}
+    fetched = Channel(PIPELINE_FETCH_AHEAD, producer=stats['download'], consumer=stats['parse'])
+    parsed = Channel(1, producer=stats['parse'], consumer=stats['carga'])
+    processed = []
+    failed = 0
+
+    start_stage(stats['download'], fetch_stage, fetched, files_to_process, s3_files, sftp_files, ftps,
+                stats['download'])
+    start_stage(stats['parse'], parse_stage, parsed, fetched, stats['parse'], stats['carga'])
+
+    load_stats = stats['carga']
+    load_stats.start()
+    for file_name, local_file_path, chunks in parsed:
+        if local_file_path is None:
+            failed += 1
+            continue
+        logger.info(f"Processando arquivo: {file_name}")
+        try:
+            success = run_processor(file_name, local_file_path, chunks)
+        except Exception as e:
+            logger.error(f"Falha ao processar {file_name}: {e}")
+            success = False
+        finally:
+            # Libera o parse para o próximo arquivo mesmo se a carga parou no meio
+            chunks.drain()
+        load_stats.items += 1
+        if finish_file(file_name, local_file_path, success):
+            processed.append(file_name)
+        else:
+            failed += 1
+    load_stats.finish()
+
+    for stage in stats.values():
+        logger.info(f"Pipeline {stage}")
+    return processed, failed
+
+def main(workers=None):
     sftp_files = []
     ftps = None
     processed = 0
     failed = 0
     total = 0
+    workers = max(1, workers or PROCESS_WORKERS)
 
     try:
         try:
@@ -67,6 +319,8 @@ def main():
         s3_files = list_s3_files(S3_BUCKET, S3_PREFIX)
         logger.info(f"Arquivos encontrados no S3: {len(s3_files)}")
 
+        # Uma conexão por worker (threads na Lambda); processos filhos criam o próprio pool
+        init_pool(connection_database, maxconn=max(DB_POOL_MAX, workers))
         db_status = get_file_processing_status(**connection_database)
         logger.info(f"Arquivos registrados no banco: {len(db_status)}")
 
@@ -82,66 +336,17 @@ def main():
                 logger.warning(f"- {report['file']}: {report['message']}")
 
         total = len(files_to_process)
+        processed_files, failed = process_files(files_to_process, s3_files, sftp_files, ftps, workers)
+        processed = len(processed_files)
 
-        for file_name in files_to_process:
-            logger.info(f"Processando arquivo: {file_name}")
-
-            # Na Lambda, usar /tmp para arquivos temporários
-            if os.path.exists('/var/task'):  # Detecta se está rodando na Lambda
-                local_file_path = os.path.join("/tmp", file_name)
-            else:
-                local_file_path = os.path.join(local_directory, file_name)
-
-            # Tenta obter do S3 primeiro
-            if file_name in s3_files:
-                key = f"{S3_PREFIX}/{file_name}".lstrip('/')
-                if download_s3_file(S3_BUCKET, key, local_file_path):
-                    logger.info(f"Arquivo baixado do S3 para processamento: {file_name}")
-                else:
-                    logger.error(f"Falha ao baixar do S3: {file_name}")
-                    failed += 1
-                    continue
-            # Se não estiver no S3, tenta baixar do SFTP
-            elif ftps and file_name in sftp_files:
-                try:
-                    with open(local_file_path, 'wb') as local_file:
-                        ftps.retrbinary(f'RETR {file_name}', local_file.write)
-                    logger.info(f"Arquivo baixado do SFTP para processamento: {file_name}")
-                except Exception as e:
-                    logger.error(f"Erro ao baixar arquivo do SFTP: {file_name} - {e}")
-                    failed += 1
-                    continue
-            else:
-                logger.warning(f"Arquivo não encontrado no S3 nem no SFTP: {file_name}")
-                failed += 1
-                continue
-
-            # Caminho remoto alvo (S3)
-            remote_path = f"s3://{S3_BUCKET}/{S3_PREFIX}/{file_name}"
-
-            # Rotear para o processador correto
-            if "TRICARD" in file_name:
-                from scripts.leitor_tricard import process_tricard_file
-                success = process_tricard_file(file_name, local_file_path, remote_path, connection_database, is_tryout=False)
-            else:
-                success = process_file(file_name, local_file_path, remote_path, connection_database, is_tryout=False)
-
-            if success:
-                processed += 1
-            else:
-                failed += 1
-                if os.path.exists(local_file_path):
-                    os.remove(local_file_path)
-                logger.error(f"Erro ao processar arquivo {file_name}")
-
-        # Refresh conciliação se houve processamento com sucesso
-        if processed > 0:
-            try:
+        # Refresh conciliação dos arquivos ainda não cobertos (desta execução ou de um refresh que falhou)
+        try:
+            if processed > 0 or has_pending_refresh(connection_database):
                 from scripts.refresh_conciliacao import full_refresh
-                refresh_result = full_refresh(connection_database)
+                refresh_result = full_refresh(connection_database, incremental=True)
                 logger.info(f"Refresh conciliação: {refresh_result}")
-            except Exception as e:
-                logger.error(f"Erro no refresh conciliação: {e}")
+        except Exception as e:
+            logger.error(f"Erro no refresh conciliação: {e}")
 
     except Exception as e:
         logger.error(f"Erro ao executar o processo: {e}")
@@ -152,7 +357,10 @@ def main():
                 ftps.quit()
             except Exception:
                 pass
+        close_pools()
 
+    if total - processed - failed:
+        logger.info(f"{total - processed - failed} arquivos ignorados (reservados por outra execução)")
     return {"processed": processed, "failed": failed, "total": total}
 
 def lambda_handler(event, context):
@@ -163,3 +371,10 @@ def lambda_handler(event, context):
             f"Processamento com falhas: {result['failed']}/{result['total']} arquivos falharam"
         )
     return {"status": "ok", **result}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sincroniza e processa os arquivos EXTRATO/TRICARD")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Arquivos processados em paralelo (padrão: PROCESS_WORKERS ou 1)")
+    args = parser.parse_args()
+    logger.info(f"Resultado: {main(workers=args.workers)}")
@@ -21,16 +21,8 @@ const pool = new Pool({
 app.get('/api/simulation-data', async (req, res) => {
   try {
     const query = `
-      WITH ultimas_transacoes AS (
-        SELECT 
-          nsu_host_transacao,
-          numero_parcela,
-          MAX(created_at) AS max_created_at
-        FROM unica_transactions.transacoes
-        WHERE data_transacao >= CURRENT_DATE - INTERVAL '12 months'
-        GROUP BY nsu_host_transacao, numero_parcela
-      ),
-      deduplicated_stats AS (
+      WITH deduplicated_stats AS (
+        -- Latest row per parcel, maintained by the loader in transacoes_current
         SELECT 
           TO_CHAR(t.data_transacao, 'YYYY-MM') as mes,
           t.codigo_bandeira as bandeira,
@@ -44,11 +36,10 @@ app.get('/api/simulation-data', async (req, res) => {
             WHEN t.numero_total_parcelas <> '0' THEN t.valor_desconto_parcela
             ELSE t.valor_desconto
           END AS mdr_cobrado
-        FROM unica_transactions.transacoes t
-        INNER JOIN ultimas_transacoes u
-          ON t.nsu_host_transacao = u.nsu_host_transacao
-          AND t.numero_parcela = u.numero_parcela
-          AND t.created_at = u.max_created_at
+        FROM unica_transactions.transacoes_current c
+        INNER JOIN unica_transactions.transacoes t
+          ON t.id = c.transacao_id
+        WHERE c.data_transacao >= CURRENT_DATE - INTERVAL '12 months'
       ),
       categorized_stats AS (
         SELECT
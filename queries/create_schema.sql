@@ -23,11 +23,20 @@ CREATE TABLE IF NOT EXISTS unica_transactions.controle_arquivos (
     status_processamento varchar NOT NULL,
     erro_processamento text,
     arquivo_google_drive_path varchar,
+    -- Prazo da reserva de um worker (status PROCESSANDO); vencido, o arquivo pode ser retomado
+    reserva_expira_em timestamp,
+    -- Refresh da conciliação que cobriu a última carga do arquivo (NULL = pendente)
+    refreshed_at timestamp,
     created_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
     updated_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
     CONSTRAINT check_status_valido CHECK (status_processamento IN ('SUCESSO', 'ERRO', 'PROCESSANDO'))
 );
 
+-- Bancos criados antes da reserva de arquivos
+ALTER TABLE unica_transactions.controle_arquivos ADD COLUMN IF NOT EXISTS reserva_expira_em timestamp;
+-- Bancos criados antes da pendência de refresh por arquivo
+ALTER TABLE unica_transactions.controle_arquivos ADD COLUMN IF NOT EXISTS refreshed_at timestamp;
+
 CREATE TABLE IF NOT EXISTS unica_transactions.tempo (
     id uuid PRIMARY KEY DEFAULT uuid_generate_v4(),
     data date UNIQUE NOT NULL,
@@ -123,6 +132,99 @@ CREATE TABLE IF NOT EXISTS unica_transactions.transacoes (
     CONSTRAINT fk_arquivo FOREIGN KEY (file_id) REFERENCES unica_transactions.controle_arquivos(id)
 );
 
+-- Staging da carga em lote (EXTRATO_LOAD_MODE=staging): sem WAL, índices só por arquivo;
+-- as linhas de cada arquivo são removidas na mesma transação que as move para transacoes
+CREATE UNLOGGED TABLE IF NOT EXISTS unica_transactions.transacoes_staging (
+    file_id uuid NOT NULL,
+    data_transacao timestamp,
+    horario_transacao varchar(6),
+    tipo_lancamento varchar(20),
+    data_lancamento date,
+    valor_bruto_venda decimal(15,2),
+    valor_liquido_venda decimal(15,2),
+    valor_desconto decimal(15,2),
+    tipo_produto varchar(10),
+    meio_captura varchar(10),
+    tipo_transacao varchar,
+    codigo_bandeira varchar,
+    codigo_produto varchar,
+    identificacao_loja varchar,
+    nsu_host_transacao varchar,
+    numero_cartao varchar,
+    numero_parcela varchar,
+    numero_total_parcelas varchar,
+    nsu_host_parcela varchar,
+    valor_bruto_parcela decimal(15,2),
+    valor_desconto_parcela decimal(15,2),
+    valor_liquido_parcela decimal(15,2),
+    banco varchar,
+    agencia varchar,
+    conta varchar,
+    codigo_autorizacao varchar,
+    valor_tx_interchange_tarifa decimal(15,2),
+    valor_tx_administracao decimal(15,2),
+    valor_tx_interchange_parcela decimal(15,2),
+    valor_tx_administracao_parcela decimal(15,2),
+    valor_redutor_multi_fronteira decimal(15,2),
+    valor_tx_antecipacao decimal(15,2),
+    valor_liquido_antecipado decimal(15,2),
+    codigo_pedido varchar,
+    sigla_pais varchar,
+    data_vencimento_original date,
+    indicador_deb_balance varchar(10),
+    indicador_reenvio varchar(10),
+    nsu_origem varchar,
+    numero_operacao_recebivel varchar,
+    sequencial_operacao_recebivel varchar,
+    tipo_operacao_recebivel varchar,
+    valor_operacao_recebivel decimal(15,2),
+    codigo_ec_venda varchar,
+    codigo_ec_pagamento varchar,
+    cnpj_ec_pagamento varchar,
+    -- Sequencial do registro no arquivo (ordem do DISTINCT ON das dimensões)
+    nseq varchar
+);
+
+-- Bancos criados antes da ordenação das dimensões na staging
+ALTER TABLE unica_transactions.transacoes_staging ADD COLUMN IF NOT EXISTS nseq varchar;
+
+CREATE TABLE IF NOT EXISTS unica_transactions.transacoes_quarentena (
+    id uuid PRIMARY KEY DEFAULT uuid_generate_v4(),
+    file_id uuid NOT NULL,
+    linha int NOT NULL,
+    coluna varchar NOT NULL,
+    erro text NOT NULL,
+    created_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT fk_quarentena_arquivo FOREIGN KEY (file_id) REFERENCES unica_transactions.controle_arquivos(id)
+);
+
+-- Linha mais recente (created_at) de cada parcela, mantida pela carga de cada arquivo;
+-- data_prevista/previsao_at vêm da Previsão mais recente da parcela
+CREATE TABLE IF NOT EXISTS unica_transactions.transacoes_current (
+    nsu_host_transacao varchar NOT NULL,
+    numero_parcela varchar NOT NULL,
+    transacao_id uuid NOT NULL,
+    file_id uuid NOT NULL,
+    data_transacao timestamp NOT NULL,
+    tipo_lancamento varchar(20) NOT NULL,
+    data_lancamento date NOT NULL,
+    valor_bruto_venda decimal(15,2) NOT NULL,
+    valor_liquido_venda decimal(15,2) NOT NULL,
+    numero_total_parcelas varchar NOT NULL,
+    valor_liquido_parcela decimal(15,2) NOT NULL,
+    created_at timestamp NOT NULL,
+    data_prevista date,
+    previsao_at timestamp,
+    PRIMARY KEY (nsu_host_transacao, numero_parcela)
+);
+
+-- Última reconstrução completa de cada etapa do refresh da conciliação
+-- (entre elas o refresh só recalcula o que os arquivos novos tocaram)
+CREATE TABLE IF NOT EXISTS unica_transactions.refresh_controle (
+    etapa varchar PRIMARY KEY,
+    ultimo_full_at timestamp NOT NULL
+);
+
 CREATE TRIGGER update_controle_arquivos_updated_at
     BEFORE UPDATE ON unica_transactions.controle_arquivos
     FOR EACH ROW
@@ -158,6 +260,11 @@ CREATE INDEX IF NOT EXISTS idx_transacoes_data_loja ON unica_transactions.transa
 CREATE INDEX IF NOT EXISTS idx_transacoes_bandeira ON unica_transactions.transacoes(codigo_bandeira);
 CREATE INDEX IF NOT EXISTS idx_transacoes_produto ON unica_transactions.transacoes(codigo_produto);
 CREATE INDEX IF NOT EXISTS idx_transacoes_file ON unica_transactions.transacoes(file_id);
+CREATE INDEX IF NOT EXISTS idx_transacoes_parcela ON unica_transactions.transacoes(nsu_host_transacao, numero_parcela, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_transacoes_lancamento ON unica_transactions.transacoes(data_lancamento);
+CREATE INDEX IF NOT EXISTS idx_current_lancamento ON unica_transactions.transacoes_current(data_lancamento);
+CREATE INDEX IF NOT EXISTS idx_staging_file ON unica_transactions.transacoes_staging(file_id);
+CREATE INDEX IF NOT EXISTS idx_quarentena_file ON unica_transactions.transacoes_quarentena(file_id, linha);
 
 CREATE INDEX IF NOT EXISTS idx_tempo_ano_mes ON unica_transactions.tempo(ano, mes);
 CREATE INDEX IF NOT EXISTS idx_tempo_data ON unica_transactions.tempo(data);
@@ -170,6 +277,10 @@ CREATE INDEX IF NOT EXISTS idx_pagamento_codigo ON unica_transactions.pagamento(
 
 CREATE INDEX IF NOT EXISTS idx_controle_nome_arquivo ON unica_transactions.controle_arquivos(nome_arquivo);
 CREATE INDEX IF NOT EXISTS idx_controle_data_status ON unica_transactions.controle_arquivos(data_geracao, status_processamento);
+CREATE INDEX IF NOT EXISTS idx_controle_reservas ON unica_transactions.controle_arquivos(reserva_expira_em)
+    WHERE status_processamento = 'PROCESSANDO';
+CREATE INDEX IF NOT EXISTS idx_controle_refresh_pendente ON unica_transactions.controle_arquivos(id)
+    WHERE status_processamento = 'SUCESSO' AND refreshed_at IS NULL;
 
 -- COMMENTS
 COMMENT ON TABLE unica_transactions.transacoes IS 'Tabela fato que armazena todas as transações financeiras';
@@ -177,4 +288,8 @@ COMMENT ON TABLE unica_transactions.tempo IS 'Dimensão de tempo para análise t
 COMMENT ON TABLE unica_transactions.loja IS 'Dimensão com informações da loja';
 COMMENT ON TABLE unica_transactions.produto IS 'Dimensão com informações dos produtos';
 COMMENT ON TABLE unica_transactions.pagamento IS 'Dimensão com informações das formas de pagamento';
+COMMENT ON TABLE unica_transactions.transacoes_staging IS 'Staging UNLOGGED da carga em lote de transacoes, por arquivo';
+COMMENT ON TABLE unica_transactions.transacoes_quarentena IS 'Registros CV recusados na validação de arquivos carregados em modo quarentena';
 COMMENT ON TABLE unica_transactions.controle_arquivos IS 'Controle de processamento dos arquivos de transação';
+COMMENT ON TABLE unica_transactions.transacoes_current IS 'Estado atual de cada parcela (linha mais recente de transacoes por nsu/parcela)';
+COMMENT ON TABLE unica_transactions.refresh_controle IS 'Última reconstrução completa de cada etapa do refresh da conciliação';
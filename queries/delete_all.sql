@@ -1,5 +1,9 @@
 -- Apaga dados das tabelas do schema unica_transactions (ordem segura)
+DELETE FROM unica_transactions.transacoes_current;
 DELETE FROM unica_transactions.transacoes;
+DELETE FROM unica_transactions.refresh_controle;
+DELETE FROM unica_transactions.transacoes_quarentena;
+DELETE FROM unica_transactions.transacoes_staging;
 DELETE FROM unica_transactions.tempo;
 DELETE FROM unica_transactions.pagamento;
 DELETE FROM unica_transactions.produto;
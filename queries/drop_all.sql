@@ -1,5 +1,9 @@
 -- Dropa tabelas do schema unica_transactions (ordem segura)
+DROP TABLE IF EXISTS unica_transactions.transacoes_current;
 DROP TABLE IF EXISTS unica_transactions.transacoes;
+DROP TABLE IF EXISTS unica_transactions.refresh_controle;
+DROP TABLE IF EXISTS unica_transactions.transacoes_quarentena;
+DROP TABLE IF EXISTS unica_transactions.transacoes_staging;
 DROP TABLE IF EXISTS unica_transactions.tempo;
 DROP TABLE IF EXISTS unica_transactions.pagamento;
 DROP TABLE IF EXISTS unica_transactions.produto;
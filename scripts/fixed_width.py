@@ -0,0 +1,237 @@
+"""
+Leitura colunar de arquivos de largura fixa.
+Os registros sao vistos como uma matriz de bytes (linhas x posicoes) e cada
+campo e extraido como uma coluna inteira, sem montar um dict por linha.
+"""
+
+import mmap
+import os
+
+import numpy as np
+
+NEWLINE = ord('\n')
+CARRIAGE_RETURN = ord('\r')
+SPACE = ord(' ')
+ZERO = ord('0')
+
+# Mesmos caracteres removidos por str.strip() em texto decodificado como latin-1
+_WHITESPACE = np.zeros(256, dtype=bool)
+_WHITESPACE[[9, 10, 11, 12, 13, 28, 29, 30, 31, 32, 0x85, 0xA0]] = True
+
+# Bytes varridos por vez ao procurar quebras de linha
+_SCAN_BYTES = 1 << 24
+
+# Linhas copiadas por vez quando os registros nao tem tamanho uniforme
+_GATHER_CHUNK_ROWS = 65536
+
+
+def map_file(path):
+    """Mapeia o arquivo em memoria (somente leitura) como array uint8.
+
+    Nada e copiado: as paginas sao lidas sob demanda pelo sistema operacional
+    e o mapeamento vive enquanto houver arrays apontando para ele.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return np.zeros(0, dtype=np.uint8)
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return np.frombuffer(mapping, dtype=np.uint8)
+
+
+def split_records(buffer):
+    """Localiza os registros do buffer.
+
+    Retorna (data, starts, lengths): o buffer como array uint8 e, para cada
+    registro, a posicao inicial e o tamanho sem a quebra de linha.
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    if data.size == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return data, empty, empty
+
+    # Varredura em janelas para nao criar uma mascara do tamanho do arquivo
+    ends = np.concatenate([
+        np.flatnonzero(data[first:first + _SCAN_BYTES] == NEWLINE) + first
+        for first in range(0, data.size, _SCAN_BYTES)
+    ])
+    if data[-1] != NEWLINE:
+        ends = np.append(ends, data.size)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    lengths = ends - starts
+
+    # Arquivos gerados no Windows terminam cada linha com \r\n
+    has_cr = lengths > 0
+    has_cr[has_cr] = data[ends[has_cr] - 1] == CARRIAGE_RETURN
+    lengths -= has_cr
+    return data, starts, lengths
+
+
+def record_codes(data, starts, lengths, width):
+    """Retorna os `width` primeiros bytes de cada registro (tipo de registro)."""
+    return byte_matrix(data, starts, lengths, width).view(f'S{width}').ravel()
+
+
+def byte_matrix(data, starts, lengths, width):
+    """Monta a matriz (n_registros x width) com os bytes dos registros.
+
+    A largura e limitada ao maior registro, como no fatiamento de str. Quando
+    os registros sao contiguos e do mesmo tamanho (caso normal) a matriz e uma
+    view sobre o proprio buffer; caso contrario os bytes sao copiados e
+    posicoes alem do fim da linha ficam com espaco.
+    """
+    n = len(starts)
+    if n == 0:
+        return np.zeros((0, width), dtype=np.uint8)
+
+    width = int(min(width, lengths.max()))
+
+    stride = starts[1] - starts[0] if n > 1 else 0
+    uniform = (
+        (lengths >= width).all()
+        and (n == 1 or (np.diff(starts) == stride).all())
+        and starts[-1] + width <= data.size
+    )
+    if uniform:
+        return np.lib.stride_tricks.as_strided(
+            data[starts[0]:], shape=(n, width), strides=(stride, 1), writeable=False
+        )
+
+    matrix = np.full((n, width), SPACE, dtype=np.uint8)
+    columns = np.arange(width)
+    for first in range(0, n, _GATHER_CHUNK_ROWS):
+        rows = slice(first, first + _GATHER_CHUNK_ROWS)
+        inside = columns < np.minimum(lengths[rows], width)[:, None]
+        positions = starts[rows, None] + columns
+        matrix[rows][inside] = data[positions[inside]]
+    return matrix
+
+
+def _strip_counts(block):
+    """Quantidade de bytes de espaco no inicio e no fim de cada linha do bloco."""
+    width = block.shape[1]
+    filled = ~_WHITESPACE[block]
+    leading = filled.argmax(axis=1)
+    trailing = filled[:, ::-1].argmax(axis=1)
+    empty = ~filled.any(axis=1)
+    leading[empty] = width
+    trailing[empty] = width
+    return leading, trailing
+
+
+def _to_unicode(block):
+    """Converte um bloco uint8 em array de strings (latin-1 e 1:1 com unicode)."""
+    width = block.shape[1]
+    if width == 0:
+        return np.zeros(block.shape[0], dtype='<U1')
+    return np.ascontiguousarray(block, dtype=np.uint32).view(f'<U{width}').ravel()
+
+
+def _shift_left(block, shift):
+    """Desloca cada linha `shift` posicoes para a esquerda, completando com NUL."""
+    rows = np.flatnonzero(shift > 0)
+    if rows.size:
+        columns = np.arange(block.shape[1])
+        source = columns + shift[rows, None]
+        moved = np.take_along_axis(block[rows], np.minimum(source, block.shape[1] - 1), axis=1)
+        moved[source >= block.shape[1]] = 0
+        block[rows] = moved
+    return block
+
+
+def _stripped_block(matrix, start, end):
+    """Copia do campo com os espacos das pontas removidos e alinhado a esquerda.
+
+    Os bytes removidos viram NUL, que o numpy descarta ao converter para string.
+    """
+    block = np.array(matrix[:, start:end], dtype=np.uint8)
+    if block.shape[1] == 0:
+        return block
+    leading, trailing = _strip_counts(block)
+    width = block.shape[1]
+    block *= np.arange(width) < (width - trailing)[:, None]
+    # Linhas em branco ja foram zeradas; so as demais precisam ser deslocadas
+    leading[leading == width] = 0
+    return _shift_left(block, leading)
+
+
+def text_block(matrix, start, end, strip=True, zfill=None):
+    """Bytes do campo [start:end) como serao convertidos em str, completados com NUL.
+
+    `strip` replica str.strip() e `zfill` replica str.zfill(zfill) aplicado depois.
+    """
+    end = min(end, matrix.shape[1])
+    if not strip:
+        return matrix[:, start:end]
+
+    block = _stripped_block(matrix, start, end)
+    if zfill and block.shape[1] == 0:
+        block = np.full((block.shape[0], zfill), ZERO, dtype=np.uint8)
+    elif zfill:
+        width = max(zfill, block.shape[1])
+        size = block.shape[1] - (block[:, ::-1] != 0).argmax(axis=1)
+        size[~block.any(axis=1)] = 0
+        source = np.arange(width) - (width - size)[:, None]
+        block = np.take_along_axis(block, np.clip(source, 0, block.shape[1] - 1), axis=1)
+        block[source < 0] = ZERO
+    return block
+
+
+def block_text(block):
+    """Converte o bloco de text_block em array de str (object)."""
+    return _to_unicode(block).astype(object)
+
+
+def text_column(matrix, start, end, strip=True, zfill=None):
+    """Extrai o campo [start:end) como array de str."""
+    return block_text(text_block(matrix, start, end, strip, zfill))
+
+
+def digits_mask(matrix, start, end, min_width=1):
+    """Indica as linhas em que todos os bytes do campo sao digitos.
+
+    Campos cortados pelo fim da linha com menos de `min_width` bytes nunca sao validos.
+    """
+    end = min(end, matrix.shape[1])
+    if end - start < min_width:
+        return np.zeros(len(matrix), dtype=bool)
+    block = matrix[:, start:end]
+    return ((block >= ZERO) & (block <= ZERO + 9)).all(axis=1)
+
+
+def integer_column(matrix, start, end):
+    """Valor inteiro do campo; so e significativo onde digits_mask e verdadeiro."""
+    end = min(end, matrix.shape[1])
+    block = matrix[:, start:end].astype(np.int64) - ZERO
+    powers = 10 ** np.arange(end - start - 1, -1, -1, dtype=np.int64)
+    return block @ powers
+
+
+def date_column(matrix, start, end):
+    """Converte campos DDMMAAAA em datetime64[D].
+
+    Retorna (datas, validas); linhas que nao sao digitos, datas inexistentes
+    (ex.: 31/02) e anos fora do intervalo de datetime64[ns] do pandas ficam NaT.
+    """
+    dates = np.full(len(matrix), np.datetime64('NaT'), dtype='datetime64[D]')
+    valid = digits_mask(matrix, start, end, min_width=8) & (min(end, matrix.shape[1]) - start == 8)
+    if not valid.any():
+        return dates, valid
+
+    rows = matrix[valid]
+    day = integer_column(rows, start, start + 2)
+    month = integer_column(rows, start + 2, start + 4)
+    year = integer_column(rows, start + 4, start + 8)
+
+    ok = (month >= 1) & (month <= 12) & (year >= 1678) & (year <= 2261) & (day >= 1)
+    months = ((year - 1970) * 12 + month - 1).astype('datetime64[M]')
+    first_day = months.astype('datetime64[D]')
+    month_days = ((months + 1).astype('datetime64[D]') - first_day).astype(np.int64)
+    ok &= day <= month_days
+
+    values = np.full(len(rows), np.datetime64('NaT'), dtype='datetime64[D]')
+    values[ok] = first_day[ok] + (day[ok] - 1)
+    dates[valid] = values
+    valid[valid] = ok
+    return dates, valid
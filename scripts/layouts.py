@@ -0,0 +1,495 @@
+"""
+Registro de layouts de largura fixa.
+Cada layout e uma tabela de campos, chaveada por (familia, tipo de registro,
+versao do layout), compilada uma unica vez por processo em um extrator que
+decodifica os campos coluna a coluna sobre a matriz de bytes dos registros.
+Para suportar uma nova versao de layout basta registrar a tabela em LAYOUTS.
+"""
+
+from collections import namedtuple
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from scripts.fixed_width import (
+    split_records,
+    byte_matrix,
+    text_column,
+    text_block,
+    block_text,
+    digits_mask,
+    integer_column,
+    date_column
+)
+from utils.logger import setup_logger
+
+logger = setup_logger("layouts")
+
+# type:
+#   'raw'     -> fatia sem strip
+#   'str'     -> strip
+#   'zfill'   -> strip + zeros a esquerda ate a largura do campo
+#   'cents'   -> 9(n)V99 do EXTRATO, em centavos inteiros (Int64, <NA> se invalido)
+#   'amount'  -> 9(13)V99 do TRICARD, em centavos Int64 (0 se invalido)
+#   'date'    -> DDMMAAAA do TRICARD, como datetime64 (NaT se vazio/invalido)
+#   campos 'amount'/'date' de largura zero marcam valores ausentes no tipo de
+#   registro (<NA>/NaT), mantendo o dtype da coluna ao juntar os tipos
+#   'int'     -> inteiro (default se vazio)
+#   'const'   -> valor fixo `default`, sem posicao no registro
+# optional: o campo vale None quando o registro nao passa do fim do campo
+Field = namedtuple(
+    'Field',
+    ['name', 'start', 'end', 'type', 'decimals', 'default', 'optional'],
+    defaults=(0, None, False)
+)
+
+DEFAULT_VERSIONS = {
+    'EXTRATO': '002.0a',
+    'TRICARD': 'padrao',
+}
+
+EXTRATO_HEADER = [
+    Field('codigo_registro', 0, 2, 'raw'),
+    Field('versao_layout', 2, 8, 'raw'),
+    Field('data_geracao', 8, 16, 'raw'),
+    Field('hora_geracao', 16, 22, 'raw'),
+    Field('id_movimento', 22, 28, 'raw'),
+    Field('nome_admin', 28, 58, 'str'),
+    Field('remetente', 58, 62, 'raw'),
+    Field('destinatario', 62, 71, 'raw'),
+    Field('tipo_processamento', 71, 72, 'raw'),
+    Field('nseq_registro', 72, 78, 'raw'),
+]
+
+EXTRATO_CV = [
+    Field('codigo_registro', 0, 2, 'str'),
+    Field('identificacao_loja', 2, 17, 'zfill'),
+    Field('nsu_host_transacao', 17, 29, 'str'),
+    Field('data_transacao', 29, 37, 'str'),
+    Field('horario_transacao', 37, 43, 'str'),
+    Field('tipo_lancamento', 43, 44, 'str'),
+    Field('data_lancamento', 44, 52, 'str'),
+    Field('tipo_produto', 52, 53, 'str'),
+    Field('meio_captura', 53, 54, 'str'),
+    Field('valor_bruto_venda', 54, 65, 'cents', 2),
+    Field('valor_desconto', 65, 76, 'cents', 2),
+    Field('valor_liquido_venda', 76, 87, 'cents', 2),
+    Field('numero_cartao', 87, 106, 'zfill'),
+    Field('numero_parcela', 106, 108, 'zfill'),
+    Field('numero_total_parcelas', 108, 110, 'zfill'),
+    Field('nsu_host_parcela', 110, 122, 'zfill'),
+    Field('valor_bruto_parcela', 122, 133, 'cents', 2),
+    Field('valor_desconto_parcela', 133, 144, 'cents', 2),
+    Field('valor_liquido_parcela', 144, 155, 'cents', 2),
+    Field('banco', 155, 158, 'str'),
+    Field('agencia', 158, 164, 'str'),
+    Field('conta', 164, 175, 'str'),
+    Field('codigo_autorizacao', 175, 187, 'zfill'),
+    Field('codigo_bandeira', 187, 190, 'zfill'),
+    Field('codigo_produto', 190, 193, 'zfill'),
+    Field('valor_tx_interchange_tarifa', 193, 204, 'cents', 2),
+    Field('valor_tx_administracao', 204, 215, 'cents', 2),
+    Field('valor_tx_interchange_parcela', 215, 226, 'cents', 2),
+    Field('valor_tx_administracao_parcela', 226, 237, 'cents', 2),
+    Field('valor_redutor_multi_fronteira', 237, 248, 'cents', 2),
+    Field('valor_tx_antecipacao', 248, 259, 'cents', 2),
+    Field('valor_liquido_antecipado', 259, 270, 'cents', 2),
+    Field('tipo_transacao', 270, 272, 'str'),
+    Field('codigo_pedido', 272, 302, 'str'),
+    Field('sigla_pais', 302, 305, 'str'),
+    Field('reservado', 305, 356, 'str'),
+    Field('codigo_ec_venda', 305, 314, 'str'),
+    Field('codigo_ec_pagamento', 314, 323, 'str'),
+    Field('cnpj_ec_pagamento', 323, 337, 'str'),
+    Field('data_vencimento_original', 337, 345, 'str'),
+    Field('indicador_deb_balance', 345, 346, 'str'),
+    Field('indicador_reenvio', 346, 347, 'str'),
+    Field('nsu_origem', 347, 353, 'str'),
+    Field('reservado_final', 353, 356, 'str'),
+    Field('numero_operacao_recebivel', 356, 376, 'str'),
+    Field('sequencial_operacao_recebivel', 376, 378, 'str'),
+    Field('tipo_operacao_recebivel', 378, 379, 'str'),
+    Field('valor_operacao_recebivel', 379, 390, 'cents', 2),
+    Field('nseq', 390, 397, 'str'),
+]
+
+EXTRATO_TRAILER = [
+    Field('codigo_registro', 0, 2, 'raw'),
+    Field('total_registros', 2, 8, 'raw'),
+    Field('nseq_registro', 8, 14, 'raw'),
+]
+
+TRICARD_HEADER_VENDA = [
+    Field('tipo_registro', 0, 3, 'raw'),
+    Field('data_emissao', 3, 11, 'raw'),
+    Field('literal', 11, 19, 'str'),
+    Field('nome_comercial', 49, 71, 'str'),
+    Field('seq_movimento', 71, 77, 'raw'),
+    Field('pv_grupo', 77, 86, 'raw'),
+    Field('tipo_processamento', 86, 101, 'str'),
+    Field('versao', 101, 121, 'str'),
+]
+
+TRICARD_HEADER_FINANCEIRO = [
+    Field('tipo_registro', 0, 3, 'raw'),
+    Field('data_emissao', 3, 11, 'raw'),
+    Field('literal', 11, 19, 'str'),
+    Field('nome_comercial', 53, 75, 'str'),
+    Field('seq_movimento', 75, 81, 'raw'),
+    Field('pv_grupo', 81, 90, 'raw'),
+    Field('tipo_processamento', 90, 105, 'str'),
+    Field('versao', 105, 125, 'str'),
+]
+
+TRICARD_HEADER_SALDO = [
+    Field('tipo_registro', 0, 3, 'raw'),
+    Field('data_emissao', 3, 11, 'raw'),
+    Field('literal', 11, 19, 'str'),
+    Field('nome_comercial', 59, 81, 'str'),
+    Field('seq_movimento', 81, 87, 'raw'),
+    Field('pv_grupo', 87, 96, 'raw'),
+    Field('tipo_processamento', 96, 111, 'str'),
+]
+
+# Trailers de arquivo (028 VENDA, 052 FINANCEIRO, 069 SALDO): a quantidade de
+# registros inclui header e trailer
+TRICARD_TRAILER = [
+    Field('tipo_registro', 0, 3, 'raw'),
+    Field('quantidade_matrizes', 3, 7, 'int'),
+    Field('quantidade_registros', 7, 13, 'int'),
+]
+
+# 008 (rotativo) e 012 (parcelado) compartilham as colunas de tricard_vendas
+TRICARD_008 = [
+    Field('tipo_registro', 0, 0, 'const', default='008'),
+    Field('numero_pv', 3, 12, 'str'),
+    Field('numero_rv', 12, 21, 'str'),
+    Field('data_venda', 21, 29, 'date'),
+    Field('numero_cv_nsu', 86, 98, 'str'),
+    Field('numero_cartao', 67, 83, 'str'),
+    Field('valor_bruto', 37, 52, 'amount', 2),
+    Field('valor_gorjeta', 52, 67, 'amount', 2),
+    Field('valor_desconto', 111, 126, 'amount', 2),
+    Field('valor_liquido', 203, 218, 'amount', 2),
+    Field('nr_autorizacao', 126, 132, 'str'),
+    Field('hora_transacao', 132, 138, 'str'),
+    Field('tipo_captura', 202, 203, 'str'),
+    Field('nr_terminal', 218, 226, 'str'),
+    Field('sigla_pais', 226, 229, 'str'),
+    Field('numero_parcelas', 0, 0, 'const', default=1),
+    Field('numero_referencia', 98, 111, 'str'),
+]
+
+TRICARD_012 = [
+    Field('tipo_registro', 0, 0, 'const', default='012'),
+    Field('numero_pv', 3, 12, 'str'),
+    Field('numero_rv', 12, 21, 'str'),
+    Field('data_venda', 21, 29, 'date'),
+    Field('numero_cv_nsu', 88, 100, 'str'),
+    Field('numero_cartao', 67, 83, 'str'),
+    Field('valor_bruto', 37, 52, 'amount', 2),
+    Field('valor_gorjeta', 52, 67, 'amount', 2),
+    Field('valor_desconto', 113, 128, 'amount', 2),
+    Field('valor_liquido', 205, 220, 'amount', 2),
+    Field('nr_autorizacao', 128, 134, 'str'),
+    Field('hora_transacao', 134, 140, 'str'),
+    Field('tipo_captura', 204, 205, 'str'),
+    Field('nr_terminal', 250, 258, 'str'),
+    Field('sigla_pais', 258, 261, 'str'),
+    Field('numero_parcelas', 86, 88, 'int', default=1),
+    Field('numero_referencia', 100, 113, 'str'),
+]
+
+# 034 (créditos), 035 (ajustes) e 036 (antecipações) compartilham tricard_financeiro
+TRICARD_034 = [
+    Field('tipo_registro', 0, 0, 'const', default='034'),
+    Field('numero_pv', 3, 12, 'str'),
+    Field('numero_documento', 12, 23, 'str'),
+    Field('data_lancamento', 23, 31, 'date'),
+    Field('valor_lancamento', 31, 46, 'amount', 2),
+    Field('indicador_cd', 46, 47, 'str'),
+    Field('banco', 47, 50, 'str'),
+    Field('agencia', 50, 56, 'str'),
+    Field('conta_corrente', 56, 67, 'str'),
+    Field('numero_rv', 75, 84, 'str'),
+    Field('data_transacao_original', 84, 92, 'date'),
+    Field('tipo_transacao', 93, 94, 'str'),
+    Field('valor_bruto_rv', 94, 109, 'amount', 2),
+    Field('valor_taxa_desconto', 109, 124, 'amount', 2),
+    Field('parcela_total', 124, 129, 'str'),
+    Field('status_credito', 129, 131, 'str'),
+    Field('pv_original', 131, 140, 'str'),
+    Field('motivo_ajuste', 0, 0, 'const'),
+    Field('numero_cartao', 0, 0, 'const'),
+    Field('valor_credito_original', 0, 0, 'amount', 2),
+    Field('data_vencimento_original', 0, 0, 'date'),
+]
+
+TRICARD_035 = [
+    Field('tipo_registro', 0, 0, 'const', default='035'),
+    Field('numero_pv', 3, 12, 'str'),
+    Field('numero_documento', 12, 21, 'str'),
+    Field('data_lancamento', 21, 29, 'date'),
+    Field('valor_lancamento', 29, 44, 'amount', 2),
+    Field('indicador_cd', 44, 45, 'str'),
+    Field('banco', 0, 0, 'const'),
+    Field('agencia', 0, 0, 'const'),
+    Field('conta_corrente', 0, 0, 'const'),
+    Field('numero_rv', 99, 108, 'str', optional=True),
+    Field('data_transacao_original', 91, 99, 'date', optional=True),
+    Field('tipo_transacao', 0, 0, 'const'),
+    Field('valor_bruto_rv', 0, 0, 'amount', 2),
+    Field('valor_taxa_desconto', 0, 0, 'amount', 2),
+    Field('parcela_total', 0, 0, 'const'),
+    Field('status_credito', 0, 0, 'const'),
+    Field('pv_original', 137, 146, 'str', optional=True),
+    Field('motivo_ajuste', 47, 75, 'str', optional=True),
+    Field('numero_cartao', 75, 91, 'str', optional=True),
+    Field('valor_credito_original', 0, 0, 'amount', 2),
+    Field('data_vencimento_original', 0, 0, 'date'),
+]
+
+TRICARD_036 = [
+    Field('tipo_registro', 0, 0, 'const', default='036'),
+    Field('numero_pv', 3, 12, 'str'),
+    Field('numero_documento', 12, 23, 'str'),
+    Field('data_lancamento', 23, 31, 'date'),
+    Field('valor_lancamento', 31, 46, 'amount', 2),
+    Field('indicador_cd', 46, 47, 'str'),
+    Field('banco', 47, 50, 'str'),
+    Field('agencia', 50, 56, 'str'),
+    Field('conta_corrente', 56, 67, 'str'),
+    Field('numero_rv', 67, 76, 'str'),
+    Field('data_transacao_original', 76, 84, 'date'),
+    Field('tipo_transacao', 0, 0, 'const'),
+    Field('valor_bruto_rv', 112, 127, 'amount', 2),
+    Field('valor_taxa_desconto', 127, 142, 'amount', 2),
+    Field('parcela_total', 107, 112, 'str'),
+    Field('status_credito', 0, 0, 'const'),
+    Field('pv_original', 142, 151, 'str'),
+    Field('motivo_ajuste', 0, 0, 'const'),
+    Field('numero_cartao', 0, 0, 'const'),
+    Field('valor_credito_original', 84, 99, 'amount', 2),
+    Field('data_vencimento_original', 99, 107, 'date'),
+]
+
+TRICARD_062 = [
+    Field('numero_oc', 3, 18, 'str'),
+    Field('tipo_transacao', 18, 19, 'str'),
+    Field('banco', 19, 22, 'str'),
+    Field('agencia', 22, 31, 'str'),
+    Field('conta_corrente', 31, 42, 'str'),
+    Field('data_vencimento', 42, 50, 'date'),
+    Field('numero_ec', 50, 59, 'str'),
+    Field('valor_bruto', 90, 105, 'amount', 2),
+    Field('valor_desconto', 105, 120, 'amount', 2),
+    Field('valor_gorjeta', 120, 135, 'amount', 2),
+    Field('valor_liquido', 135, 150, 'amount', 2),
+    Field('numero_pv', 150, 159, 'str'),
+    Field('numero_parcela', 159, 161, 'int'),
+]
+
+LAYOUTS = {
+    ('EXTRATO', 'A0', '002.0a'): EXTRATO_HEADER,
+    ('EXTRATO', 'CV', '002.0a'): EXTRATO_CV,
+    ('EXTRATO', 'A9', '002.0a'): EXTRATO_TRAILER,
+    ('TRICARD', '002', 'padrao'): TRICARD_HEADER_VENDA,
+    ('TRICARD', '008', 'padrao'): TRICARD_008,
+    ('TRICARD', '012', 'padrao'): TRICARD_012,
+    ('TRICARD', '028', 'padrao'): TRICARD_TRAILER,
+    ('TRICARD', '030', 'padrao'): TRICARD_HEADER_FINANCEIRO,
+    ('TRICARD', '034', 'padrao'): TRICARD_034,
+    ('TRICARD', '035', 'padrao'): TRICARD_035,
+    ('TRICARD', '036', 'padrao'): TRICARD_036,
+    ('TRICARD', '052', 'padrao'): TRICARD_TRAILER,
+    ('TRICARD', '060', 'padrao'): TRICARD_HEADER_SALDO,
+    ('TRICARD', '062', 'padrao'): TRICARD_062,
+    ('TRICARD', '069', 'padrao'): TRICARD_TRAILER,
+}
+
+
+def _cents(value, decimal_places=2):
+    """Valor 9(n)V99 com espacos nas pontas em centavos; None se invalido"""
+    value = value.strip()
+    if len(value) >= decimal_places and value.isdigit():
+        return int(value)
+    return None
+
+
+def _tricard_cents(value):
+    """9(13)V99 fora do padrao (sinal, espacos); 0 se invalido"""
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return 0
+
+
+def parse_tricard_date(value):
+    """Parse DDMMAAAA date format to date object"""
+    try:
+        value = value.strip()
+        if not value or value == '00000000':
+            return None
+        return datetime.strptime(value, '%d%m%Y').date()
+    except (ValueError, TypeError):
+        return None
+
+
+def _decode_raw(matrix, field):
+    return text_column(matrix, field.start, field.end, strip=False)
+
+
+def _text_block(matrix, field):
+    zfill = field.end - field.start if field.type == 'zfill' else None
+    return text_block(matrix, field.start, field.end, zfill=zfill)
+
+
+def _decode_str(matrix, field):
+    return block_text(_text_block(matrix, field))
+
+
+def _decode_cents(matrix, field):
+    # Campo todo em digitos vira inteiro direto dos bytes; o resto segue a regra campo a campo
+    valid = digits_mask(matrix, field.start, field.end, min_width=field.decimals + 1)
+    values = np.zeros(len(matrix), dtype=np.int64)
+    if valid.any():
+        values[valid] = integer_column(matrix[valid], field.start, field.end)
+    invalid = np.flatnonzero(~valid)
+    if invalid.size:
+        parsed = [_cents(value, field.decimals) for value in text_column(matrix[invalid], field.start, field.end, strip=False)]
+        values[invalid] = [value or 0 for value in parsed]
+        valid[invalid] = [value is not None for value in parsed]
+    return pd.arrays.IntegerArray(values, ~valid)
+
+
+def _decode_amount(matrix, field):
+    # Sempre Int64: largura zero (valor ausente neste tipo de registro) vira <NA>, e nao zero
+    missing = np.full(len(matrix), field.end == field.start)
+    if missing.all():
+        return pd.arrays.IntegerArray(np.zeros(len(matrix), dtype=np.int64), missing)
+    valid = digits_mask(matrix, field.start, field.end)
+    values = np.zeros(len(matrix), dtype=np.int64)
+    if valid.any():
+        values[valid] = integer_column(matrix[valid], field.start, field.end)
+    invalid = np.flatnonzero(~valid)
+    if invalid.size:
+        values[invalid] = [
+            _tricard_cents(value)
+            for value in text_column(matrix[invalid], field.start, field.end, strip=False)
+        ]
+    return pd.arrays.IntegerArray(values, missing)
+
+
+def _decode_date(matrix, field):
+    dates, valid = date_column(matrix, field.start, field.end)
+    # Campos fora do padrao DDMMAAAA (ex.: com espacos) seguem a regra campo a campo
+    candidates = np.flatnonzero(~valid & ~digits_mask(matrix, field.start, field.end))
+    if candidates.size and field.end > field.start:
+        texts = text_column(matrix[candidates], field.start, field.end)
+        for i, value in zip(candidates, texts):
+            parsed = parse_tricard_date(value) if value else None
+            if parsed and 1678 <= parsed.year <= 2261:
+                dates[i] = np.datetime64(parsed, 'D')
+    return dates
+
+
+def _decode_int(matrix, field):
+    texts = text_column(matrix, field.start, field.end)
+    valid = digits_mask(matrix, field.start, field.end)
+    values = np.empty(len(matrix), dtype=object)
+    values[valid] = integer_column(matrix[valid], field.start, field.end).tolist()
+    for i in np.flatnonzero(~valid):
+        values[i] = int(texts[i]) if texts[i] else field.default
+    return values
+
+
+def _decode_const(matrix, field):
+    values = np.empty(len(matrix), dtype=object)
+    values[:] = [field.default] * len(matrix)
+    return values
+
+
+# Tipos cujo valor é o texto do campo (bloco de bytes disponível para a validação)
+TEXT_TYPES = ('str', 'zfill')
+
+DECODERS = {
+    'raw': _decode_raw,
+    'str': _decode_str,
+    'zfill': _decode_str,
+    'cents': _decode_cents,
+    'amount': _decode_amount,
+    'date': _decode_date,
+    'int': _decode_int,
+    'const': _decode_const,
+}
+
+
+class RecordExtractor:
+    """Layout compilado: decodifica todos os campos de um lote de registros."""
+
+    def __init__(self, fields):
+        unknown = {field.type for field in fields} - DECODERS.keys()
+        if unknown:
+            raise ValueError(f"Tipos de campo desconhecidos no layout: {sorted(unknown)}")
+        self.fields = tuple(fields)
+        self.columns = [field.name for field in self.fields]
+        self.width = max(field.end for field in self.fields)
+        self.decoders = [DECODERS[field.type] for field in self.fields]
+
+    def extract(self, buffer, starts, lengths, blocks=None):
+        """Retorna {campo: array} para os registros indicados por starts/lengths
+
+        Com `blocks` (dict), guarda nele os bytes de cada campo de texto já sem
+        espaços, para a validação não precisar percorrer as strings de novo.
+        """
+        matrix = byte_matrix(buffer, starts, lengths, self.width)
+        columns = {}
+        for field, decode in zip(self.fields, self.decoders):
+            if blocks is not None and field.type in TEXT_TYPES and not field.optional:
+                blocks[field.name] = _text_block(matrix, field)
+                columns[field.name] = block_text(blocks[field.name])
+                continue
+            values = decode(matrix, field)
+            if field.optional and values.dtype.kind == 'M':
+                values[lengths <= field.end] = np.datetime64('NaT')
+            elif field.optional:
+                values = values.astype(object)
+                values[lengths <= field.end] = None
+            columns[field.name] = values
+        return columns
+
+    def to_dataframe(self, buffer, starts, lengths, blocks=None):
+        return pd.DataFrame(self.extract(buffer, starts, lengths, blocks), columns=self.columns)
+
+    def parse_line(self, line):
+        """Decodifica um único registro (header/trailer) como dict"""
+        buffer, starts, lengths = split_records(line.encode('latin-1'))
+        return {name: values[0] for name, values in self.extract(buffer, starts[:1], lengths[:1]).items()}
+
+
+@lru_cache(maxsize=None)
+def _compile(family, record_type, versao):
+    return RecordExtractor(LAYOUTS[(family, record_type, versao)])
+
+
+@lru_cache(maxsize=None)
+def _resolve_version(family, record_type, versao):
+    default = DEFAULT_VERSIONS[family]
+    if versao is None:
+        return default
+    if (family, record_type, versao) not in LAYOUTS:
+        logger.warning(
+            f"Layout {family}/{record_type} versão '{versao}' não registrado; usando versão '{default}'"
+        )
+        return default
+    return versao
+
+
+def get_extractor(family, record_type, versao=None):
+    """Extrator compilado (e mantido em cache) para o layout pedido.
+
+    Sem versão, ou com uma versão não registrada, usa a versão padrão da família.
+    """
+    return _compile(family, record_type, _resolve_version(family, record_type, versao))
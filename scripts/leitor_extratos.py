@@ -1,18 +1,55 @@
+import os
 import pandas as pd
 from datetime import datetime
 from scripts.reading_files import ExtratoTransacao
+from scripts.layouts import EXTRATO_CV
 from scripts.transform_files import TransformerTrasacoes
 from utils.connection_db import (
-    insert_df_to_db, 
-    get_existing_records,
-    register_file_processing
+    copy_df_to_db,
+    acquire_connection,
+    pooled_connection,
+    release_connection,
+    update_current_parcels,
+    upsert_file_record
 )
 from utils.logger import setup_logger
-import psycopg2
-from psycopg2 import sql
+from scripts import fixed_width, layouts, reading_files, transform_files, validation_rules
+from utils import parse_cache, dimension_cache
+from psycopg2.errors import ForeignKeyViolation
 
 logger = setup_logger("leitor_extratos")
 
+# Transações validadas e inseridas por vez; limita o pico de memória em arquivos grandes
+CHUNK_ROWS = int(os.getenv('EXTRATO_CHUNK_ROWS', '50000'))
+
+# Validação de tamanho/dígitos direto nos bytes lidos pelo parser (0 desliga)
+FUSED_VALIDATION = os.getenv('EXTRATO_FUSED_VALIDATION', '1') != '0'
+
+# Quarentena: linhas inválidas vão para transacoes_quarentena e as válidas são carregadas;
+# o arquivo só é recusado quando a fração de linhas rejeitadas passa do limite
+QUARANTINE = os.getenv('EXTRATO_QUARANTINE', '0') != '0'
+MAX_REJECTED_RATE = float(os.getenv('EXTRATO_MAX_REJECTED_RATE', '0.01'))
+
+# Entra na chave do cache de parse: mudar layouts, parser ou regras de validação invalida os blocos gravados
+CACHE_DEFINITIONS = parse_cache.definitions_digest(
+    fixed_width, layouts, reading_files, transform_files, validation_rules
+)
+
+# Carga da fato: 'direct' (COPY por bloco direto em transacoes) ou 'staging' (COPY
+# na UNLOGGED transacoes_staging e um único INSERT ... SELECT no fim do arquivo)
+LOAD_MODE = os.getenv('EXTRATO_LOAD_MODE', 'direct')
+
+# Colunas monetárias: trafegam como centavos inteiros e viram decimal(15,2) no próprio banco
+CENTS_COLUMNS = [field.name for field in EXTRATO_CV if field.type == 'cents']
+
+# (tabela, coluna chave) na ordem retornada por prepare_dimension_tables
+DIMENSIONS = [
+    ('tempo', 'data'),
+    ('loja', 'identificacao_loja'),
+    ('produto', 'codigo_produto'),
+    ('pagamento', 'codigo_bandeira'),
+]
+
 def prepare_dimension_tables(df_transacoes):
     df_tempo = pd.DataFrame({
         'data': pd.to_datetime(df_transacoes['data_transacao']).dt.date,
@@ -40,43 +77,187 @@ def prepare_dimension_tables(df_transacoes):
 
     return df_tempo, df_loja, df_produto, df_pagamento
 
+FACT_COLUMNS = [
+    'data_transacao', 'horario_transacao', 'tipo_lancamento', 'data_lancamento',
+    'valor_bruto_venda', 'valor_liquido_venda', 'valor_desconto', 'tipo_produto',
+    'meio_captura', 'tipo_transacao', 'codigo_bandeira', 'codigo_produto',
+    'identificacao_loja', 'nsu_host_transacao', 'numero_cartao', 'numero_parcela',
+    'numero_total_parcelas', 'nsu_host_parcela', 'valor_bruto_parcela',
+    'valor_desconto_parcela', 'valor_liquido_parcela', 'banco', 'agencia',
+    'conta', 'codigo_autorizacao', 'valor_tx_interchange_tarifa',
+    'valor_tx_administracao', 'valor_tx_interchange_parcela',
+    'valor_tx_administracao_parcela', 'valor_redutor_multi_fronteira',
+    'valor_tx_antecipacao', 'valor_liquido_antecipado', 'codigo_pedido',
+    'sigla_pais', 'data_vencimento_original', 'indicador_deb_balance',
+    'indicador_reenvio', 'nsu_origem', 'numero_operacao_recebivel',
+    'sequencial_operacao_recebivel', 'tipo_operacao_recebivel',
+    'valor_operacao_recebivel'
+]
+
+# Colunas da loja que não ficam na tabela fato, mas vão para a staging
+LOJA_COLUMNS = ['codigo_ec_venda', 'codigo_ec_pagamento', 'cnpj_ec_pagamento']
+# Sequencial do registro no arquivo: as dimensões da staging ficam com a primeira linha, como na carga direta
+STAGING_ORDER_COLUMN = 'nseq'
+
 def prepare_fact_table(df_transacoes):
-    df_fact = df_transacoes[[
-        'data_transacao', 'horario_transacao', 'tipo_lancamento', 'data_lancamento',
-        'valor_bruto_venda', 'valor_liquido_venda', 'valor_desconto', 'tipo_produto',
-        'meio_captura', 'tipo_transacao', 'codigo_bandeira', 'codigo_produto',
-        'identificacao_loja', 'nsu_host_transacao', 'numero_cartao', 'numero_parcela',
-        'numero_total_parcelas', 'nsu_host_parcela', 'valor_bruto_parcela',
-        'valor_desconto_parcela', 'valor_liquido_parcela', 'banco', 'agencia',
-        'conta', 'codigo_autorizacao', 'valor_tx_interchange_tarifa',
-        'valor_tx_administracao', 'valor_tx_interchange_parcela',
-        'valor_tx_administracao_parcela', 'valor_redutor_multi_fronteira',
-        'valor_tx_antecipacao', 'valor_liquido_antecipado', 'codigo_pedido',
-        'sigla_pais', 'data_vencimento_original', 'indicador_deb_balance',
-        'indicador_reenvio', 'nsu_origem', 'numero_operacao_recebivel',
-        'sequencial_operacao_recebivel', 'tipo_operacao_recebivel',
-        'valor_operacao_recebivel'
-    ]].copy()
+    df_fact = df_transacoes[FACT_COLUMNS].copy()
     
     return df_fact
 
+def prepare_staging_table(df_transacoes, file_id):
+    """Linhas da transacoes_staging: colunas da fato + dados da loja, marcadas com file_id"""
+    df_staging = df_transacoes[FACT_COLUMNS + LOJA_COLUMNS + [STAGING_ORDER_COLUMN]].copy()
+    df_staging['file_id'] = file_id
+    return df_staging
+
+def load_staged_transactions(conn, file_id, schema='unica_transactions'):
+    """Move as linhas do arquivo da staging para dimensões e fato em comandos únicos.
+
+    Roda na transação do arquivo: dimensões com INSERT ... SELECT DISTINCT ...
+    ON CONFLICT DO NOTHING, a fato com um INSERT ... SELECT e, por fim, a
+    remoção das linhas do arquivo na staging. Retorna o número de transações inseridas.
+    """
+    staging = f"{schema}.transacoes_staging"
+    queries = [
+        f"""
+        INSERT INTO {schema}.tempo (data, dia_semana, mes, ano)
+        SELECT DISTINCT data_transacao::date, to_char(data_transacao, 'FMDay'),
+            EXTRACT(MONTH FROM data_transacao)::int, EXTRACT(YEAR FROM data_transacao)::int
+        FROM {staging} WHERE file_id = %(file_id)s
+        ON CONFLICT (data) DO NOTHING
+        """,
+        f"""
+        INSERT INTO {schema}.loja (identificacao_loja, codigo_ec_venda, codigo_ec_pagamento, cnpj_ec_pagamento)
+        SELECT DISTINCT ON (identificacao_loja)
+            identificacao_loja, codigo_ec_venda, codigo_ec_pagamento, cnpj_ec_pagamento
+        FROM {staging} WHERE file_id = %(file_id)s
+        ORDER BY identificacao_loja, {STAGING_ORDER_COLUMN}
+        ON CONFLICT (identificacao_loja) DO NOTHING
+        """,
+        f"""
+        INSERT INTO {schema}.produto (codigo_produto, descricao)
+        SELECT DISTINCT codigo_produto, codigo_produto
+        FROM {staging} WHERE file_id = %(file_id)s
+        ON CONFLICT (codigo_produto) DO NOTHING
+        """,
+        f"""
+        INSERT INTO {schema}.pagamento (codigo_bandeira, tipo_pagamento)
+        SELECT DISTINCT ON (codigo_bandeira) codigo_bandeira, tipo_transacao
+        FROM {staging} WHERE file_id = %(file_id)s
+        ORDER BY codigo_bandeira, {STAGING_ORDER_COLUMN}
+        ON CONFLICT (codigo_bandeira) DO NOTHING
+        """,
+    ]
+    columns = ', '.join(FACT_COLUMNS)
+    with conn.cursor() as cur:
+        for query in queries:
+            cur.execute(query, {'file_id': file_id})
+        cur.execute(
+            f"""
+            INSERT INTO {schema}.transacoes ({columns}, file_id)
+            SELECT {columns}, file_id FROM {staging} WHERE file_id = %(file_id)s
+            """,
+            {'file_id': file_id}
+        )
+        inserted = cur.rowcount
+        cur.execute(f"DELETE FROM {staging} WHERE file_id = %(file_id)s", {'file_id': file_id})
+    return inserted
+
+def exceeds_rejection_limit(total_rejected, total_rows, max_rate=MAX_REJECTED_RATE):
+    """Verdadeiro quando as linhas rejeitadas passam da fração tolerada e o arquivo deve ser recusado"""
+    return total_rejected > 0 and total_rejected > max_rate * total_rows
+
+def iter_validated_chunks(extrato, file_name, cache_key=None):
+    """Gera (bloco de transações validado, linhas em quarentena ou None), gravando no cache de parse.
+
+    Em erro de validação gera (lista de erros, None) e para; a entrada de cache só é
+    publicada quando todos os blocos passaram sem nenhuma linha em quarentena.
+    """
+    writer = parse_cache.CacheWriter(cache_key) if cache_key else None
+    if FUSED_VALIDATION:
+        chunks = extrato.iter_fused_chunks(chunk_rows=CHUNK_ROWS)
+    else:
+        chunks = ((df_chunk, None) for df_chunk in extrato.iter_chunks(chunk_rows=CHUNK_ROWS))
+
+    for df_transacoes, byte_columns in chunks:
+        df_transacoes['file_name'] = file_name
+
+        transacoes_transformer = TransformerTrasacoes(
+            dataframe=df_transacoes, byte_columns=byte_columns, quarantine=QUARANTINE
+        )
+        df_transacoes_validated = transacoes_transformer.validate_all()
+        df_rejected = transacoes_transformer.rejected
+
+        if isinstance(df_transacoes_validated, list):
+            if writer:
+                writer.discard()
+            yield df_transacoes_validated, None
+            return
+
+        if writer and df_rejected is not None and not df_rejected.empty:
+            writer.discard()
+            writer = None
+        if writer:
+            writer.add(df_transacoes_validated)
+        yield df_transacoes_validated, df_rejected
+
+    if writer:
+        writer.commit()
+
+def open_validated_chunks(extrato, file_name, local_file_path, versao_layout):
+    """Retorna (blocos, pendentes): blocos do cache de parse ou validados agora.
+
+    pendentes é o gerador da validação (None quando veio do cache), para
+    complete_cache em caso de falha no banco.
+    """
+    # Reprocessamento do mesmo conteúdo usa os blocos já validados
+    cache_key = None
+    if parse_cache.enabled():
+        cache_key = parse_cache.make_key(
+            parse_cache.file_digest(local_file_path), 'EXTRATO', versao_layout, CACHE_DEFINITIONS
+        )
+        cached = parse_cache.load(cache_key)
+        if cached is not None:
+            return ((df_chunk, None) for df_chunk in cached), None
+    chunks = iter_validated_chunks(extrato, file_name, cache_key)
+    return chunks, chunks
+
+def iter_parsed_chunks(file_name, local_file_path):
+    """Blocos validados do arquivo, sem tocar no banco (estágio de parse do pipeline)"""
+    extrato = ExtratoTransacao(file_path=local_file_path)
+    df_header, _ = extrato.process_metadata()
+    if df_header.empty:
+        return
+    chunks, _ = open_validated_chunks(extrato, file_name, local_file_path, df_header['versao_layout'].iloc[0])
+    yield from chunks
+
+def complete_cache(chunks):
+    """Consome os blocos restantes para publicar a entrada de cache após uma falha no banco"""
+    if chunks is None:
+        return
+    try:
+        for _ in chunks:
+            pass
+    except Exception as e:
+        logger.warning(f"Cache de parse não gravado: {e}")
+
 def insert_dimension_if_not_exists(df_dimension, table_name, key_column, connection_params, conn=None):
-    """Insere registros na tabela dimensional se não existirem"""
+    """Insere registros na tabela dimensional se não existirem
+
+    As chaves do lote vão por COPY para uma tabela temporária e entram com
+    ON CONFLICT DO NOTHING: o custo depende do lote, não do tamanho da dimensão.
+    """
     try:
         if conn is None:
-            conn = psycopg2.connect(
-                host=connection_params['host'],
-                port=connection_params['port'],
-                user=connection_params['user'],
-                password=connection_params['password'],
-                database=connection_params['database']
-            )
-            conn.autocommit = False
+            conn = acquire_connection(connection_params)
             should_close = True
         else:
             should_close = False
 
-        existing_records = get_existing_records(
+        # Uma linha por chave (a primeira, como no INSERT linha a linha)
+        new_records = df_dimension.drop_duplicates(subset=key_column)
+
+        inserted = insert_df_to_db(
             user=connection_params['user'],
             host=connection_params['host'],
             password=connection_params['password'],
@@ -84,105 +265,50 @@ def insert_dimension_if_not_exists(df_dimension, table_name, key_column, connect
             port=connection_params['port'],
             schema='unica_transactions',
             table=table_name,
-            key_column=key_column,
-            conn=conn
+            df=new_records,
+            conn=conn,
+            conflict_column=key_column
         )
-        
-        # Filtra apenas registros novos
-        new_records = df_dimension[~df_dimension[key_column].isin(existing_records)]
-        
-        if not new_records.empty:
-            insert_df_to_db(
-                user=connection_params['user'],
-                host=connection_params['host'],
-                password=connection_params['password'],
-                database=connection_params['database'],
-                port=connection_params['port'],
-                schema='unica_transactions',
-                table=table_name,
-                df=new_records,
-                conn=conn
-            )
-            logger.info(f"{len(new_records)} novos registros inseridos na tabela {table_name}.")
+        if inserted:
+            logger.info(f"{inserted} novos registros inseridos na tabela {table_name}.")
         else:
             logger.info(f"Nenhum novo registro para inserir na tabela {table_name}.")
 
         if should_close:
-            conn.close()
+            release_connection(conn)
 
     except Exception as e:
         if should_close and conn:
-            conn.close()
+            release_connection(conn)
         raise e
 
-def insert_df_to_db(user, host, password, database, port, schema, table, df, conn=None):
-    """Insere DataFrame no banco de dados"""
-    try:
-        if conn is None:
-            conn = psycopg2.connect(
-                host=host,
-                port=port,
-                user=user,
-                password=password,
-                database=database
-            )
-            conn.autocommit = False
-            should_close = True
-        else:
-            should_close = False
-
-        # Converte DataFrame para lista de tuplas
-        records = [tuple(x) for x in df.to_numpy()]
-        
-        # Obtém nomes das colunas
-        columns = ', '.join(df.columns)
-        
-        # Cria string de placeholders
-        placeholders = ', '.join(['%s'] * len(df.columns))
-        
-        # Query de inserção
-        query = f"INSERT INTO {schema}.{table} ({columns}) VALUES ({placeholders})"
-        
-        # Executa inserção
-        with conn.cursor() as cur:
-            cur.executemany(query, records)
-        
-        if should_close:
-            conn.close()
-
-    except Exception as e:
-        if should_close and conn:
-            conn.close()
-        raise e
+def insert_df_to_db(user, host, password, database, port, schema, table, df, conn=None, cents_columns=(),
+                    conflict_column=None):
+    """Insere DataFrame no banco de dados
 
-def get_existing_records(user, host, password, database, port, schema, table, key_column, conn=None):
-    """Obtém registros existentes da tabela"""
+    Usa COPY (utils.connection_db.copy_df_to_db). Colunas em cents_columns são
+    enviadas como centavos formatados em decimal, sem passar por float. Com
+    conflict_column, linhas cuja chave já existe (inclusive inseridas por outro
+    arquivo em paralelo) são ignoradas. Retorna o número de linhas inseridas.
+    """
     try:
         if conn is None:
-            conn = psycopg2.connect(
-                host=host,
-                port=port,
-                user=user,
-                password=password,
-                database=database
-            )
-            conn.autocommit = False
+            conn = acquire_connection(dict(host=host, port=port, user=user, password=password, database=database))
             should_close = True
         else:
             should_close = False
 
-        with conn.cursor() as cur:
-            cur.execute(f"SELECT {key_column} FROM {schema}.{table}")
-            existing_records = [row[0] for row in cur.fetchall()]
-        
+        # COPY em lote; colunas Categorical viram o texto de cada linha só aqui
+        inserted = copy_df_to_db(conn, schema, table, df, cents_columns=cents_columns, conflict_column=conflict_column)
+
         if should_close:
-            conn.close()
+            release_connection(conn)
 
-        return existing_records
+        return inserted
 
     except Exception as e:
         if should_close and conn:
-            conn.close()
+            release_connection(conn)
         raise e
 
 def register_file_processing(user, host, password, database, port, file_name, data_geracao, 
@@ -190,64 +316,44 @@ def register_file_processing(user, host, password, database, port, file_name, da
     """Registra o processamento de um arquivo"""
     try:
         if conn is None:
-            conn = psycopg2.connect(
-                host=host,
-                port=port,
-                user=user,
-                password=password,
-                database=database
-            )
-            conn.autocommit = False
+            conn = acquire_connection(dict(host=host, port=port, user=user, password=password, database=database))
             should_close = True
         else:
             should_close = False
 
         with conn.cursor() as cur:
-            cur.execute(
-                f"""
-                INSERT INTO {schema}.controle_arquivos 
-                (nome_arquivo, data_geracao, data_processamento, status_processamento, 
-                erro_processamento, arquivo_google_drive_path)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                RETURNING id
-                """,
-                (file_name, data_geracao, datetime.now(), status, error, google_drive_path)
-            )
-            file_id = cur.fetchone()[0]
+            file_id = upsert_file_record(cur, file_name, data_geracao, status, error, google_drive_path, schema)
         
         if should_close:
-            conn.close()
+            release_connection(conn)
 
         return file_id
 
     except Exception as e:
         if should_close and conn:
-            conn.close()
+            release_connection(conn)
         raise e
 
-def process_file(file_name, local_file_path, s3_uri, connection_params, is_tryout=False):
-    """Processa um arquivo individual"""
+def process_file(file_name, local_file_path, s3_uri, connection_params, is_tryout=False, chunks=None):
+    """Processa um arquivo individual
+
+    chunks: blocos (df validado, rejeitados) já produzidos por outro estágio
+    (ver iter_parsed_chunks); sem eles o arquivo é lido e validado aqui.
+    """
     conn = None
+    pending_chunks = None
     try:
         # Estabelece conexão com o banco
-        conn = psycopg2.connect(
-            host=connection_params['host'],
-            port=connection_params['port'],
-            user=connection_params['user'],
-            password=connection_params['password'],
-            database=connection_params['database']
-        )
-        
-        conn.autocommit = False
+        conn = acquire_connection(connection_params)
         extrato = ExtratoTransacao(file_path=local_file_path)
-        df_header, df_transacoes, df_trailer = extrato.process_file()
+        df_header, df_trailer = extrato.process_metadata()
 
         df_header = df_header[['codigo_registro', 'versao_layout', 'data_geracao',
                             'hora_geracao', 'tipo_processamento', 'destinatario']]
         df_summary_processing = pd.concat([df_header, df_trailer[['total_registros']]], axis=1)
         df_summary_processing['file_path'] = s3_uri
         df_summary_processing['file_name'] = file_name
-        df_transacoes['file_name'] = file_name
+        data_geracao = pd.to_datetime(df_header['data_geracao'].iloc[0]).date()
 
         if not (
             (df_summary_processing['codigo_registro'] == 'A0').all() and
@@ -258,48 +364,21 @@ def process_file(file_name, local_file_path, s3_uri, connection_params, is_tryou
             register_file_processing(
                 **connection_params,
                 file_name=file_name,
-                data_geracao=pd.to_datetime(df_header['data_geracao'].iloc[0]).date(),
-                status='ERRO',
-                error=error_msg,
-                google_drive_path=s3_uri,
-                conn=conn
-            )
-            return False
-
-        transacoes_transformer = TransformerTrasacoes(dataframe=df_transacoes)
-        df_transacoes_validated = transacoes_transformer.validate_all()
-        
-        if isinstance(df_transacoes_validated, list):
-            error_msg = "\n".join(df_transacoes_validated)
-            logger.error(f"Erros de validação no arquivo {file_name}:")
-            for error in df_transacoes_validated:
-                logger.error(f"  - {error}")
-            register_file_processing(
-                **connection_params,
-                file_name=file_name,
-                data_geracao=pd.to_datetime(df_header['data_geracao'].iloc[0]).date(),
+                data_geracao=data_geracao,
                 status='ERRO',
                 error=error_msg,
                 google_drive_path=s3_uri,
                 conn=conn
             )
+            conn.commit()
             return False
 
-        df_tempo, df_loja, df_produto, df_pagamento = prepare_dimension_tables(df_transacoes_validated)
-        
-        # Inserir dimensões e obter IDs
-        insert_dimension_if_not_exists(df_tempo, 'tempo', 'data', connection_params, conn)
-        insert_dimension_if_not_exists(df_loja, 'loja', 'identificacao_loja', connection_params, conn)
-        insert_dimension_if_not_exists(df_produto, 'produto', 'codigo_produto', connection_params, conn)
-        insert_dimension_if_not_exists(df_pagamento, 'pagamento', 'codigo_bandeira', connection_params, conn)
-        
-        df_fact = prepare_fact_table(df_transacoes_validated)
-
-        # Registrar processamento do arquivo e obter file_id
+        # Registrar processamento do arquivo e obter file_id; se algum bloco
+        # falhar a transação inteira é desfeita, inclusive este registro
         file_id = register_file_processing(
             **connection_params,
             file_name=file_name,
-            data_geracao=pd.to_datetime(df_header['data_geracao'].iloc[0]).date(),
+            data_geracao=data_geracao,
             status='SUCESSO',
             google_drive_path=s3_uri,
             conn=conn
@@ -308,20 +387,116 @@ def process_file(file_name, local_file_path, s3_uri, connection_params, is_tryou
         if not file_id:
             raise Exception("Falha ao registrar processamento do arquivo")
 
-        df_fact['file_id'] = file_id
+        # No pipeline os blocos chegam já validados pelo estágio de parse
+        if chunks is None:
+            chunks, pending_chunks = open_validated_chunks(
+                extrato, file_name, local_file_path, df_header['versao_layout'].iloc[0]
+            )
 
-        # Inserir dados na tabela de fatos
-        insert_df_to_db(
-            **connection_params,
-            schema='unica_transactions',
-            table='transacoes',
-            df=df_fact,
-            conn=conn
-        )
-        logger.info(f"{len(df_fact)} transações inseridas na tabela transacoes.")
+        # Chaves de dimensão inseridas por este arquivo só entram no cache após o commit
+        dimension_keys = dimension_cache.DimensionKeys(conn, DIMENSIONS)
+
+        total_inserted = 0
+        total_rejected = 0
+        staged_rows = 0
+        for df_transacoes_validated, df_rejected in chunks:
+            if isinstance(df_transacoes_validated, list):
+                conn.rollback()
+                error_msg = "\n".join(df_transacoes_validated)
+                logger.error(f"Erros de validação no arquivo {file_name}:")
+                for error in df_transacoes_validated:
+                    logger.error(f"  - {error}")
+                register_file_processing(
+                    **connection_params,
+                    file_name=file_name,
+                    data_geracao=data_geracao,
+                    status='ERRO',
+                    error=error_msg,
+                    google_drive_path=s3_uri,
+                    conn=conn
+                )
+                conn.commit()
+                return False
+
+            if df_rejected is not None and not df_rejected.empty:
+                df_quarentena = df_rejected.copy()
+                df_quarentena['file_id'] = file_id
+                insert_df_to_db(
+                    **connection_params,
+                    schema='unica_transactions',
+                    table='transacoes_quarentena',
+                    df=df_quarentena,
+                    conn=conn
+                )
+                total_rejected += df_rejected['linha'].nunique()
+
+            if LOAD_MODE == 'staging':
+                insert_df_to_db(
+                    **connection_params,
+                    schema='unica_transactions',
+                    table='transacoes_staging',
+                    df=prepare_staging_table(df_transacoes_validated, file_id),
+                    conn=conn,
+                    cents_columns=CENTS_COLUMNS
+                )
+                staged_rows += len(df_transacoes_validated)
+                continue
+
+            # Inserir dimensões; só chaves que o cache ainda não conhece vão ao banco
+            for df_dimension, (table_name, key_column) in zip(
+                prepare_dimension_tables(df_transacoes_validated), DIMENSIONS
+            ):
+                df_new = dimension_keys.new_rows(df_dimension, table_name, key_column)
+                insert_dimension_if_not_exists(df_new, table_name, key_column, connection_params, conn)
+                dimension_keys.add(table_name, df_new[key_column])
+
+            df_fact = prepare_fact_table(df_transacoes_validated)
+            df_fact['file_id'] = file_id
+
+            # Inserir dados na tabela de fatos
+            insert_df_to_db(
+                **connection_params,
+                schema='unica_transactions',
+                table='transacoes',
+                df=df_fact,
+                conn=conn,
+                cents_columns=CENTS_COLUMNS
+            )
+            total_inserted += len(df_fact)
+
+        total_rows = total_inserted + staged_rows + total_rejected
+        if exceeds_rejection_limit(total_rejected, total_rows):
+            conn.rollback()
+            error_msg = (
+                f"{total_rejected} de {total_rows} linhas rejeitadas na validação "
+                f"(limite de {MAX_REJECTED_RATE:.2%}); detalhes no log do processamento."
+            )
+            logger.error(f"Arquivo {file_name} recusado: {error_msg}")
+            register_file_processing(
+                **connection_params,
+                file_name=file_name,
+                data_geracao=data_geracao,
+                status='ERRO',
+                error=error_msg,
+                google_drive_path=s3_uri,
+                conn=conn
+            )
+            conn.commit()
+            return False
+
+        if staged_rows:
+            total_inserted += load_staged_transactions(conn, file_id)
+
+        # Estado atual por parcela, na mesma transação das linhas da fato
+        update_current_parcels(conn, file_id)
+
+        logger.info(f"{total_inserted} transações inseridas na tabela transacoes.")
+        if total_rejected:
+            logger.warning(f"{total_rejected} linhas do arquivo {file_name} gravadas em transacoes_quarentena.")
 
         # Se chegou até aqui sem erros, commit a transação
         conn.commit()
+        dimension_keys.commit()
 
         if not is_tryout:
             # S3-only: sempre envia para S3 usando a URI informada
@@ -340,30 +515,43 @@ def process_file(file_name, local_file_path, s3_uri, connection_params, is_tryou
         return True
 
     except Exception as e:
-        # Em caso de erro, rollback na transação
-        if conn:
-            conn.rollback()
+        # Em caso de erro, rollback na transação (a conexão pode ter caído)
+        if conn and not conn.closed:
+            try:
+                conn.rollback()
+            except Exception as rollback_error:
+                logger.error(f"Erro ao desfazer transação: {rollback_error}")
+        if isinstance(e, ForeignKeyViolation):
+            # Chave de dimensão em cache já não existe no banco: recarrega na próxima tentativa
+            dimension_cache.reset()
             
         error_msg = str(e)
         logger.error(f"Erro ao processar arquivo {file_name}: {error_msg}")
+        complete_cache(pending_chunks)
         
-        # Registrar erro usando uma nova conexão
+        # Registrar erro com uma conexão do pool (a do arquivo pode ter caído); o ERRO
+        # confirmado encerra a reserva e libera o arquivo para reprocessamento
         try:
-            register_file_processing(
-                **connection_params,
-                file_name=file_name,
-                data_geracao=datetime.now().date(),  # Data atual como fallback
-                status='ERRO',
-                error=error_msg,
-                google_drive_path=s3_uri
-            )
+            if conn:
+                release_connection(conn)
+                conn = None
+            with pooled_connection(connection_params) as err_conn:
+                register_file_processing(
+                    **connection_params,
+                    file_name=file_name,
+                    data_geracao=datetime.now().date(),  # Data atual como fallback
+                    status='ERRO',
+                    error=error_msg,
+                    google_drive_path=s3_uri,
+                    conn=err_conn
+                )
         except Exception as register_error:
             logger.error(f"Erro ao registrar erro de processamento: {register_error}")
             
         return False
     finally:
         if conn:
-            conn.close()
+            release_connection(conn)
 
 def analyze_files_to_process(sftp_files, s3_files, db_status):
     """Analisa quais arquivos precisam ser processados baseado em diferentes cenários"""
@@ -389,6 +577,15 @@ def analyze_files_to_process(sftp_files, s3_files, db_status):
             logger.info(f"Arquivo encontrado no S3 sem registro no banco: {file}")
             continue
             
+        # Arquivo reservado por outro worker: só volta à fila quando a reserva vencer
+        if file in db_status and db_status[file]['status'] == 'PROCESSANDO':
+            if db_status[file].get('reserva_vencida'):
+                files_to_process.append(file)
+                logger.info(f"Arquivo com reserva de processamento vencida: {file}")
+            else:
+                logger.info(f"Arquivo em processamento por outro worker: {file}")
+            continue
+
         # Cenário 3: Arquivo está registrado com erro no banco
         if file in db_status and db_status[file]['status'] == 'ERRO':
             files_to_process.append(file)
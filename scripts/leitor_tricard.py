@@ -1,6 +1,13 @@
-import psycopg2
 from datetime import datetime
 from scripts.reading_tricard import ExtratoTricard, parse_tricard_date
+from scripts.layouts import LAYOUTS
+from utils.connection_db import (
+    acquire_connection,
+    copy_df_to_db,
+    pooled_connection,
+    release_connection,
+    upsert_file_record
+)
 from utils.logger import setup_logger
 
 logger = setup_logger("leitor_tricard")
@@ -12,6 +19,13 @@ FILE_TYPE_TABLE = {
     'SALDO': 'tricard_saldos',
 }
 
+# Valores 9(13)V99 chegam do parser em centavos inteiros e viram decimal(15,2) no banco
+CENTS_COLUMNS = {
+    field.name
+    for (family, _, _), fields in LAYOUTS.items() if family == 'TRICARD'
+    for field in fields if field.type == 'amount'
+}
+
 
 def detect_tricard_type(file_name):
     """Detecta o tipo de arquivo TRICARD pelo nome"""
@@ -24,56 +38,58 @@ def detect_tricard_type(file_name):
     return None
 
 
-def insert_df_to_db(conn, schema, table, df):
-    """Insere DataFrame no banco usando conexão compartilhada"""
-    records = [tuple(x) for x in df.to_numpy()]
-    columns = ', '.join(df.columns)
-    placeholders = ', '.join(['%s'] * len(df.columns))
-    query = f"INSERT INTO {schema}.{table} ({columns}) VALUES ({placeholders})"
-    with conn.cursor() as cur:
-        cur.executemany(query, records)
+def insert_df_to_db(conn, schema, table, df, cents_columns=()):
+    """Insere DataFrame no banco usando conexão compartilhada
+
+    Usa COPY (utils.connection_db.copy_df_to_db): colunas em cents_columns vão
+    em centavos formatados em decimal; datas NaT e valores ausentes viram NULL.
+    """
+    copy_df_to_db(conn, schema, table, df, cents_columns=cents_columns)
 
 
 def register_file_processing(conn, file_name, data_geracao, status, error=None, s3_uri=None):
-    """Registra processamento na controle_arquivos e retorna file_id"""
+    """Registra processamento na controle_arquivos (atualizando a reserva, se houver) e retorna file_id"""
     with conn.cursor() as cur:
-        cur.execute(
-            """
-            INSERT INTO unica_transactions.controle_arquivos
-            (nome_arquivo, data_geracao, data_processamento, status_processamento,
-            erro_processamento, arquivo_google_drive_path)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            RETURNING id
-            """,
-            (file_name, data_geracao, datetime.now(), status, error, s3_uri)
-        )
-        return cur.fetchone()[0]
-
-
-def process_tricard_file(file_name, local_file_path, s3_uri, connection_params, is_tryout=False):
-    """Processa um arquivo TRICARD (VENDA, FINANCEIRO ou SALDO)"""
+        return upsert_file_record(cur, file_name, data_geracao, status, error, s3_uri)
+
+
+def iter_parsed_tricard(file_name, local_file_path):
+    """Gera o único item (header, df) do arquivo, sem tocar no banco (estágio de parse do pipeline)"""
+    file_type = detect_tricard_type(file_name)
+    if file_type:
+        yield ExtratoTricard(file_path=local_file_path, file_type=file_type).process_file()
+
+
+def process_tricard_file(file_name, local_file_path, s3_uri, connection_params, is_tryout=False, parsed=None):
+    """Processa um arquivo TRICARD (VENDA, FINANCEIRO ou SALDO)
+
+    parsed: iterável com o (header, df) já lido por outro estágio (ver iter_parsed_tricard).
+    """
     conn = None
     file_type = detect_tricard_type(file_name)
 
     if not file_type:
-        logger.error(f"Tipo TRICARD não reconhecido no arquivo: {file_name}")
+        error_msg = f"Tipo TRICARD não reconhecido no arquivo: {file_name}"
+        logger.error(error_msg)
+        # O arquivo já foi reservado: sem o ERRO ficaria PROCESSANDO até a reserva vencer
+        try:
+            with pooled_connection(connection_params) as err_conn:
+                register_file_processing(err_conn, file_name, datetime.now().date(), 'ERRO', error_msg, s3_uri)
+        except Exception as register_error:
+            logger.error(f"Erro ao registrar erro de processamento: {register_error}")
         return False
 
     table_name = FILE_TYPE_TABLE[file_type]
 
     try:
-        conn = psycopg2.connect(
-            host=connection_params['host'],
-            port=connection_params['port'],
-            user=connection_params['user'],
-            password=connection_params['password'],
-            database=connection_params['database']
-        )
-        conn.autocommit = False
+        conn = acquire_connection(connection_params)
 
         # Parse do arquivo
-        extrato = ExtratoTricard(file_path=local_file_path, file_type=file_type)
-        header, df = extrato.process_file()
+        if parsed is not None:
+            header, df = next(iter(parsed))
+        else:
+            extrato = ExtratoTricard(file_path=local_file_path, file_type=file_type)
+            header, df = extrato.process_file()
 
         if header is None:
             error_msg = f"Falha ao parsear header do arquivo {file_name}"
@@ -107,7 +123,7 @@ def process_tricard_file(file_name, local_file_path, s3_uri, connection_params,
         df['file_id'] = file_id
 
         # Inserir no banco
-        insert_df_to_db(conn, 'unica_transactions', table_name, df)
+        insert_df_to_db(conn, 'unica_transactions', table_name, df, cents_columns=CENTS_COLUMNS)
         logger.info(f"{len(df)} registros inseridos na tabela {table_name} do arquivo {file_name}")
 
         conn.commit()
@@ -118,24 +134,22 @@ def process_tricard_file(file_name, local_file_path, s3_uri, connection_params,
         return True
 
     except Exception as e:
-        if conn:
-            conn.rollback()
+        if conn and not conn.closed:
+            try:
+                conn.rollback()
+            except Exception as rollback_error:
+                logger.error(f"Erro ao desfazer transação: {rollback_error}")
 
         error_msg = str(e)
         logger.error(f"Erro ao processar arquivo TRICARD {file_name}: {error_msg}")
 
-        # Registrar erro com nova conexão
+        # Registrar erro com uma conexão do pool (a do arquivo pode ter caído)
         try:
-            err_conn = psycopg2.connect(
-                host=connection_params['host'],
-                port=connection_params['port'],
-                user=connection_params['user'],
-                password=connection_params['password'],
-                database=connection_params['database']
-            )
-            err_conn.autocommit = True
-            register_file_processing(err_conn, file_name, datetime.now().date(), 'ERRO', error_msg, s3_uri)
-            err_conn.close()
+            if conn:
+                release_connection(conn)
+                conn = None
+            with pooled_connection(connection_params) as err_conn:
+                register_file_processing(err_conn, file_name, datetime.now().date(), 'ERRO', error_msg, s3_uri)
         except Exception as register_error:
             logger.error(f"Erro ao registrar erro de processamento: {register_error}")
 
@@ -143,7 +157,7 @@ def process_tricard_file(file_name, local_file_path, s3_uri, connection_params,
 
     finally:
         if conn:
-            conn.close()
+            release_connection(conn)
 
 
 def _upload_to_s3(s3_uri, local_file_path):
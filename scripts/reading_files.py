@@ -1,33 +1,61 @@
+import os
+import numpy as np
 import pandas as pd
+from scripts.fixed_width import NEWLINE, map_file, split_records, record_codes
+from scripts.layouts import get_extractor
 from utils.logger import setup_logger
 
 logger = setup_logger("reading_files")
 
+# Tamanho aproximado de um registro, usado para dimensionar a leitura em blocos
+RECORD_SIZE_HINT = 400
+# Bytes lidos do fim do arquivo para localizar o trailer
+TRAILER_TAIL_BYTES = 4096
+
+
 class ExtratoTransacao:
     def __init__(self, file_path):
         self.file_path = file_path
         self.data = None
-        self.transacoes = []
-    
+        self.versao_layout = None
+        self.transacoes = pd.DataFrame()
+
     def load_file(self):
-        with open(self.file_path, 'r', encoding='latin-1') as f:
-            self.data = f.readlines()
-    
+        # Os registros são lidos direto do arquivo mapeado; só o texto dos campos é decodificado
+        self.buffer, self.starts, self.lengths = split_records(map_file(self.file_path))
+        self.codes = record_codes(self.buffer, self.starts, self.lengths, 2)
+        # Header e trailer continuam disponíveis como texto
+        self.data = [self.record_text(0), self.record_text(-1)] if len(self.starts) else []
+
+    def load_metadata(self):
+        """Lê apenas o header e o trailer, sem carregar o arquivo inteiro"""
+        with open(self.file_path, 'rb') as f:
+            header = f.readline()
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(size - TRAILER_TAIL_BYTES, 0))
+            tail = f.read()
+
+        if not header:
+            self.data = []
+            return
+        buffer, starts, lengths = split_records(tail)
+        start, length = starts[-1], lengths[-1]
+        self.data = [
+            header.rstrip(b'\r\n').decode('latin-1'),
+            buffer[start:start + length].tobytes().decode('latin-1')
+        ]
+
+    def record_text(self, index):
+        start = self.starts[index]
+        return self.buffer[start:start + self.lengths[index]].tobytes().decode('latin-1')
+
     def parse_header(self):
         header = self.data[0]
         if header.startswith("A0"):
-            return {
-                'codigo_registro': header[0:2],
-                'versao_layout': header[2:8],
-                'data_geracao': header[8:16],
-                'hora_geracao': header[16:22],
-                'id_movimento': header[22:28],
-                'nome_admin': header[28:58].strip(),
-                'remetente': header[58:62],
-                'destinatario': header[62:71],
-                'tipo_processamento': header[71:72],
-                'nseq_registro': header[72:78]
-            }
+            header_info = get_extractor('EXTRATO', 'A0').parse_line(header)
+            self.versao_layout = header_info['versao_layout']
+            return header_info
         else:
             logger.error("Cabeçalho não encontrado ou inválido.")
             return None
@@ -35,84 +63,87 @@ class ExtratoTransacao:
     def parse_trailer(self):
         trailer = self.data[-1]
         if trailer.startswith("A9"):
-            return {
-                'codigo_registro': trailer[0:2],
-                'total_registros': trailer[2:8],
-                'nseq_registro': trailer[8:14]
-            }
+            return get_extractor('EXTRATO', 'A9', self.versao_layout).parse_line(trailer)
         else:
             logger.error("Trailer não encontrado ou inválido.")
             return None
 
-    def parse_transacao(self, transacao):
-        def parse_numeric_field(value, decimal_places=2):
-            if value.strip().isdigit():
-                integer_part = value[:-decimal_places]
-                decimal_part = value[-decimal_places:]
-                return f"{int(integer_part)}.{decimal_part}"
-            return value.strip()
-        
-        return {
-            "codigo_registro": transacao[0:2].strip(),
-            "identificacao_loja": transacao[2:17].strip().zfill(15),
-            "nsu_host_transacao": transacao[17:29].strip(),
-            "data_transacao": transacao[29:37].strip(),
-            "horario_transacao": transacao[37:43].strip(),
-            "tipo_lancamento": transacao[43:44].strip(),
-            "data_lancamento": transacao[44:52].strip(),
-            "tipo_produto": transacao[52:53].strip(),
-            "meio_captura": transacao[53:54].strip(),
-            "valor_bruto_venda": parse_numeric_field(transacao[54:65].strip()),
-            "valor_desconto": parse_numeric_field(transacao[65:76].strip()),
-            "valor_liquido_venda": parse_numeric_field(transacao[76:87].strip()),
-            "numero_cartao": transacao[87:106].strip().zfill(19),
-            "numero_parcela": transacao[106:108].strip().zfill(2),
-            "numero_total_parcelas": transacao[108:110].strip().zfill(2),
-            "nsu_host_parcela": transacao[110:122].strip().zfill(12),
-            "valor_bruto_parcela": parse_numeric_field(transacao[122:133].strip()),
-            "valor_desconto_parcela": parse_numeric_field(transacao[133:144].strip()),
-            "valor_liquido_parcela": parse_numeric_field(transacao[144:155].strip()),
-            "banco": transacao[155:158].strip(),
-            "agencia": transacao[158:164].strip(),
-            "conta": transacao[164:175].strip(),
-            "codigo_autorizacao": transacao[175:187].strip().zfill(12),
-            "codigo_bandeira": transacao[187:190].strip().zfill(3),
-            "codigo_produto": transacao[190:193].strip().zfill(3),
-            "valor_tx_interchange_tarifa": parse_numeric_field(transacao[193:204].strip()),
-            "valor_tx_administracao": parse_numeric_field(transacao[204:215].strip()),
-            "valor_tx_interchange_parcela": parse_numeric_field(transacao[215:226].strip()),
-            "valor_tx_administracao_parcela": parse_numeric_field(transacao[226:237].strip()),
-            "valor_redutor_multi_fronteira": parse_numeric_field(transacao[237:248].strip()),
-            "valor_tx_antecipacao": parse_numeric_field(transacao[248:259].strip()),
-            "valor_liquido_antecipado": parse_numeric_field(transacao[259:270].strip()),
-            "tipo_transacao": transacao[270:272].strip(),
-            "codigo_pedido": transacao[272:302].strip(),
-            "sigla_pais": transacao[302:305].strip(),
-            "reservado": transacao[305:356].strip(),
-            "codigo_ec_venda": transacao[305:314].strip(),
-            "codigo_ec_pagamento": transacao[314:323].strip(),
-            "cnpj_ec_pagamento": transacao[323:337].strip(),
-            "data_vencimento_original": transacao[337:345].strip(),
-            "indicador_deb_balance": transacao[345:346].strip(),
-            "indicador_reenvio": transacao[346:347].strip(),
-            "nsu_origem": transacao[347:353].strip(),
-            "reservado_final": transacao[353:356].strip(),
-            "numero_operacao_recebivel": transacao[356:376].strip(),
-            "sequencial_operacao_recebivel": transacao[376:378].strip(),
-            "tipo_operacao_recebivel": transacao[378:379].strip(),
-            "valor_operacao_recebivel": parse_numeric_field(transacao[379:390].strip()),
-            "nseq": transacao[390:396+1].strip()
-        }
-
     def parse_transacoes(self):
-        self.transacoes = []
-        for linha in self.data[1:-1]:  # Ignorar header e trailer
-            if linha.startswith("CV"):
-                transacao_info = self.parse_transacao(linha)
-                self.transacoes.append(transacao_info)
+        cv_rows = np.flatnonzero(self.codes[1:-1] == b'CV') + 1  # Ignorar header e trailer
+        self.transacoes = self.parse_cv_records(self.buffer, self.starts[cv_rows], self.lengths[cv_rows])
+
+    def parse_cv_records(self, buffer, starts, lengths, blocks=None):
+        """Extrai os registros CV coluna a coluna conforme o layout do arquivo"""
+        return get_extractor('EXTRATO', 'CV', self.versao_layout).to_dataframe(buffer, starts, lengths, blocks)
+
+    def iter_blocks(self, block_rows):
+        """Percorre o arquivo mapeado em blocos de ~block_rows registros completos.
+
+        Gera (buffer, starts, lengths, cv_rows) por bloco, onde buffer é uma view
+        sobre o mapeamento; header (primeiro registro) e trailer (último
+        registro) nunca entram em cv_rows.
+        """
+        block_size = max(block_rows, 1) * RECORD_SIZE_HINT
+        data = map_file(self.file_path)
+        size = data.size
+        pos = 0
+        while pos < size:
+            end = min(pos + block_size, size)
+            while True:
+                buffer, starts, lengths = split_records(data[pos:end])
+                if end == size or buffer[-1] == NEWLINE:
+                    next_pos = end
+                    break
+                if len(starts) > 1:
+                    # O último registro ficou incompleto e começa o próximo bloco
+                    next_pos = pos + starts[-1]
+                    starts, lengths = starts[:-1], lengths[:-1]
+                    break
+                end = min(end + block_size, size)
+
+            is_cv = record_codes(buffer, starts, lengths, 2) == b'CV'
+            if pos == 0 and len(is_cv):
+                is_cv[0] = False
+            if next_pos == size and len(is_cv):
+                is_cv[-1] = False
+            yield buffer, starts, lengths, np.flatnonzero(is_cv)
+            pos = next_pos
+
+    def iter_chunks(self, chunk_rows=50000):
+        """Gera DataFrames com no máximo chunk_rows transações, lendo o arquivo em blocos.
+
+        Header e trailer são lidos antes do primeiro bloco e ficam disponíveis em
+        self.header_info e self.trailer_info. O índice de cada bloco continua a
+        numeração das linhas do arquivo inteiro.
+        """
+        for df_chunk, _ in self._iter_chunks(chunk_rows, fused=False):
+            yield df_chunk
+
+    def iter_fused_chunks(self, chunk_rows=50000):
+        """Como iter_chunks, mas gera (DataFrame, blocos de bytes dos campos de texto).
+
+        Os blocos ({campo: matriz uint8}) vão junto para TransformerTrasacoes, que
+        valida tamanhos e dígitos direto nos bytes lidos do arquivo.
+        """
+        return self._iter_chunks(chunk_rows, fused=True)
+
+    def _iter_chunks(self, chunk_rows, fused):
+        self.load_metadata()
+        self.header_info = self.parse_header()
+        self.trailer_info = self.parse_trailer()
+
+        offset = 0
+        for buffer, starts, lengths, cv_rows in self.iter_blocks(chunk_rows):
+            for first in range(0, len(cv_rows), chunk_rows):
+                rows = cv_rows[first:first + chunk_rows]
+                blocks = {} if fused else None
+                df_chunk = self.parse_cv_records(buffer, starts[rows], lengths[rows], blocks)
+                df_chunk.index = pd.RangeIndex(offset, offset + len(df_chunk))
+                offset += len(df_chunk)
+                yield df_chunk, blocks
 
     def to_dataframe(self):
-        return pd.DataFrame(self.transacoes)
+        return self.transacoes
 
     def to_dataframe_header(self, header_info):
         return pd.DataFrame([header_info]) if header_info else pd.DataFrame()
@@ -137,5 +168,12 @@ class ExtratoTransacao:
         
         return df_header, df_transacoes, df_trailer
 
+    def process_metadata(self):
+        """Retorna (df_header, df_trailer) sem processar as transações"""
+        self.load_metadata()
+        df_header = self.to_dataframe_header(self.parse_header())
+        df_trailer = self.to_dataframe_trailer(self.parse_trailer())
+        return df_header, df_trailer
+
 
 
@@ -1,32 +1,149 @@
 """
 Refresh da conciliacao.
-Popula: deposito_diario, conciliacao_master.
+Popula: deposito_diario, conciliacao_master (a partir de transacoes_current).
 Chamado pelo main.py apos processamento de arquivos.
 """
 
 import logging
-import psycopg2
+import os
 from datetime import datetime
 
+from utils.connection_db import acquire_connection, release_connection, update_current_parcels
+
 logger = logging.getLogger("refresh_conciliacao")
 
+# Horas entre reconstruções completas; no intervalo o refresh só recalcula o que
+# os arquivos da execução tocaram (0 = sempre completo)
+FULL_REBUILD_HOURS = float(os.getenv('REFRESH_FULL_REBUILD_HOURS', '168'))
+
+
+def pending_files(conn):
+    """{id: data_processamento} dos arquivos carregados com sucesso que ainda não passaram por um refresh.
+
+    A pendência fica em controle_arquivos.refreshed_at (NULL até o refresh que
+    cobre o arquivo ser confirmado); um refresh que falha não perde o escopo.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT id, data_processamento FROM unica_transactions.controle_arquivos
+            WHERE status_processamento = 'SUCESSO' AND refreshed_at IS NULL
+            """
+        )
+        return dict(cur.fetchall())
+
+
+def mark_files_refreshed(conn, files):
+    """Marca os arquivos como cobertos pelo refresh.
+
+    Só vale para a carga lida em pending_files: um arquivo recarregado nesse
+    meio-tempo (data_processamento nova) continua pendente.
+    """
+    if not files:
+        return 0
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE unica_transactions.controle_arquivos c
+            SET refreshed_at = NOW()
+            FROM unnest(%s::uuid[], %s::timestamp[]) AS p(id, data_processamento)
+            WHERE c.id = p.id AND c.data_processamento = p.data_processamento
+              AND c.refreshed_at IS NULL
+            """,
+            ([str(file_id) for file_id in files], list(files.values()))
+        )
+        return cur.rowcount
+
+
+def full_rebuild_due(conn, etapa):
+    """True se a etapa nunca foi reconstruída por completo ou se já passou FULL_REBUILD_HOURS."""
+    if FULL_REBUILD_HOURS <= 0:
+        return True
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT ultimo_full_at < NOW() - %s * interval '1 hour'
+            FROM unica_transactions.refresh_controle
+            WHERE etapa = %s
+            """,
+            (FULL_REBUILD_HOURS, etapa)
+        )
+        row = cur.fetchone()
+    return row is None or row[0]
+
+
+def mark_full_rebuild(conn, etapa):
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO unica_transactions.refresh_controle (etapa, ultimo_full_at)
+            VALUES (%s, NOW())
+            ON CONFLICT (etapa) DO UPDATE SET ultimo_full_at = EXCLUDED.ultimo_full_at
+            """,
+            (etapa,)
+        )
+
+
+def rebuild_current_parcels(conn):
+    """Reconstrói transacoes_current a partir de toda a transacoes (rede de segurança da carga).
+
+    Sem TRUNCATE (lock exclusivo que pararia as cargas): remove as parcelas que
+    não existem mais na transacoes e regrava só as que divergem do cálculo.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            DELETE FROM unica_transactions.transacoes_current c
+            WHERE NOT EXISTS (
+                SELECT 1 FROM unica_transactions.transacoes t
+                WHERE t.nsu_host_transacao = c.nsu_host_transacao
+                  AND t.numero_parcela = c.numero_parcela
+            )
+            """
+        )
+        removed = cur.rowcount
+    count = update_current_parcels(conn, replace=True)
+    logger.info(f"transacoes_current: {count} parcelas corrigidas, {removed} removidas")
+    return count
+
+
+def affected_dates(conn, file_ids):
+    """Datas de liquidação que os arquivos podem ter alterado.
 
-def build_deposito_diario(conn):
-    """Agrega transacoes Liquidacao Normal por data e popula deposito_diario."""
+    Além das datas das linhas novas, entram as das linhas anteriores das mesmas
+    parcelas: a parcela que mudou de data sai do total da data antiga.
+    """
+    if not file_ids:
+        return []
     query = """
-    WITH latest_per_parcel AS (
-        SELECT DISTINCT ON (nsu_host_transacao, numero_parcela)
-            nsu_host_transacao,
-            numero_parcela,
-            numero_total_parcelas,
-            data_lancamento::date AS data_lancamento,
-            valor_liquido_parcela,
-            valor_liquido_venda,
-            tipo_lancamento
+    WITH touched AS (
+        SELECT DISTINCT nsu_host_transacao, numero_parcela
         FROM unica_transactions.transacoes
-        ORDER BY nsu_host_transacao, numero_parcela, created_at DESC
-    ),
-    aggregated AS (
+        WHERE file_id = ANY(%s::uuid[])
+    )
+    SELECT DISTINCT t.data_lancamento::date
+    FROM unica_transactions.transacoes t
+    JOIN touched USING (nsu_host_transacao, numero_parcela)
+    """
+    with conn.cursor() as cur:
+        cur.execute(query, ([str(file_id) for file_id in file_ids],))
+        return sorted(row[0] for row in cur.fetchall())
+
+
+def build_deposito_diario(conn, dates=None):
+    """Agrega transacoes Liquidacao Normal por data e popula deposito_diario.
+
+    Lê o estado atual de cada parcela em transacoes_current. Com `dates`,
+    recalcula só essas datas, zerando antes as que podem ter ficado sem parcelas.
+    """
+    if dates is not None and not dates:
+        logger.info("deposito_diario: nenhuma data afetada")
+        return 0
+
+    date_filter = "AND data_lancamento = ANY(%(dates)s)" if dates is not None else ""
+
+    query = f"""
+    WITH aggregated AS (
         SELECT
             data_lancamento AS data_liquidacao,
             SUM(
@@ -36,8 +153,8 @@ def build_deposito_diario(conn):
                 END
             ) AS total_liquido_esperado,
             COUNT(*) AS qtd_parcelas
-        FROM latest_per_parcel
-        WHERE tipo_lancamento = 'Liquidação Normal'
+        FROM unica_transactions.transacoes_current
+        WHERE tipo_lancamento = 'Liquidação Normal' {date_filter}
         GROUP BY data_lancamento
     )
     INSERT INTO unica_transactions.deposito_diario
@@ -50,14 +167,29 @@ def build_deposito_diario(conn):
         updated_at             = NOW()
     """
     with conn.cursor() as cur:
-        cur.execute(query)
+        if dates is not None:
+            cur.execute(
+                """
+                UPDATE unica_transactions.deposito_diario
+                SET total_liquido_esperado = 0, qtd_parcelas = 0, updated_at = NOW()
+                WHERE data_liquidacao = ANY(%(dates)s) AND qtd_parcelas <> 0
+                """,
+                {'dates': dates}
+            )
+        cur.execute(query, {'dates': dates})
         count = cur.rowcount
     logger.info(f"deposito_diario: {count} datas atualizadas")
     return count
 
 
 def match_deposito_extrato(conn):
-    """Faz match entre deposito_diario e extrato_juridica (Triangulo)."""
+    """Faz match entre deposito_diario e extrato_juridica (Triangulo).
+
+    O extrato é agregado por data a cada refresh (não há marca de alteração na
+    extrato_juridica); só as datas cujo extrato, valor ou diferença mudaram são
+    regravadas. Assim um lançamento novo ou alterado no extrato entra no
+    refresh seguinte, inclusive em datas que já tinham match.
+    """
     query_match = """
     UPDATE unica_transactions.deposito_diario dd
     SET
@@ -76,11 +208,13 @@ def match_deposito_extrato(conn):
             MIN(e.id)              AS extrato_id,
             SUM(e.valorlancamento) AS valor_extrato
         FROM public.extrato_juridica e
-        WHERE e.textodescricaohistorico LIKE '%%Triangulo%%'
-          AND e.textodescricaohistorico NOT LIKE '%%Antecipação%%'
+        WHERE e.textodescricaohistorico LIKE '%Triangulo%'
+          AND e.textodescricaohistorico NOT LIKE '%Antecipação%'
         GROUP BY e.datalancamento::date
     ) sub
     WHERE dd.data_liquidacao = sub.data
+      AND (dd.extrato_id, dd.valor_extrato, dd.diferenca)
+          IS DISTINCT FROM (sub.extrato_id, sub.valor_extrato, dd.total_liquido_esperado - sub.valor_extrato)
     """
     with conn.cursor() as cur:
         cur.execute(query_match)
@@ -99,151 +233,197 @@ def match_deposito_extrato(conn):
     return matched
 
 
-def refresh_conciliacao_master(conn):
-    """Popula conciliacao_master a partir de transacoes + antecipacao_override."""
-
-    query_portal = """
-    INSERT INTO unica_transactions.conciliacao_master
-        (nsu, parcela, data_venda, valor_bruto_venda, valor_liquido,
-         numero_total_parcelas, portal_last_status, portal_last_status_at,
-         data_liquidacao_portal, last_status)
-    SELECT
-        t.nsu_host_transacao,
-        t.numero_parcela,
-        t.data_transacao::date,
-        t.valor_bruto_venda,
-        CASE
-            WHEN t.numero_total_parcelas NOT IN ('0', '1', '') THEN t.valor_liquido_parcela
-            ELSE t.valor_liquido_venda
-        END,
-        t.numero_total_parcelas,
-        t.tipo_lancamento,
-        t.created_at,
-        CASE
-            WHEN t.tipo_lancamento = 'Liquidação Normal' THEN t.data_lancamento::date
-            ELSE NULL
-        END,
-        t.tipo_lancamento
-    FROM (
-        SELECT DISTINCT ON (nsu_host_transacao, numero_parcela) *
-        FROM unica_transactions.transacoes
-        ORDER BY nsu_host_transacao, numero_parcela, created_at DESC
-    ) t
-    ON CONFLICT (nsu, parcela) DO UPDATE SET
-        data_venda              = EXCLUDED.data_venda,
-        valor_bruto_venda       = EXCLUDED.valor_bruto_venda,
-        valor_liquido           = EXCLUDED.valor_liquido,
-        numero_total_parcelas   = EXCLUDED.numero_total_parcelas,
-        portal_last_status      = EXCLUDED.portal_last_status,
-        portal_last_status_at   = EXCLUDED.portal_last_status_at,
-        data_liquidacao_portal  = EXCLUDED.data_liquidacao_portal,
-        last_status             = EXCLUDED.portal_last_status,
-        antecipado              = FALSE,
-        data_antecipacao        = NULL,
-        valor_antecipado        = NULL,
-        updated_at              = NOW()
-    """
-    with conn.cursor() as cur:
-        cur.execute(query_portal)
-        portal_count = cur.rowcount
-    logger.info(f"conciliacao_master portal: {portal_count} registros")
+def stage_parcel_scope(conn, file_ids):
+    """Cria a tabela temporária conciliacao_escopo com as parcelas a recalcular no master.
 
-    query_previsao = """
-    UPDATE unica_transactions.conciliacao_master cm
-    SET data_prevista_pagamento = prev.data_prevista,
-        updated_at = NOW()
-    FROM (
-        SELECT DISTINCT ON (nsu_host_transacao, numero_parcela)
-            nsu_host_transacao,
-            numero_parcela,
-            data_lancamento::date AS data_prevista
-        FROM unica_transactions.transacoes
-        WHERE tipo_lancamento = 'Previsão'
-        ORDER BY nsu_host_transacao, numero_parcela, created_at DESC
-    ) prev
-    WHERE cm.nsu = prev.nsu_host_transacao
-      AND cm.parcela = prev.numero_parcela
+    Entram as (nsu, parcela) dos arquivos e as parcelas cujo override de
+    antecipação mais recente ainda não está refletido no master (override novo,
+    alterado ou removido).
     """
-    with conn.cursor() as cur:
-        cur.execute(query_previsao)
-        previsao_count = cur.rowcount
-    logger.info(f"conciliacao_master data_prevista: {previsao_count} atualizados")
-
-    query_override = """
-    UPDATE unica_transactions.conciliacao_master cm
-    SET
-        antecipado       = TRUE,
-        data_antecipacao = ao.data_antecipacao,
-        valor_antecipado = ao.valor_antecipado,
-        last_status      = 'Antecipado',
-        updated_at       = NOW()
+    query = """
+    CREATE TEMP TABLE conciliacao_escopo ON COMMIT DROP AS
+    SELECT nsu_host_transacao AS nsu, numero_parcela AS parcela
+    FROM unica_transactions.transacoes
+    WHERE file_id = ANY(%s::uuid[])
+    UNION
+    SELECT ao.nsu, ao.parcela
     FROM (
         SELECT DISTINCT ON (nsu, parcela)
             nsu, parcela, data_antecipacao, valor_antecipado
         FROM unica_transactions.antecipacao_override
         ORDER BY nsu, parcela, data_antecipacao DESC
     ) ao
-    WHERE cm.nsu = ao.nsu
-      AND cm.parcela = ao.parcela
+    LEFT JOIN unica_transactions.conciliacao_master cm
+        ON cm.nsu = ao.nsu AND cm.parcela = ao.parcela
+    WHERE cm.antecipado IS DISTINCT FROM TRUE
+       OR cm.data_antecipacao IS DISTINCT FROM ao.data_antecipacao
+       OR cm.valor_antecipado IS DISTINCT FROM ao.valor_antecipado
+    UNION
+    SELECT cm.nsu, cm.parcela
+    FROM unica_transactions.conciliacao_master cm
+    WHERE cm.antecipado = TRUE
+      AND NOT EXISTS (
+          SELECT 1 FROM unica_transactions.antecipacao_override ao
+          WHERE ao.nsu = cm.nsu AND ao.parcela = cm.parcela
+      )
     """
     with conn.cursor() as cur:
-        cur.execute(query_override)
-        override_count = cur.rowcount
-    logger.info(f"conciliacao_master overrides antecipacao: {override_count}")
+        cur.execute(query, ([str(file_id) for file_id in file_ids],))
+        count = cur.rowcount
+        cur.execute("ANALYZE conciliacao_escopo")
+    logger.info(f"conciliacao_master: {count} parcelas no escopo do refresh")
+    return count
 
-    query_link = """
-    UPDATE unica_transactions.conciliacao_master cm
-    SET
-        deposito_diario_id = dd.id,
-        updated_at         = NOW()
-    FROM unica_transactions.deposito_diario dd
-    WHERE cm.data_liquidacao_portal = dd.data_liquidacao
-      AND cm.portal_last_status = 'Liquidação Normal'
+
+def _scope(columns, scoped, keyword='WHERE'):
+    """Filtro das parcelas em conciliacao_escopo (vazio no refresh completo)."""
+    if not scoped:
+        return ""
+    return f"{keyword} ({columns}) IN (SELECT nsu, parcela FROM conciliacao_escopo)"
+
+
+# Colunas do master calculadas pelo refresh (além da chave nsu, parcela)
+MASTER_COLUMNS = [
+    'data_venda', 'valor_bruto_venda', 'valor_liquido', 'numero_total_parcelas',
+    'portal_last_status', 'portal_last_status_at', 'data_liquidacao_portal',
+    'data_prevista_pagamento', 'antecipado', 'data_antecipacao', 'valor_antecipado',
+    'last_status', 'deposito_diario_id', 'remessa_bb'
+]
+
+# Colunas que mantêm o valor gravado quando o cálculo não tem valor: a parcela
+# que deixa de casar com um depósito continua ligada ao último (como no link antigo)
+MASTER_KEEP = {
+    'deposito_diario_id': "COALESCE(EXCLUDED.deposito_diario_id, cm.deposito_diario_id)",
+}
+
+
+def refresh_conciliacao_master(conn, file_ids=None):
+    """Popula conciliacao_master a partir de transacoes_current + antecipacao_override.
+
+    Um único upsert junta estado do portal, Previsão, override de antecipação
+    e depósito e grava cada parcela uma vez com os valores finais; parcelas
+    sem mudança não são regravadas. Com `file_ids`, só as parcelas de
+    stage_parcel_scope entram; sem eles, todas.
     """
-    with conn.cursor() as cur:
-        cur.execute(query_link)
+    scoped = file_ids is not None
+    if scoped and not stage_parcel_scope(conn, file_ids):
+        return 0, 0
 
-    query_remessa = """
-    UPDATE unica_transactions.conciliacao_master
-    SET
-        remessa_bb = CASE
-            WHEN antecipado = TRUE THEN data_antecipacao
-            WHEN portal_last_status = 'Liquidação Normal' THEN data_liquidacao_portal
-            ELSE NULL
-        END,
-        updated_at = NOW()
+    columns = ', '.join(MASTER_COLUMNS)
+    values = {column: MASTER_KEEP.get(column, f"EXCLUDED.{column}") for column in MASTER_COLUMNS}
+    updates = ',\n            '.join(f"{column} = {values[column]}" for column in MASTER_COLUMNS)
+    query = f"""
+    WITH override AS (
+        SELECT DISTINCT ON (nsu, parcela)
+            nsu, parcela, data_antecipacao, valor_antecipado
+        FROM unica_transactions.antecipacao_override
+        {_scope('nsu, parcela', scoped)}
+        ORDER BY nsu, parcela, data_antecipacao DESC
+    ),
+    source AS (
+        SELECT
+            t.nsu_host_transacao AS nsu,
+            t.numero_parcela AS parcela,
+            t.data_transacao::date AS data_venda,
+            t.valor_bruto_venda,
+            CASE
+                WHEN t.numero_total_parcelas NOT IN ('0', '1', '') THEN t.valor_liquido_parcela
+                ELSE t.valor_liquido_venda
+            END AS valor_liquido,
+            t.numero_total_parcelas,
+            t.tipo_lancamento AS portal_last_status,
+            t.created_at AS portal_last_status_at,
+            CASE
+                WHEN t.tipo_lancamento = 'Liquidação Normal' THEN t.data_lancamento
+                ELSE NULL
+            END AS data_liquidacao_portal,
+            t.data_prevista AS data_prevista_pagamento,
+            ao.nsu IS NOT NULL AS antecipado,
+            ao.data_antecipacao,
+            ao.valor_antecipado,
+            CASE WHEN ao.nsu IS NOT NULL THEN 'Antecipado' ELSE t.tipo_lancamento END AS last_status,
+            dd.id AS deposito_diario_id,
+            CASE
+                WHEN ao.nsu IS NOT NULL THEN ao.data_antecipacao
+                WHEN t.tipo_lancamento = 'Liquidação Normal' THEN t.data_lancamento
+                ELSE NULL
+            END AS remessa_bb
+        FROM unica_transactions.transacoes_current t
+        LEFT JOIN override ao
+            ON ao.nsu = t.nsu_host_transacao AND ao.parcela = t.numero_parcela
+        LEFT JOIN unica_transactions.deposito_diario dd
+            ON t.tipo_lancamento = 'Liquidação Normal' AND dd.data_liquidacao = t.data_lancamento
+        {_scope('t.nsu_host_transacao, t.numero_parcela', scoped)}
+    ),
+    upserted AS (
+        INSERT INTO unica_transactions.conciliacao_master AS cm (nsu, parcela, {columns})
+        SELECT nsu, parcela, {columns}
+        FROM source
+        ON CONFLICT (nsu, parcela) DO UPDATE SET
+            {updates},
+            updated_at = NOW()
+        WHERE ({', '.join(f'cm.{column}' for column in MASTER_COLUMNS)})
+            IS DISTINCT FROM ({', '.join(values[column] for column in MASTER_COLUMNS)})
+        RETURNING cm.antecipado
+    )
+    SELECT COUNT(*), COUNT(*) FILTER (WHERE antecipado) FROM upserted
     """
     with conn.cursor() as cur:
-        cur.execute(query_remessa)
-
+        cur.execute(query)
+        portal_count, override_count = cur.fetchone()
+    logger.info(f"conciliacao_master: {portal_count} parcelas gravadas, {override_count} com antecipação")
     return portal_count, override_count
 
 
-def full_refresh(connection_params):
-    """Pipeline completo de refresh. Recebe dict com host, user, password, database, port."""
+def full_refresh(connection_params, incremental=False):
+    """Pipeline completo de refresh. Recebe dict com host, user, password, database, port.
+
+    Com `incremental`, o escopo são os arquivos ainda não cobertos por um
+    refresh (controle_arquivos.refreshed_at nulo, inclusive os de execuções
+    cujo refresh falhou): o deposito_diario é recalculado só nas datas afetadas
+    e o conciliacao_master só nas parcelas tocadas. Sem `incremental`, ou
+    quando a última reconstrução completa da etapa tem mais de
+    FULL_REBUILD_HOURS, a etapa é recalculada inteira.
+    """
     start = datetime.now()
     logger.info("Iniciando refresh conciliacao...")
 
-    conn = psycopg2.connect(
-        host=connection_params['host'],
-        port=connection_params['port'],
-        user=connection_params['user'],
-        password=connection_params['password'],
-        database=connection_params['database']
-    )
+    conn = acquire_connection(connection_params)
 
     try:
-        conn.autocommit = False
+        # Lidos antes do recálculo: um arquivo confirmado depois fica para o próximo refresh
+        pending = pending_files(conn)
+        file_ids = list(pending) if incremental else None
+        logger.info(f"Refresh: {len(pending)} arquivos pendentes")
+        # Estado por parcela é mantido pela carga; a reconstrução corrige desvios
+        if file_ids is None or full_rebuild_due(conn, 'transacoes_current'):
+            rebuild_current_parcels(conn)
+            mark_full_rebuild(conn, 'transacoes_current')
+
+        full = file_ids is None or full_rebuild_due(conn, 'deposito_diario')
+        full_master = file_ids is None or full_rebuild_due(conn, 'conciliacao_master')
+        dates = None
+        if not full:
+            dates = affected_dates(conn, file_ids)
+            logger.info(f"Refresh incremental: {len(dates)} datas de liquidação afetadas")
 
-        depositos = build_deposito_diario(conn)
+        depositos = build_deposito_diario(conn, dates)
         matched = match_deposito_extrato(conn)
-        portal_count, override_count = refresh_conciliacao_master(conn)
+        portal_count, override_count = refresh_conciliacao_master(conn, None if full_master else file_ids)
+        if full:
+            mark_full_rebuild(conn, 'deposito_diario')
+        if full_master:
+            mark_full_rebuild(conn, 'conciliacao_master')
+        # Na mesma transação do refresh: se ele falhar, os arquivos continuam pendentes
+        mark_files_refreshed(conn, pending)
 
         conn.commit()
 
         elapsed = (datetime.now() - start).total_seconds()
         result = {
             "status": "ok",
+            "mode": "full" if full else "incremental",
+            "mode_master": "full" if full_master else "incremental",
             "depositos": depositos,
             "matched": matched,
             "portal": portal_count,
@@ -258,4 +438,4 @@ def full_refresh(connection_params):
         logger.error(f"Erro no refresh: {e}")
         raise
     finally:
-        conn.close()
+        release_connection(conn)
@@ -0,0 +1,254 @@
+"""
+Motor de regras de validação vetorizadas.
+
+Cada coluna tem uma sequência de passos: verificações (Check), que geram uma
+máscara booleana por linha, e conversões (Convert), aplicadas só quando todas
+as verificações anteriores passaram. A coluna é convertida uma única vez em uma
+matriz de code points (TextColumn), reaproveitada por todas as verificações
+de tamanho e de dígitos, sem lambdas por linha. No modo fundido a matriz é o
+próprio bloco de bytes extraído pelo parser, sem nova passada pelas strings.
+
+No modo quarentena uma verificação que falha não encerra a coluna: as linhas
+inválidas são separadas (Rejection) e os passos seguintes rodam só nas demais.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+ZERO = ord('0')
+NINE = ord('9')
+
+# message: texto do erro, ou função (série, máscara de válidos) -> texto
+# fatal: interrompe a validação com ValueError(erros)
+Check = namedtuple('Check', ['mask', 'message', 'fatal'], defaults=(False,))
+Convert = namedtuple('Convert', ['function'])
+Rule = namedtuple('Rule', ['column', 'steps'])
+# Linhas (índice do DataFrame) recusadas por uma verificação no modo quarentena
+Rejection = namedtuple('Rejection', ['rows', 'column', 'message'])
+
+
+class TextColumn:
+    """Visão vetorizada de uma coluna de str: tamanhos e dígitos por posição.
+
+    A matriz de code points só é montada na primeira verificação que precisar dela.
+    """
+
+    def __init__(self, series):
+        self.series = series
+        self._codes = None
+        self._digits = None
+
+    @classmethod
+    def from_bytes(cls, series, block):
+        """Coluna montada sobre os bytes do parser (fixed_width.text_block) em vez das strings"""
+        column = cls(series)
+        column._set_codes(block, np.ones(len(block), dtype=bool))
+        return column
+
+    def _prepare(self):
+        values = self.series.to_numpy(dtype=object)
+        if pd.api.types.infer_dtype(values, skipna=False) == 'string':
+            is_str = np.ones(len(values), dtype=bool)
+        else:
+            is_str = np.fromiter((isinstance(v, str) for v in values), dtype=bool, count=len(values))
+            values = np.where(is_str, values, '')
+        texts = values.astype(str) if len(values) else np.zeros(0, dtype='<U1')
+        self._set_codes(texts.view(np.uint32).reshape(len(texts), texts.dtype.itemsize // 4), is_str)
+
+    def _set_codes(self, codes, is_str):
+        self._codes = codes
+        self._is_str = is_str
+        # Completados com NUL à direita: tamanho = posição do último caractere não nulo + 1
+        filled = codes[:, ::-1] != 0
+        self._lengths = np.where(filled.any(axis=1), codes.shape[1] - filled.argmax(axis=1), 0)
+
+    @property
+    def is_str(self):
+        if self._codes is None:
+            self._prepare()
+        return self._is_str
+
+    @property
+    def lengths(self):
+        if self._codes is None:
+            self._prepare()
+        return self._lengths
+
+    @property
+    def codes(self):
+        if self._codes is None:
+            self._prepare()
+        return self._codes
+
+    @property
+    def digits(self):
+        if self._digits is None:
+            self._digits = (self.codes >= ZERO) & (self.codes <= NINE)
+        return self._digits
+
+    def all_digits(self, start=0):
+        """str[start:].isdigit() por linha"""
+        count = self.digits[:, start:].sum(axis=1)
+        return self.is_str & (self.lengths > start) & (count == self.lengths - start)
+
+    def to_int(self):
+        """Valor inteiro das linhas só com dígitos"""
+        width = self.codes.shape[1]
+        exponent = self.lengths[:, None] - 1 - np.arange(width)
+        values = np.where(exponent >= 0, self.codes.astype(np.int64) - ZERO, 0)
+        return (values * 10 ** np.maximum(exponent, 0)).sum(axis=1)
+
+
+# Verificações: recebem a TextColumn e retornam a máscara de linhas válidas
+
+def length(n):
+    return lambda column: column.is_str & (column.lengths == n)
+
+
+def length_between(low, high):
+    return lambda column: column.is_str & (column.lengths >= low) & (column.lengths <= high)
+
+
+def digits(n=None, start=0):
+    """Só dígitos a partir de `start` (e, com n, exatamente n caracteres)"""
+    if n is None:
+        return lambda column: column.all_digits(start)
+    return lambda column: column.all_digits(start) & (column.lengths == n)
+
+
+def digits_up_to(n):
+    return lambda column: column.all_digits() & (column.lengths <= n)
+
+
+def one_of(*values):
+    return lambda column: column.series.isin(values).to_numpy()
+
+
+def not_null(column):
+    return column.series.notna().to_numpy()
+
+
+def all_of(*checks):
+    def mask(column):
+        result = checks[0](column)
+        for check in checks[1:]:
+            result = result & check(column)
+        return result
+    return mask
+
+
+# Conversões: recebem a série (já validada) e sua TextColumn e retornam a série convertida
+
+def to_int(series, column):
+    return pd.Series(column.to_int(), index=series.index)
+
+
+def to_date(series, column):
+    return pd.to_datetime(series, format='%Y%m%d', errors='coerce')
+
+
+def zfill(width):
+    return lambda series, column: series.str.zfill(width)
+
+
+def categorical(*values):
+    """Converte a coluna (já restrita a `values`) em Categorical"""
+    dtype = pd.CategoricalDtype(list(values))
+    return lambda series, column: series.astype(dtype)
+
+
+def map_values(mapping):
+    """Equivale a series.map(mapping), mas gera um Categorical com as descrições.
+
+    O código de cada chave é traduzido direto para o código da descrição; chaves
+    fora do mapeamento viram NaN, como no .map.
+    """
+    keys = list(mapping)
+    dtype = pd.CategoricalDtype(list(dict.fromkeys(mapping.values())))
+    # Último elemento (-1) atende os códigos -1 das chaves ausentes
+    targets = np.array([dtype.categories.get_loc(mapping[key]) for key in keys] + [-1])
+
+    def convert(series, column):
+        codes = pd.Categorical(series, categories=keys).codes
+        return pd.Series(pd.Categorical.from_codes(targets[codes], dtype=dtype), index=series.index)
+    return convert
+
+
+def _int_text(value):
+    try:
+        return str(int(value))
+    except (TypeError, ValueError):
+        return value
+
+
+def int_text(series, column):
+    """Equivale a str(int(x)): remove zeros à esquerda"""
+    if column.all_digits().all():
+        return pd.Series(column.to_int().astype(str).astype(object), index=series.index)
+    # Sinais/espaços seguem a conversão do Python; texto inválido fica como está
+    # para a verificação seguinte recusar
+    return series.apply(_int_text)
+
+
+def apply_rules(df, rules, errors, byte_columns=None, rejected=None):
+    """Executa as regras em ordem sobre df e acumula os erros em `errors`.
+
+    `byte_columns` ({coluna: bloco uint8}, ver ExtratoTransacao.iter_fused_chunks)
+    substitui as strings da coluna até a primeira conversão.
+
+    Com `rejected` (lista), as falhas não vão para `errors` nem interrompem a
+    validação (inclusive as fatais): cada uma acrescenta um Rejection e as
+    linhas recusadas ficam fora do DataFrame retornado.
+
+    Retorna um novo DataFrame com as colunas convertidas; as colunas são trocadas
+    de uma vez no final, em vez de uma atribuição (e cópia do bloco) por coluna.
+    """
+    byte_columns = byte_columns or {}
+    converted = {}
+    dropped = []
+    for rule in rules:
+        series = df[rule.column]
+        if rule.column in byte_columns:
+            column = TextColumn.from_bytes(series, byte_columns[rule.column])
+        else:
+            column = TextColumn(series)
+        for step in rule.steps:
+            if isinstance(step, Convert):
+                series = step.function(series, column)
+                converted[rule.column] = series
+                column = TextColumn(series)
+                continue
+
+            valid = step.mask(column)
+            if not valid.all():
+                message = step.message(series, valid) if callable(step.message) else step.message
+                if rejected is None:
+                    errors.append(message)
+                    if step.fatal:
+                        raise ValueError(errors)
+                    break
+
+                rejected.append(Rejection(series.index[~valid], rule.column, message))
+                dropped.append(series.index[~valid])
+                series = series[valid]
+                column = TextColumn(series)
+
+    if dropped:
+        index = df.index[~df.index.isin(np.concatenate(dropped))]
+        return pd.DataFrame({name: converted.get(name, df[name]).loc[index] for name in df.columns}, index=index)
+    if not converted:
+        return df
+    return pd.DataFrame({name: converted.get(name, df[name]) for name in df.columns}, index=df.index)
+
+
+def rejections_frame(rejected):
+    """Uma linha por (linha, coluna) recusada, no formato da tabela de quarentena"""
+    counts = [len(rejection.rows) for rejection in rejected]
+    rows = [np.asarray(rejection.rows, dtype='int64') for rejection in rejected]
+    return pd.DataFrame({
+        'linha': np.concatenate(rows) if rows else np.zeros(0, dtype='int64'),
+        'coluna': np.repeat(np.array([rejection.column for rejection in rejected], dtype=object), counts),
+        'erro': np.repeat(np.array([rejection.message for rejection in rejected], dtype=object), counts),
+    })
@@ -0,0 +1,229 @@
+"""
+Equivalência do parser de largura fixa (bytes/NumPy) com o fatiamento de `str`.
+
+A referência decodifica cada linha como o parser original fazia: fatia do
+texto, `.strip()`, `.zfill()` e conversão campo a campo. Os arquivos saem de
+benchmarks.generators, com linhas alteradas para os casos de borda (CRLF/LF,
+quebra de linha final, linhas curtas, valores alinhados à esquerda e datas
+inválidas).
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.generators import extrato_file, tricard_file
+from scripts.fixed_width import split_records, record_codes
+from scripts.layouts import EXTRATO_CV, LAYOUTS, get_extractor, parse_tricard_date
+from scripts.leitor_extratos import exceeds_rejection_limit
+from scripts.reading_files import ExtratoTransacao
+from scripts.reading_tricard import ExtratoTricard
+from scripts.transform_files import TransformerTrasacoes
+
+CV_FIELDS = {field.name: field for field in EXTRATO_CV}
+
+
+def _replace(line, field, value):
+    return line[:field.start] + value + line[field.end:]
+
+
+def _cents(value, decimal_places):
+    value = value.strip()
+    return int(value) if len(value) >= decimal_places and value.isdigit() else None
+
+
+def _amount(value):
+    try:
+        return int(value)
+    except ValueError:
+        return 0
+
+
+def _date(value):
+    parsed = parse_tricard_date(value)
+    return parsed if parsed and 1678 <= parsed.year <= 2261 else None
+
+
+def reference_value(line, field):
+    """Valor do campo decodificado por fatiamento de str"""
+    value = line[field.start:field.end]
+    if field.optional and len(line) <= field.end:
+        return None
+    if field.type == 'raw':
+        return value
+    if field.type == 'str':
+        return value.strip()
+    if field.type == 'zfill':
+        return value.strip().zfill(field.end - field.start)
+    if field.type == 'cents':
+        return _cents(value, field.decimals)
+    if field.type == 'amount':
+        return _amount(value) if field.end > field.start else None
+    if field.type == 'date':
+        return _date(value) if field.end > field.start else None
+    if field.type == 'int':
+        return int(value.strip()) if value.strip() else field.default
+    return field.default
+
+
+def column_values(series):
+    """Valores da coluna como objetos Python, com None no lugar de NA/NaT"""
+    if series.dtype.kind == 'M':
+        return [None if pd.isna(value) else value.date() for value in series]
+    return [None if pd.isna(value) else value for value in series.astype(object)]
+
+
+def assert_matches_reference(df, lines, fields):
+    assert len(df) == len(lines)
+    for field in fields:
+        expected = [reference_value(line, field) for line in lines]
+        assert column_values(df[field.name]) == expected, field.name
+
+
+def extrato_lines(rows=24, seed=7):
+    """Linhas de um arquivo EXTRATO com os casos de borda nos registros CV"""
+    lines = extrato_file(rows, seed=seed, error_rate=0.1).decode('latin-1').split('\r\n')[:-1]
+    bruto = CV_FIELDS['valor_bruto_venda']
+    desconto = CV_FIELDS['valor_desconto']
+    loja = CV_FIELDS['identificacao_loja']
+
+    # Valor alinhado à esquerda (espaços à direita)
+    lines[2] = _replace(lines[2], bruto, '12345'.ljust(11))
+    # Valores com menos dígitos que as casas decimais, e com exatamente as casas decimais
+    lines[3] = _replace(lines[3], bruto, '5'.rjust(11))
+    lines[4] = _replace(lines[4], desconto, ' 05'.ljust(11))
+    # Campo só de espaços e código zfill com espaços
+    lines[5] = _replace(lines[5], desconto, ' ' * 11)
+    lines[6] = _replace(lines[6], loja, '  123'.ljust(15))
+    # Linhas curtas: no meio de um valor, no meio do registro e sem o último dígito do nseq
+    lines[7] = lines[7][:60]
+    lines[8] = lines[8][:200]
+    lines[9] = lines[9][:395]
+    return lines
+
+
+def render(lines, newline, trailing):
+    return (newline.join(lines) + (newline if trailing else '')).encode('latin-1')
+
+
+@pytest.fixture(params=[('\r\n', True), ('\r\n', False), ('\n', True), ('\n', False)],
+                ids=['crlf', 'crlf-sem-final', 'lf', 'lf-sem-final'])
+def extrato_path(request, tmp_path):
+    newline, trailing = request.param
+    path = tmp_path / 'extrato.txt'
+    path.write_bytes(render(extrato_lines(), newline, trailing))
+    return path
+
+
+def test_extrato_cv_matches_str_slicing(extrato_path):
+    lines = extrato_lines()
+    df_header, df_transacoes, df_trailer = ExtratoTransacao(str(extrato_path)).process_file()
+
+    assert_matches_reference(df_transacoes, lines[1:-1], EXTRATO_CV)
+    assert df_header['versao_layout'].iloc[0] == lines[0][2:8].strip()
+    assert len(df_trailer) == 1
+
+
+@pytest.mark.parametrize('chunk_rows', [1, 5, 1000])
+def test_extrato_chunks_match_whole_file(extrato_path, chunk_rows):
+    _, df_transacoes, _ = ExtratoTransacao(str(extrato_path)).process_file()
+
+    chunks = list(ExtratoTransacao(str(extrato_path)).iter_chunks(chunk_rows=chunk_rows))
+    pd.testing.assert_frame_equal(pd.concat(chunks), df_transacoes)
+
+    fused = list(ExtratoTransacao(str(extrato_path)).iter_fused_chunks(chunk_rows=chunk_rows))
+    pd.testing.assert_frame_equal(pd.concat([df for df, _ in fused]), df_transacoes)
+
+
+def _validate(transformer):
+    # Sem quarentena, uma regra fatal interrompe a validação com ValueError(erros)
+    try:
+        return transformer.validate_all()
+    except ValueError as error:
+        return error.args[0]
+
+
+@pytest.mark.parametrize('quarantine', [False, True])
+def test_fused_validation_matches_text_validation(extrato_path, quarantine):
+    for df_chunk, blocks in ExtratoTransacao(str(extrato_path)).iter_fused_chunks(chunk_rows=5):
+        df_chunk['file_name'] = 'extrato.txt'
+        fused = TransformerTrasacoes(df_chunk.copy(), byte_columns=blocks, quarantine=quarantine)
+        text = TransformerTrasacoes(df_chunk.copy(), quarantine=quarantine)
+
+        fused_result, text_result = _validate(fused), _validate(text)
+        assert type(fused_result) is type(text_result)
+        if isinstance(text_result, list):
+            assert sorted(fused_result) == sorted(text_result)
+        else:
+            pd.testing.assert_frame_equal(fused_result, text_result)
+        if quarantine:
+            pd.testing.assert_frame_equal(
+                fused.rejected.sort_values(['linha', 'coluna']).reset_index(drop=True),
+                text.rejected.sort_values(['linha', 'coluna']).reset_index(drop=True),
+            )
+
+
+def test_extrato_quarantine_keeps_valid_rows(tmp_path):
+    lines = extrato_lines()
+    path = tmp_path / 'extrato.txt'
+    path.write_bytes(render(lines, '\r\n', True))
+
+    _, df_transacoes, _ = ExtratoTransacao(str(path)).process_file()
+    df_transacoes['file_name'] = 'extrato.txt'
+    transformer = TransformerTrasacoes(df_transacoes, quarantine=True)
+    validated = transformer.validate_all()
+
+    rejected_rows = set(transformer.rejected['linha'])
+    assert rejected_rows
+    assert len(validated) + len(rejected_rows) == len(lines) - 2
+    assert rejected_rows.isdisjoint(validated.index)
+
+
+@pytest.mark.parametrize('rejected, total, expected', [
+    (0, 0, False),
+    (0, 1000, False),
+    (10, 1000, False),
+    (11, 1000, True),
+    (1, 1, True),
+])
+def test_rejection_limit(rejected, total, expected):
+    assert exceeds_rejection_limit(rejected, total, max_rate=0.01) is expected
+
+
+def tricard_lines(file_type, rows=30, seed=3):
+    """Linhas de um arquivo TRICARD com datas inválidas, valores fora do padrão e linhas curtas"""
+    lines = tricard_file(file_type, rows, seed=seed, error_rate=0.1).decode('latin-1').split('\r\n')[:-1]
+    invalid_dates = ['31022025', '00000000', '  152025', ' ' * 8, '1503202 ', '15031500']
+    amounts = ['12345'.ljust(15), '-' + '1'.rjust(14), ' ' * 15, '12 34'.rjust(15)]
+    for i, line in enumerate(lines[1:-1], start=1):
+        fields = LAYOUTS[('TRICARD', line[:3], 'padrao')]
+        dates = [field for field in fields if field.type == 'date' and field.end > field.start]
+        values = [field for field in fields if field.type == 'amount' and field.end > field.start]
+        if dates:
+            line = _replace(line, dates[0], invalid_dates[i % len(invalid_dates)])
+        if values and i % 2:
+            line = _replace(line, values[-1], amounts[i % len(amounts)])
+        if i % 7 == 0:
+            line = line[:max(field.end for field in fields) - 10]
+        lines[i] = line
+    return lines
+
+
+@pytest.mark.parametrize('file_type', ['VENDA', 'FINANCEIRO', 'SALDO'])
+@pytest.mark.parametrize('newline', ['\r\n', '\n'], ids=['crlf', 'lf'])
+def test_tricard_records_match_str_slicing(tmp_path, file_type, newline):
+    lines = tricard_lines(file_type)
+    content = render(lines, newline, True)
+
+    buffer, starts, lengths = split_records(content)
+    codes = record_codes(buffer, starts, lengths, 3)
+    for tipo in {line[:3] for line in lines[1:-1]}:
+        rows = np.flatnonzero(codes == tipo.encode('latin-1'))
+        df = get_extractor('TRICARD', tipo).to_dataframe(buffer, starts[rows], lengths[rows])
+        assert_matches_reference(df, [lines[i] for i in rows], LAYOUTS[('TRICARD', tipo, 'padrao')])
+
+    path = tmp_path / f'{file_type.lower()}.txt'
+    path.write_bytes(content + newline.encode('latin-1'))
+    extrato = ExtratoTricard(str(path), file_type)
+    extrato.load_file()
+    assert len(extrato.starts) == len(lines)
+    assert len(extrato.parse_records(sorted({line[:3] for line in lines[1:-1]}))) == len(lines) - 2
@@ -1,75 +1,249 @@
 from psycopg2 import sql
+from psycopg2.pool import ThreadedConnectionPool
 import psycopg2
+import io
+import os
+import threading
+from contextlib import contextmanager
+import numpy as np
 import pandas as pd
 from datetime import datetime
 from utils.logger import setup_logger
+from utils import dimension_cache
 
 logger = setup_logger("connection_db")
 
-def get_existing_records(user, host, password, database, port, schema, table, key_column):
-    """Retorna lista de registros existentes em uma tabela baseado na coluna chave"""
+# Pool de conexões do processo (sobrescrito por init_pool)
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '4'))
+
+# Validade da reserva PROCESSANDO em controle_arquivos; vencida, outro worker pode retomar o arquivo
+CLAIM_LEASE_MINUTES = int(os.getenv('CLAIM_LEASE_MINUTES', '30'))
+# Reserva vencida; sem prazo gravado (linha anterior à coluna ou queda antes do prazo) também conta.
+# Usada tanto na reserva quanto no status, para que um arquivo escolhido possa ser reservado.
+LEASE_EXPIRED = sql.SQL("(reserva_expira_em IS NULL OR reserva_expira_em < now())")
+
+_pools = {}
+_pools_pid = os.getpid()
+_pools_lock = threading.Lock()
+# Pools herdados via fork: mantidos vivos para o coletor de lixo não encerrar
+# conexões que ainda pertencem ao processo pai
+_inherited_pools = []
+# id(conexão) -> pool de origem, para devolução em release_connection
+_checked_out = {}
+
+
+class _Pool:
+    def __init__(self, connection_params, minconn, maxconn):
+        self.maxconn = maxconn
+        self.pool = ThreadedConnectionPool(minconn, maxconn, **connection_params)
+        # getconn falha quando o pool está esgotado; o semáforo faz a thread esperar
+        self.slots = threading.BoundedSemaphore(maxconn)
+
+
+def _pool_key(connection_params):
+    return tuple(sorted((name, str(value)) for name, value in connection_params.items()))
+
+
+def _get_pool(connection_params, minconn=None, maxconn=None):
+    global _pools, _pools_pid
+    with _pools_lock:
+        if os.getpid() != _pools_pid:
+            _inherited_pools.extend(_pools.values())
+            _pools, _pools_pid = {}, os.getpid()
+            _checked_out.clear()
+
+        key = _pool_key(connection_params)
+        if key not in _pools:
+            minconn = DB_POOL_MIN if minconn is None else minconn
+            maxconn = max(minconn, DB_POOL_MAX if maxconn is None else maxconn)
+            _pools[key] = _Pool(connection_params, minconn, maxconn)
+            logger.info(f"Pool de conexões criado ({minconn}-{maxconn} conexões)")
+        return _pools[key]
+
+
+def init_pool(connection_params, minconn=None, maxconn=None):
+    """Cria (se ainda não existir) o pool do processo para connection_params"""
+    return _get_pool(connection_params, minconn, maxconn)
+
+
+def close_pools():
+    """Fecha todas as conexões dos pools criados por este processo"""
+    with _pools_lock:
+        if os.getpid() != _pools_pid:
+            return
+        for pool in _pools.values():
+            pool.pool.closeall()
+        _pools.clear()
+        _checked_out.clear()
+
+
+def _healthy(conn):
+    if conn.closed:
+        return False
     try:
-        conn = psycopg2.connect(
-            host=host,
-            port=port,
-            user=user,
-            password=password,
-            database=database
-        )
-        
         with conn.cursor() as cur:
-            query = sql.SQL("""
-                SELECT {} 
-                FROM {}.{}
-            """).format(
-                sql.Identifier(key_column),
-                sql.Identifier(schema),
-                sql.Identifier(table)
-            )
-            
-            cur.execute(query)
-            results = cur.fetchall()
-            return [row[0] for row in results]
-            
-    except Exception as e:
-        logger.error(f"Erro ao buscar registros existentes: {e}")
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        return False
+
+
+def acquire_connection(connection_params):
+    """Retira uma conexão verificada do pool (autocommit desligado); devolver com release_connection"""
+    pool = _get_pool(connection_params)
+    pool.slots.acquire()
+    try:
+        # Conexões que caíram enquanto ociosas são descartadas e substituídas
+        for _ in range(pool.maxconn + 1):
+            conn = pool.pool.getconn()
+            if _healthy(conn):
+                conn.autocommit = False
+                _checked_out[id(conn)] = pool
+                return conn
+            logger.warning("Conexão inválida descartada do pool")
+            pool.pool.putconn(conn, close=True)
+        raise psycopg2.OperationalError("Nenhuma conexão válida disponível no pool")
+    except Exception:
+        pool.slots.release()
         raise
+
+
+def release_connection(conn):
+    """Devolve ao pool uma conexão de acquire_connection; transação pendente é desfeita"""
+    pool = _checked_out.pop(id(conn), None)
+    if pool is None:
+        conn.close()
+        return
+    try:
+        pool.pool.putconn(conn, close=conn.closed)
     finally:
-        if conn:
-            conn.close()
+        pool.slots.release()
+
+
+@contextmanager
+def pooled_connection(connection_params, conn=None):
+    """Conexão do pool com commit ao sair (rollback em erro).
+
+    Com `conn`, usa a conexão recebida e deixa commit/rollback para quem a abriu.
+    """
+    if conn is not None:
+        yield conn
+        return
+
+    conn = acquire_connection(connection_params)
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        release_connection(conn)
+
+# Marcador de NULL e caracteres que precisam de escape no formato texto do COPY
+COPY_NULL = '\\N'
+COPY_ESCAPES = {'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'}
+
+
+def _copy_cents(values):
+    """Centavos inteiros como texto decimal (-123 -> '-1.23'), sem passar por float"""
+    values = np.asarray(values, dtype=np.int64)
+    absolute = np.abs(values)
+    text = pd.Series((absolute // 100).astype(str), dtype=object) + '.' + \
+        pd.Series((absolute % 100).astype(str), dtype=object).str.zfill(2)
+    return np.where(values < 0, '-' + text, text)
+
+
+def _copy_column(series, cents=False):
+    """Valores de uma coluna já no formato texto do COPY (NULL como \\N)"""
+    missing = series.isna().to_numpy()
+    if cents:
+        text = _copy_cents(series.astype('Int64').fillna(0).to_numpy(dtype=np.int64))
+    elif series.dtype.kind == 'M':
+        values = series.to_numpy(dtype='datetime64[us]')
+        midnight = values == values.astype('datetime64[D]')
+        # Só datas (sem hora) saem como YYYY-MM-DD, aceito por colunas date e timestamp
+        unit = 'D' if midnight[~missing].all() else 'us'
+        text = np.datetime_as_string(values, unit=unit).astype(object)
+    elif series.dtype.kind == 'b':
+        text = np.where(series.to_numpy(), 't', 'f')
+    elif series.dtype.kind == 'f':
+        # Inteiros com valor ausente viram float64 no pandas; 1.0 iria como '1.0',
+        # que colunas int recusam. Valores inteiros saem sem a parte decimal
+        values = series.to_numpy(dtype=np.float64)
+        integral = np.zeros(len(values), dtype=bool)
+        integral[~missing] = (values[~missing] == np.trunc(values[~missing])) & (np.abs(values[~missing]) < 2 ** 53)
+        text = np.where(
+            integral,
+            np.where(integral, values, 0).astype(np.int64).astype(str).astype(object),
+            series.astype(object).map(str, na_action='ignore').to_numpy()
+        )
+    else:
+        text = series.astype(object).map(str, na_action='ignore')
+        if text.str.contains('[\\\\\t\n\r]', regex=True, na=False).any():
+            for char, escaped in COPY_ESCAPES.items():
+                text = text.str.replace(char, escaped, regex=False)
+        text = text.to_numpy()
+    return np.where(missing, COPY_NULL, text).tolist()
+
+
+def _copy_buffer(df, cents_columns=()):
+    """Serializa o DataFrame no formato texto do COPY em um buffer em memória"""
+    columns = [_copy_column(df[column], column in cents_columns) for column in df.columns]
+    buffer = io.StringIO()
+    for line in map('\t'.join, zip(*columns)):
+        buffer.write(line)
+        buffer.write('\n')
+    buffer.seek(0)
+    return buffer
+
+
+def copy_df_to_db(conn, schema, table, df, cents_columns=(), conflict_column=None):
+    """Insere o DataFrame com COPY ... FROM STDIN na transação de `conn`.
+
+    Colunas em cents_columns vão como centavos inteiros formatados em decimal
+    (12345 -> 123.45); valores ausentes (None, NaN, NaT, <NA>) viram NULL. Com
+    conflict_column, o COPY vai para uma tabela temporária e só as chaves ainda
+    inexistentes são inseridas (ON CONFLICT DO NOTHING).
+    """
+    if df.empty:
+        return 0
+
+    columns = sql.SQL(', ').join(map(sql.Identifier, df.columns))
+    target = sql.SQL('{}.{}').format(sql.Identifier(schema), sql.Identifier(table))
+    buffer = _copy_buffer(df, cents_columns)
+
+    with conn.cursor() as cur:
+        if conflict_column is None:
+            cur.copy_expert(sql.SQL("COPY {} ({}) FROM STDIN").format(target, columns).as_string(conn), buffer)
+            return len(df)
+
+        staging = sql.Identifier(f"copy_{table}")
+        # Só as colunas do lote, com os tipos da tabela destino e sem restrições/defaults
+        cur.execute(sql.SQL("CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA").format(
+            staging, columns, target
+        ))
+        cur.copy_expert(sql.SQL("COPY {} ({}) FROM STDIN").format(staging, columns).as_string(conn), buffer)
+        cur.execute(sql.SQL(
+            "INSERT INTO {} ({}) SELECT {} FROM {} ON CONFLICT ({}) DO NOTHING"
+        ).format(target, columns, columns, staging, sql.Identifier(conflict_column)))
+        inserted = cur.rowcount
+        # Libera o nome para o próximo COPY da mesma tabela na transação
+        cur.execute(sql.SQL("DROP TABLE {}").format(staging))
+        return inserted
 
 def insert_df_to_db(user, host, password, database, port, schema, table, df):
     """Insere um DataFrame em uma tabela do banco de dados"""
+    conn = None
     try:
-        conn = psycopg2.connect(
-            host=host,
-            port=port,
-            user=user,
-            password=password,
-            database=database
-        )
-        
-        # Converte o DataFrame para uma lista de tuplas
-        records = [tuple(x) for x in df.values]
-        
-        # Obtém os nomes das colunas
-        columns = df.columns.tolist()
-        
-        # Cria a query de inserção
-        query = sql.SQL("""
-            INSERT INTO {}.{} ({})
-            VALUES ({})
-        """).format(
-            sql.Identifier(schema),
-            sql.Identifier(table),
-            sql.SQL(', ').join(map(sql.Identifier, columns)),
-            sql.SQL(', ').join(sql.Placeholder() * len(columns))
-        )
+        conn = acquire_connection(dict(host=host, port=port, user=user, password=password, database=database))
         
-        with conn.cursor() as cur:
-            cur.executemany(query, records)
-            conn.commit()
-            logger.info(f"{len(records)} registros inseridos na tabela {table}")
+        inserted = copy_df_to_db(conn, schema, table, df)
+        conn.commit()
+        logger.info(f"{inserted} registros inseridos na tabela {table}")
             
     except Exception as e:
         logger.error(f"Erro ao inserir dados na tabela {table}: {e}")
@@ -78,18 +252,13 @@ def insert_df_to_db(user, host, password, database, port, schema, table, df):
         raise
     finally:
         if conn:
-            conn.close()
+            release_connection(conn)
 
 def get_processed_files(user, host, password, database, port, schema='unica_transactions'):
     """Retorna lista de arquivos já processados com sucesso"""
+    conn = None
     try:
-        conn = psycopg2.connect(
-            host=host,
-            port=port,
-            user=user,
-            password=password,
-            database=database
-        )
+        conn = acquire_connection(dict(host=host, port=port, user=user, password=password, database=database))
         
         with conn.cursor() as cur:
             query = sql.SQL("""
@@ -108,39 +277,49 @@ def get_processed_files(user, host, password, database, port, schema='unica_tran
         raise
     finally:
         if conn:
-            conn.close()
+            release_connection(conn)
+
+def upsert_file_record(cur, file_name, data_geracao, status, error=None, file_path=None,
+                       schema='unica_transactions'):
+    """Grava o status do arquivo em controle_arquivos e retorna o id.
+
+    A linha reservada por claim_file (ou de um processamento anterior com ERRO)
+    é atualizada no lugar, mantendo o id; a reserva é encerrada e o arquivo volta
+    a ficar pendente para o refresh da conciliação.
+    """
+    cur.execute(sql.SQL("""
+        INSERT INTO {}.controle_arquivos
+        (nome_arquivo, data_geracao, data_processamento, status_processamento,
+        erro_processamento, arquivo_google_drive_path)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON CONFLICT (nome_arquivo) DO UPDATE SET
+            data_geracao = EXCLUDED.data_geracao,
+            data_processamento = EXCLUDED.data_processamento,
+            status_processamento = EXCLUDED.status_processamento,
+            erro_processamento = EXCLUDED.erro_processamento,
+            arquivo_google_drive_path = EXCLUDED.arquivo_google_drive_path,
+            reserva_expira_em = NULL,
+            refreshed_at = NULL
+        RETURNING id
+    """).format(sql.Identifier(schema)), (
+        file_name,
+        data_geracao,
+        datetime.now(),
+        status,
+        error,
+        file_path
+    ))
+    return cur.fetchone()[0]
 
 def register_file_processing(user, host, password, database, port, file_name, data_geracao, 
                            status, error=None, google_drive_path=None, schema='unica_transactions'):
     """Registra o processamento de um arquivo e retorna o ID do registro"""
+    conn = None
     try:
-        conn = psycopg2.connect(
-            host=host,
-            port=port,
-            user=user,
-            password=password,
-            database=database
-        )
+        conn = acquire_connection(dict(host=host, port=port, user=user, password=password, database=database))
         
         with conn.cursor() as cur:
-            query = sql.SQL("""
-                INSERT INTO {}.controle_arquivos 
-                (nome_arquivo, data_geracao, data_processamento, status_processamento, 
-                erro_processamento, arquivo_google_drive_path)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                RETURNING id
-            """).format(sql.Identifier(schema))
-            
-            cur.execute(query, (
-                file_name,
-                data_geracao,
-                datetime.now(),
-                status,
-                error,
-                google_drive_path
-            ))
-            
-            file_id = cur.fetchone()[0]
+            file_id = upsert_file_record(cur, file_name, data_geracao, status, error, google_drive_path, schema)
             conn.commit()
             logger.info(f"Registro de processamento criado para o arquivo {file_name}")
             return file_id
@@ -152,49 +331,173 @@ def register_file_processing(user, host, password, database, port, file_name, da
         raise
     finally:
         if conn:
-            conn.close()
+            release_connection(conn)
+
+def claim_file(connection_params, file_name, lease_minutes=None, schema='unica_transactions'):
+    """Reserva o arquivo (status PROCESSANDO com prazo) para este worker; retorna o id ou None.
+
+    Arquivo sem registro ganha uma linha PROCESSANDO; registrado, só é reservado
+    com status ERRO ou com reserva vencida. A reserva é gravada e confirmada na
+    hora, fora da transação de carga. Linhas travadas por outra transação (um
+    worker gravando o arquivo) são puladas com SKIP LOCKED em vez de esperar.
+    """
+    lease_minutes = CLAIM_LEASE_MINUTES if lease_minutes is None else lease_minutes
+    with pooled_connection(connection_params) as conn, conn.cursor() as cur:
+        # data_geracao definitiva vem do header, gravada por upsert_file_record;
+        # o NOT EXISTS evita esperar no índice único por uma linha já travada
+        cur.execute(sql.SQL("""
+            INSERT INTO {0}.controle_arquivos
+            (nome_arquivo, data_geracao, data_processamento, status_processamento, reserva_expira_em)
+            SELECT %s, CURRENT_DATE, now(), 'PROCESSANDO', now() + %s * interval '1 minute'
+            WHERE NOT EXISTS (SELECT 1 FROM {0}.controle_arquivos WHERE nome_arquivo = %s)
+            ON CONFLICT (nome_arquivo) DO NOTHING
+            RETURNING id
+        """).format(sql.Identifier(schema)), (file_name, lease_minutes, file_name))
+        row = cur.fetchone()
+        if row is None:
+            cur.execute(sql.SQL("""
+                UPDATE {0}.controle_arquivos c
+                SET status_processamento = 'PROCESSANDO',
+                    erro_processamento = NULL,
+                    data_processamento = now(),
+                    reserva_expira_em = now() + %s * interval '1 minute'
+                WHERE c.id = (
+                    SELECT id FROM {0}.controle_arquivos
+                    WHERE nome_arquivo = %s
+                      AND (status_processamento = 'ERRO'
+                           OR (status_processamento = 'PROCESSANDO' AND {1}))
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING c.id
+            """).format(sql.Identifier(schema), LEASE_EXPIRED), (lease_minutes, file_name))
+            row = cur.fetchone()
+    return row[0] if row else None
+
+def release_claim(connection_params, file_name, error, schema='unica_transactions'):
+    """Encerra a reserva de um arquivo que não chegou à carga (ex.: falha no download) como ERRO"""
+    with pooled_connection(connection_params) as conn, conn.cursor() as cur:
+        cur.execute(sql.SQL("""
+            UPDATE {}.controle_arquivos
+            SET status_processamento = 'ERRO',
+                erro_processamento = %s,
+                reserva_expira_em = NULL
+            WHERE nome_arquivo = %s AND status_processamento = 'PROCESSANDO'
+        """).format(sql.Identifier(schema)), (error, file_name))
+
+def has_pending_refresh(connection_params, schema='unica_transactions'):
+    """True se algum arquivo carregado com sucesso ainda não passou pelo refresh da conciliação"""
+    with pooled_connection(connection_params) as conn, conn.cursor() as cur:
+        cur.execute(sql.SQL("""
+            SELECT EXISTS (
+                SELECT 1 FROM {}.controle_arquivos
+                WHERE status_processamento = 'SUCESSO' AND refreshed_at IS NULL
+            )
+        """).format(sql.Identifier(schema)))
+        return cur.fetchone()[0]
 
 def get_file_processing_status(user, host, password, database, port, schema='unica_transactions'):
     """Retorna o status de processamento de todos os arquivos registrados"""
+    conn = None
     try:
-        conn = psycopg2.connect(
-            host=host,
-            port=port,
-            user=user,
-            password=password,
-            database=database
-        )
+        conn = acquire_connection(dict(host=host, port=port, user=user, password=password, database=database))
         
         with conn.cursor() as cur:
             query = sql.SQL("""
-                SELECT nome_arquivo, status_processamento, erro_processamento
+                SELECT nome_arquivo, status_processamento, erro_processamento,
+                       {}
                 FROM {}.controle_arquivos
-            """).format(sql.Identifier(schema))
+            """).format(LEASE_EXPIRED, sql.Identifier(schema))
             
             cur.execute(query)
             results = cur.fetchall()
             
             # Converte para um dicionário para fácil acesso
-            return {row[0]: {'status': row[1], 'erro': row[2]} for row in results}
+            return {row[0]: {'status': row[1], 'erro': row[2], 'reserva_vencida': row[3]} for row in results}
             
     except Exception as e:
         logger.error(f"Erro ao buscar status de processamento dos arquivos: {e}")
         raise
     finally:
         if conn:
-            conn.close()
+            release_connection(conn)
+
+# Colunas de transacoes copiadas para transacoes_current
+CURRENT_COLUMNS = [
+    'nsu_host_transacao', 'numero_parcela', 'file_id', 'data_transacao',
+    'tipo_lancamento', 'data_lancamento', 'valor_bruto_venda',
+    'valor_liquido_venda', 'numero_total_parcelas', 'valor_liquido_parcela',
+    'created_at'
+]
+
+def update_current_parcels(conn, file_id=None, schema='unica_transactions', parcels=None, replace=False):
+    """Leva para transacoes_current a linha mais recente de cada parcela do arquivo.
+
+    A linha existente só é substituída por uma com created_at igual ou maior
+    (reprocessar um arquivo antigo não volta o estado da parcela); a Previsão
+    mais recente do arquivo, se houver, atualiza data_prevista. Com `parcels`
+    (tabela com nsu_host_transacao, numero_parcela), considera todas as linhas
+    dessas parcelas; sem file_id nem parcels, percorre toda a transacoes
+    (reconstrução). Com `replace`, o cálculo prevalece sobre o que está gravado
+    (inclusive data_prevista), exceto uma linha mais nova de carga concorrente,
+    e só as parcelas diferentes são regravadas. Retorna o número de parcelas
+    gravadas.
+    """
+    filters = []
+    if file_id is not None:
+        filters.append("file_id = %(file_id)s")
+    if parcels is not None:
+        filters.append(
+            f"(nsu_host_transacao, numero_parcela) IN (SELECT nsu_host_transacao, numero_parcela FROM {parcels})"
+        )
+    file_filter = ' AND '.join(filters)
+    columns = ', '.join(CURRENT_COLUMNS)
+    updated_columns = ['transacao_id'] + CURRENT_COLUMNS[2:]
+    updates = ',\n            '.join(f"{column} = EXCLUDED.{column}" for column in updated_columns)
+    if replace:
+        updated_columns += ['data_prevista', 'previsao_at']
+        previsao_updates = """data_prevista = EXCLUDED.data_prevista,
+            previsao_at = EXCLUDED.previsao_at"""
+        # Linha gravada por uma carga concorrente (mais nova e ainda na transacoes) é mantida
+        guard = (f"({', '.join(f'c.{column}' for column in updated_columns)}) IS DISTINCT FROM "
+                 f"({', '.join(f'EXCLUDED.{column}' for column in updated_columns)})\n"
+                 f"      AND (EXCLUDED.created_at >= c.created_at\n"
+                 f"           OR NOT EXISTS (SELECT 1 FROM {schema}.transacoes t WHERE t.id = c.transacao_id))")
+    else:
+        previsao_updates = """data_prevista = CASE WHEN EXCLUDED.previsao_at IS NULL THEN c.data_prevista ELSE EXCLUDED.data_prevista END,
+            previsao_at = COALESCE(EXCLUDED.previsao_at, c.previsao_at)"""
+        guard = "EXCLUDED.created_at >= c.created_at"
+    query = f"""
+    WITH latest AS (
+        SELECT DISTINCT ON (nsu_host_transacao, numero_parcela) id AS transacao_id, {columns}
+        FROM {schema}.transacoes
+        {'WHERE ' + file_filter if file_filter else ''}
+        ORDER BY nsu_host_transacao, numero_parcela, created_at DESC
+    ),
+    previsao AS (
+        SELECT DISTINCT ON (nsu_host_transacao, numero_parcela)
+            nsu_host_transacao, numero_parcela, data_lancamento AS data_prevista, created_at AS previsao_at
+        FROM {schema}.transacoes
+        WHERE tipo_lancamento = 'Previsão' {'AND ' + file_filter if file_filter else ''}
+        ORDER BY nsu_host_transacao, numero_parcela, created_at DESC
+    )
+    INSERT INTO {schema}.transacoes_current AS c (transacao_id, {columns}, data_prevista, previsao_at)
+    SELECT l.transacao_id, {', '.join(f'l.{column}' for column in CURRENT_COLUMNS)}, p.data_prevista, p.previsao_at
+    FROM latest l
+    LEFT JOIN previsao p USING (nsu_host_transacao, numero_parcela)
+    ON CONFLICT (nsu_host_transacao, numero_parcela) DO UPDATE SET
+            {updates},
+            {previsao_updates}
+    WHERE {guard}
+    """
+    with conn.cursor() as cur:
+        cur.execute(query, {'file_id': file_id})
+        return cur.rowcount
 
 def delete_file_data(user: str, host: str, password: str, database: str, 
                     port: str, file_name: str, schema: str = 'unica_transactions') -> bool:
     conn = None
     try:
-        conn = psycopg2.connect(
-            host=host,
-            port=port,
-            user=user,
-            password=password,
-            database=database
-        )
+        conn = acquire_connection(dict(host=host, port=port, user=user, password=password, database=database))
         
         conn.autocommit = False
         
@@ -211,10 +514,31 @@ def delete_file_data(user: str, host: str, password: str, database: str,
                 
             file_id = result[0]
             
+            # Parcelas do arquivo: o estado atual delas é recalculado com as linhas que sobrarem
+            cur.execute(sql.SQL("""
+                CREATE TEMP TABLE parcelas_arquivo ON COMMIT DROP AS
+                SELECT DISTINCT nsu_host_transacao, numero_parcela
+                FROM {}.transacoes
+                WHERE file_id = %s
+            """).format(sql.Identifier(schema)), (file_id,))
+
             cur.execute(sql.SQL("""
                 DELETE FROM {}.transacoes 
                 WHERE file_id = %s
             """).format(sql.Identifier(schema)), (file_id,))
+
+            cur.execute(sql.SQL("""
+                DELETE FROM {}.transacoes_current
+                WHERE (nsu_host_transacao, numero_parcela) IN (
+                    SELECT nsu_host_transacao, numero_parcela FROM parcelas_arquivo
+                )
+            """).format(sql.Identifier(schema)))
+            update_current_parcels(conn, schema=schema, parcels='parcelas_arquivo')
+
+            cur.execute(sql.SQL("""
+                DELETE FROM {}.transacoes_quarentena
+                WHERE file_id = %s
+            """).format(sql.Identifier(schema)), (file_id,))
             
             cur.execute(sql.SQL("""
                 DELETE FROM {}.controle_arquivos 
@@ -222,6 +546,8 @@ def delete_file_data(user: str, host: str, password: str, database: str,
             """).format(sql.Identifier(schema)), (file_id,))
             
             conn.commit()
+            # Chaves de dimensão em cache podem ter sido apagadas junto (ex.: limpeza manual)
+            dimension_cache.reset()
             logger.info(f"Dados do arquivo {file_name} deletados com sucesso")
             return True
             
@@ -232,6 +558,6 @@ def delete_file_data(user: str, host: str, password: str, database: str,
         return False
     finally:
         if conn:
-            conn.close()
+            release_connection(conn)
 
 
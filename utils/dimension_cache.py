@@ -0,0 +1,92 @@
+"""
+Cache em memória das chaves já gravadas em cada dimensão.
+
+As chaves de cada tabela são lidas do banco uma única vez por processo (ou por
+container da Lambda, que reaproveita o módulo entre invocações). Cada arquivo
+abre uma DimensionKeys: as chaves que ele insere ficam pendentes e só passam
+para o cache compartilhado em commit(), chamado depois do commit da transação
+do arquivo. Se a transação for desfeita, as pendentes são descartadas junto.
+
+As dimensões só crescem. Linhas apagadas por fora (ex.: queries/delete_all.sql)
+deixam o cache desatualizado: delete_file_data chama reset(), e uma violação de
+chave estrangeira na carga de um arquivo também limpa o cache, para a próxima
+tentativa do arquivo recarregar as chaves do banco.
+"""
+
+import os
+import threading
+
+from psycopg2 import sql
+
+from utils.logger import setup_logger
+
+logger = setup_logger("dimension_cache")
+
+# 0 desliga o cache (todas as chaves do lote vão para o banco)
+CACHE_ENABLED = os.getenv('DIMENSION_CACHE', '1') != '0'
+
+_known = {}
+_lock = threading.Lock()
+
+
+def enabled():
+    return CACHE_ENABLED
+
+
+def reset():
+    """Descarta as chaves conhecidas; cada tabela é recarregada no próximo uso."""
+    with _lock:
+        _known.clear()
+
+
+def warm(conn, table, key_column, schema='unica_transactions'):
+    """Carrega as chaves de `table` na primeira vez em que a tabela é usada no processo."""
+    if not enabled() or table in _known:
+        return
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("SELECT {} FROM {}.{}").format(
+            sql.Identifier(key_column), sql.Identifier(schema), sql.Identifier(table)
+        ))
+        keys = {row[0] for row in cur.fetchall()}
+    with _lock:
+        _known.setdefault(table, keys)
+    logger.info(f"Cache de dimensão {table}: {len(keys)} chaves carregadas")
+
+
+class DimensionKeys:
+    """Visão do cache para um arquivo: chaves confirmadas + inseridas na transação atual."""
+
+    def __init__(self, conn, dimensions, schema='unica_transactions'):
+        self.pending = {}
+        for table, key_column in dimensions:
+            warm(conn, table, key_column, schema)
+            self.pending[table] = set()
+
+    def new_rows(self, df, table, key_column):
+        """Linhas de df (uma por chave) cuja chave ainda não está no banco nem na transação."""
+        df = df.drop_duplicates(subset=key_column)
+        if not enabled():
+            return df
+        pending = self.pending[table]
+        with _lock:
+            known = _known.get(table, set())
+            mask = [key not in known and key not in pending for key in df[key_column]]
+        return df[mask]
+
+    def add(self, table, keys):
+        """Chaves inseridas pela transação do arquivo (ainda não confirmadas)."""
+        if enabled():
+            self.pending[table].update(keys)
+
+    def commit(self):
+        """Publica as chaves pendentes; chamar só depois do commit no banco."""
+        if not enabled():
+            return
+        with _lock:
+            for table, keys in self.pending.items():
+                _known.setdefault(table, set()).update(keys)
+        self.rollback()
+
+    def rollback(self):
+        for keys in self.pending.values():
+            keys.clear()
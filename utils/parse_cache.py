@@ -0,0 +1,310 @@
+"""
+Cache em disco dos blocos já parseados e validados de um arquivo.
+
+A chave é o hash do conteúdo do arquivo + família/versão do layout + hash do
+código que define layouts e regras de validação (definitions_digest), então um
+arquivo reprocessado (ex.: status ERRO por falha no banco) com o mesmo
+conteúdo pula leitura e validação. Cada entrada é um diretório com um .npz
+por bloco (só arrays NumPy, lidos sem pickle: uma entrada vinda do espelho S3
+não executa código); o diretório só aparece depois que todos os blocos foram
+gravados. O tamanho total é limitado por LRU (mtime da entrada) e,
+opcionalmente, as entradas são espelhadas em um prefixo S3.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import time
+import uuid
+from typing import Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from utils.logger import setup_logger
+from utils.s3_utils import download_s3_file, upload_s3_file
+
+logger = setup_logger("parse_cache")
+
+# Incrementar quando o formato de gravação dos blocos mudar; mudanças no parser ou
+# nas regras de validação já trocam a chave por definitions_digest
+CACHE_FORMAT = 3
+
+if os.path.exists('/var/task'):  # Na Lambda só /tmp é gravável
+    _default_dir = os.path.join('/tmp', 'parse_cache')
+    # /tmp (512 MB por padrão) também guarda os arquivos baixados e os logs
+    _default_max_mb = '128'
+else:
+    _default_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'outputs', 'parse_cache')
+    _default_max_mb = '256'
+
+CACHE_DIR = os.getenv('PARSE_CACHE_DIR', _default_dir)
+# 0 desliga o cache
+CACHE_MAX_BYTES = int(os.getenv('PARSE_CACHE_MAX_MB', _default_max_mb)) * 1024 * 1024
+# Espelho opcional no bucket S3_BUCKET (ex.: parse_cache)
+CACHE_S3_BUCKET = os.getenv('S3_BUCKET')
+CACHE_S3_PREFIX = os.getenv('PARSE_CACHE_S3_PREFIX', '')
+
+MANIFEST = 'manifest.json'
+_HASH_BLOCK = 1 << 24
+# Diretório .tmp- sem alteração há mais que isso é de uma gravação interrompida
+STAGING_MAX_AGE = 3600
+
+
+def enabled() -> bool:
+    return CACHE_MAX_BYTES > 0
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 do conteúdo do arquivo, lido do mapeamento em memória."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+                view = memoryview(mapping)
+                for first in range(0, len(view), _HASH_BLOCK):
+                    digest.update(view[first:first + _HASH_BLOCK])
+                view.release()
+    return digest.hexdigest()
+
+
+def definitions_digest(*modules) -> str:
+    """Hash do código-fonte dos módulos que definem layout, parse e regras de validação."""
+    digest = hashlib.sha256()
+    for module in modules:
+        with open(module.__file__, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def make_key(digest: str, family: str, versao: str, definitions: str = '') -> str:
+    versao = ''.join(c if c.isalnum() else '_' for c in str(versao))
+    definitions = f"_{definitions}" if definitions else ''
+    return f"{digest}_{family}_{versao}{definitions}_v{CACHE_FORMAT}"
+
+
+def _entry_dir(key: str) -> str:
+    return os.path.join(CACHE_DIR, key)
+
+
+def _chunk_name(index: int) -> str:
+    return f"chunk_{index:05d}.npz"
+
+
+def _encode(series: pd.Series, prefix: str, arrays: dict) -> dict:
+    """Grava a coluna como arrays NumPy sem objetos em `arrays`; retorna a descrição para _decode."""
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        arrays[f"{prefix}codes"] = series.cat.codes.to_numpy()
+        categories = _encode(pd.Series(dtype.categories), f"{prefix}cat_", arrays)
+        return {'kind': 'category', 'ordered': bool(dtype.ordered), 'categories': categories}
+    if pd.api.types.is_extension_array_dtype(dtype) and dtype.kind in 'biuf':
+        # Int64, Float64, boolean: valores + máscara de nulos
+        arrays[f"{prefix}values"] = series.to_numpy(dtype=dtype.numpy_dtype, na_value=0)
+        arrays[f"{prefix}mask"] = series.isna().to_numpy()
+        return {'kind': 'masked', 'dtype': str(dtype)}
+    if dtype.kind in 'biufcmM':
+        arrays[f"{prefix}values"] = series.to_numpy()
+        return {'kind': 'numpy'}
+    # Texto (str, string ou object com str): unicode de largura fixa + máscara de nulos
+    mask = series.isna().to_numpy()
+    values = series.to_numpy(dtype=object, na_value='')
+    if not all(isinstance(value, str) for value in values):
+        raise TypeError(f"coluna {series.name!r} com valores que não são texto")
+    arrays[f"{prefix}values"] = values.astype(str)
+    arrays[f"{prefix}mask"] = mask
+    return {'kind': 'text', 'dtype': str(dtype)}
+
+
+def _decode(spec: dict, prefix: str, arrays) -> pd.Series:
+    kind = spec['kind']
+    if kind == 'category':
+        categories = _decode(spec['categories'], f"{prefix}cat_", arrays)
+        return pd.Series(pd.Categorical.from_codes(
+            arrays[f"{prefix}codes"], categories=categories, ordered=spec['ordered']
+        ))
+    if kind == 'masked':
+        array_type = pd.api.types.pandas_dtype(spec['dtype']).construct_array_type()
+        return pd.Series(array_type(arrays[f"{prefix}values"], arrays[f"{prefix}mask"]))
+    if kind == 'numpy':
+        return pd.Series(arrays[f"{prefix}values"])
+    values = arrays[f"{prefix}values"].astype(object)
+    values[arrays[f"{prefix}mask"]] = None
+    return pd.Series(values, dtype=spec['dtype'])
+
+
+def _write_chunk(path: str, df: pd.DataFrame) -> None:
+    arrays = {}
+    columns = [_encode(df[column], f"c{position}_", arrays) for position, column in enumerate(df.columns)]
+    if isinstance(df.index, pd.RangeIndex):
+        index = {'start': df.index.start, 'stop': df.index.stop, 'step': df.index.step}
+    else:
+        index = _encode(pd.Series(df.index), "i_", arrays)
+    meta = {'columns': [str(column) for column in df.columns], 'specs': columns, 'index': index}
+    arrays['meta'] = np.array(json.dumps(meta))
+    with open(path, 'wb') as f:
+        np.savez(f, **arrays)
+
+
+def _read_chunk(path: str) -> pd.DataFrame:
+    with np.load(path, allow_pickle=False) as arrays:
+        meta = json.loads(str(arrays['meta']))
+        data = {
+            column: _decode(spec, f"c{position}_", arrays)
+            for position, (column, spec) in enumerate(zip(meta['columns'], meta['specs']))
+        }
+        index = meta['index']
+        if 'kind' in index:
+            index = pd.Index(_decode(index, "i_", arrays))
+        else:
+            index = pd.RangeIndex(index['start'], index['stop'], index['step'])
+    df = pd.DataFrame(data, columns=meta['columns'])
+    df.index = index
+    return df
+
+
+def _s3_key(key: str, name: str) -> str:
+    return f"{CACHE_S3_PREFIX.strip('/')}/{key}/{name}".lstrip('/')
+
+
+def _fetch_from_s3(key: str) -> bool:
+    """Traz do espelho S3 uma entrada ausente localmente."""
+    if not (CACHE_S3_PREFIX and CACHE_S3_BUCKET):
+        return False
+    staging = _entry_dir(key) + f".tmp-{uuid.uuid4().hex}"
+    try:
+        manifest_path = os.path.join(staging, MANIFEST)
+        if not download_s3_file(CACHE_S3_BUCKET, _s3_key(key, MANIFEST), manifest_path):
+            return False
+        with open(manifest_path) as f:
+            chunks = json.load(f)['chunks']
+        for index in range(chunks):
+            name = _chunk_name(index)
+            if not download_s3_file(CACHE_S3_BUCKET, _s3_key(key, name), os.path.join(staging, name)):
+                return False
+        os.replace(staging, _entry_dir(key))
+        logger.info(f"Entrada {key} recuperada do espelho S3")
+        return True
+    except OSError as e:
+        logger.warning(f"Falha ao recuperar {key} do espelho S3: {e}")
+        return False
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def load(key: str) -> Optional[Iterator[pd.DataFrame]]:
+    """Blocos da entrada `key` (em ordem), ou None se não estiver em cache."""
+    if not enabled():
+        return None
+    entry = _entry_dir(key)
+    if not os.path.isdir(entry) and not _fetch_from_s3(key):
+        return None
+    try:
+        with open(os.path.join(entry, MANIFEST)) as f:
+            chunks = json.load(f)['chunks']
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Entrada de cache inválida {key}: {e}")
+        shutil.rmtree(entry, ignore_errors=True)
+        return None
+
+    os.utime(entry)  # marca como usada (LRU)
+    logger.info(f"Usando {chunks} blocos do cache para {key}")
+    return (_read_chunk(os.path.join(entry, _chunk_name(index))) for index in range(chunks))
+
+
+class CacheWriter:
+    """Grava os blocos de uma entrada; a entrada só é publicada em commit()."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.chunks = 0
+        self.staging = _entry_dir(key) + f".tmp-{uuid.uuid4().hex}" if enabled() else None
+        if self.staging:
+            os.makedirs(self.staging, exist_ok=True)
+
+    def add(self, df: pd.DataFrame) -> None:
+        if not self.staging:
+            return
+        try:
+            _write_chunk(os.path.join(self.staging, _chunk_name(self.chunks)), df)
+        except (TypeError, ValueError) as e:
+            # Bloco que não cabe no formato do cache: o arquivo segue sem cache
+            logger.warning(f"Entrada {self.key} não será gravada no cache: {e}")
+            self.discard()
+            return
+        self.chunks += 1
+
+    def discard(self) -> None:
+        if self.staging:
+            shutil.rmtree(self.staging, ignore_errors=True)
+            self.staging = None
+
+    def commit(self) -> None:
+        if not self.staging:
+            return
+        with open(os.path.join(self.staging, MANIFEST), 'w') as f:
+            json.dump({'chunks': self.chunks, 'format': CACHE_FORMAT}, f)
+
+        entry = _entry_dir(self.key)
+        try:
+            os.replace(self.staging, entry)
+        except OSError:
+            # Outro processo publicou a mesma entrada antes
+            self.discard()
+            return
+        self.staging = None
+        logger.info(f"Entrada {self.key} gravada no cache ({self.chunks} blocos)")
+
+        _mirror_to_s3(self.key, entry, self.chunks)
+        evict()
+
+
+def _mirror_to_s3(key: str, entry: str, chunks: int) -> None:
+    if not (CACHE_S3_PREFIX and CACHE_S3_BUCKET):
+        return
+    # Manifesto por último: sem ele a entrada não é considerada no espelho
+    names = [_chunk_name(index) for index in range(chunks)] + [MANIFEST]
+    for name in names:
+        if not upload_s3_file(CACHE_S3_BUCKET, _s3_key(key, name), os.path.join(entry, name)):
+            logger.warning(f"Espelho S3 incompleto para {key}")
+            return
+
+
+def _entry_size(entry: str) -> int:
+    return sum(e.stat().st_size for e in os.scandir(entry) if e.is_file())
+
+
+def evict(max_bytes: Optional[int] = None) -> List[str]:
+    """Remove as entradas menos usadas até o cache caber em max_bytes.
+
+    Diretórios .tmp- de gravações interrompidas (processo morto no meio de uma
+    entrada) são removidos depois de STAGING_MAX_AGE segundos sem alteração.
+    """
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    if not os.path.isdir(CACHE_DIR):
+        return []
+
+    removed = []
+    entries = []
+    stale_before = time.time() - STAGING_MAX_AGE
+    for e in os.scandir(CACHE_DIR):
+        if not e.is_dir():
+            continue
+        if '.tmp-' in e.name:
+            if e.stat().st_mtime < stale_before:
+                shutil.rmtree(e.path, ignore_errors=True)
+                removed.append(e.name)
+            continue
+        entries.append((e.stat().st_mtime, _entry_size(e.path), e.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        removed.append(os.path.basename(path))
+    if removed:
+        logger.info(f"{len(removed)} entradas removidas do cache (LRU e gravações interrompidas)")
+    return removed
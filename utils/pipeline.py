@@ -0,0 +1,124 @@
+"""
+Estágios de processamento ligados por filas limitadas.
+
+Cada estágio roda em sua própria thread e conversa com o seguinte por um
+Channel (queue.Queue com maxsize): quem produz bloqueia quando a fila enche,
+então os estágios se sobrepõem sem que um estágio rápido acumule dados em
+memória. O tempo bloqueado em cada fila é contado no StageStats de quem
+esperou; o restante do tempo do estágio é trabalho.
+"""
+
+import queue
+import threading
+import time
+
+from utils.logger import setup_logger
+
+logger = setup_logger("pipeline")
+
+_DONE = object()
+
+
+class StageStats:
+    """Tempos de um estágio: total, parado em filas e itens (arquivos) concluídos."""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = None
+        self.finished = None
+        self.waiting = 0.0
+        self.items = 0
+
+    def start(self):
+        self.started = time.perf_counter()
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def busy(self):
+        return max(self.elapsed - self.waiting, 0.0)
+
+    def __str__(self):
+        return (f"{self.name}: {self.items} itens, {self.busy:.2f}s trabalhando, "
+                f"{self.waiting:.2f}s esperando fila ({self.elapsed:.2f}s no total)")
+
+
+class Channel:
+    """Fila limitada entre dois estágios; o tempo bloqueado vai para o stats de cada lado.
+
+    Uma exceção enviada com fail() é relançada para quem consome, na posição
+    em que aconteceu.
+    """
+
+    def __init__(self, maxsize, producer=None, consumer=None):
+        self.queue = queue.Queue(maxsize=max(1, maxsize))
+        self.producer = producer
+        self.consumer = consumer
+        self.closed = False
+
+    def _timed(self, stats, call, *args):
+        started = time.perf_counter()
+        try:
+            return call(*args)
+        finally:
+            if stats is not None:
+                stats.waiting += time.perf_counter() - started
+
+    def put(self, item):
+        self._timed(self.producer, self.queue.put, item)
+
+    def fail(self, error):
+        self._timed(self.producer, self.queue.put, _Failure(error))
+
+    def close(self):
+        self._timed(self.producer, self.queue.put, _DONE)
+
+    def __iter__(self):
+        while not self.closed:
+            item = self._timed(self.consumer, self.queue.get)
+            if item is _DONE:
+                self.closed = True
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+
+    def drain(self):
+        """Descarta o que faltou consumir, liberando o produtor até o close()."""
+        while not self.closed:
+            item = self._timed(self.consumer, self.queue.get)
+            if item is _DONE:
+                self.closed = True
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+def start_stage(stats, target, output, *args):
+    """Roda target(output, *args) em uma thread daemon e fecha output ao final.
+
+    Um erro inesperado encerra o estágio (o consumidor vê a fila fechada em
+    vez de ficar bloqueado esperando).
+    """
+    def run():
+        stats.start()
+        try:
+            target(output, *args)
+        except Exception as e:
+            logger.error(f"Estágio {stats.name} interrompido: {e}")
+        finally:
+            output.close()
+            stats.finish()
+
+    thread = threading.Thread(target=run, name=f"stage-{stats.name}", daemon=True)
+    thread.start()
+    return thread